@@ -0,0 +1,1253 @@
+"""A local stand-in for the Shortcut REST API, for running and benchmarking
+the cookbook's recipes offline.
+
+Serves an in-memory, seeded workspace over the v3 (also reachable as
+/api/beta) and v4 endpoints the recipes use, with configurable latency,
+rate limiting, and injected HTTP 429 responses. Point a recipe at it with:
+
+    export SHORTCUT_API_BASE_URL=http://127.0.0.1:8765
+    export SHORTCUT_API_TOKEN=simulated
+    export SHORTCUT_WORKSPACE_SLUG=simulated
+
+Uses only the Python standard library.
+"""
+
+import argparse
+import base64
+import collections
+import hashlib
+import itertools
+import json
+import logging
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+parser = argparse.ArgumentParser(
+    description="Serves a simulated Shortcut API workspace for offline runs and benchmarks",
+)
+parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+parser.add_argument(
+    "--port", type=int, default=8765, help="Port to listen on (default: %(default)s)"
+)
+parser.add_argument(
+    "--stories",
+    type=int,
+    default=200,
+    help="Number of stories to seed the workspace with (default: %(default)s)",
+)
+parser.add_argument(
+    "--seed", type=int, default=1, help="Random seed for the workspace and faults"
+)
+parser.add_argument(
+    "--latency-ms",
+    type=float,
+    default=0,
+    help="Time each response is delayed by, in milliseconds (default: %(default)s)",
+)
+parser.add_argument(
+    "--jitter-ms",
+    type=float,
+    default=0,
+    help="Maximum random variation of the latency, in milliseconds (default: %(default)s)",
+)
+parser.add_argument(
+    "--rate-limit",
+    type=int,
+    default=200,
+    help="Requests allowed per token per minute before responding 429; 0 disables (default: %(default)s)",
+)
+parser.add_argument(
+    "--throttle-rate",
+    type=float,
+    default=0,
+    help="Fraction of requests answered with an injected 429 (default: %(default)s)",
+)
+parser.add_argument(
+    "--retry-after",
+    type=int,
+    default=1,
+    help="Retry-After seconds sent with injected 429 responses (default: %(default)s)",
+)
+parser.add_argument("--debug", action="store_true", help="Turns on debugging logs")
+
+# Logging
+logger = logging.getLogger(__name__)
+
+"""The default and maximum page sizes of paginated v4 lists and v3 search"""
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+SEARCH_PAGE_SIZE = 25
+
+"""The states of the seeded "Standard" workflow, in order, with their types"""
+STANDARD_WORKFLOW_STATES = [
+    ("Backlog", "backlog"),
+    ("To Do", "unstarted"),
+    ("In Progress", "started"),
+    ("In Review", "started"),
+    ("Done", "done"),
+]
+
+STORY_TYPES = ["feature", "bug", "chore"]
+
+
+class ApiError(Exception):
+    """An error response, with the status code and message to send."""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+def iso(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class Workspace:
+    """
+    The in-memory state of a simulated workspace. Entities are stored as
+    v3-shaped dicts; v4 responses are built from them on the way out.
+    All access goes through `lock`.
+    """
+
+    def __init__(self, stories=200, seed=1, slug="simulated", now=None):
+        self.lock = threading.RLock()
+        self.slug = slug
+        self.now = now or datetime.now(timezone.utc).replace(microsecond=0)
+        self.rng = random.Random(seed)
+        self._ids = itertools.count(1000)
+        self.members = []
+        self.groups = []
+        self.workflows = []
+        self.custom_fields = []
+        self.labels = {}
+        self.epics = {}
+        self.iterations = {}
+        self.stories = {}
+        self.files = {}
+        self.story_comments = collections.defaultdict(list)
+        self.epic_comments = collections.defaultdict(list)
+        self.histories = collections.defaultdict(list)
+        self.tokens = {}
+        self.seed(stories)
+
+    def next_id(self):
+        return next(self._ids)
+
+    def app_url(self, kind, entity_id):
+        return f"https://app.shortcut.com/{self.slug}/{kind}/{entity_id}"
+
+    # Seeding
+
+    def seed(self, story_count):
+        rng = self.rng
+        names = ["Ada Lovelace", "Alan Turing", "Grace Hopper", "Edsger Dijkstra"]
+        names += ["Barbara Liskov", "Donald Knuth", "Frances Allen", "Ken Thompson"]
+        for name in names:
+            first, last = name.lower().split()
+            self.members.append(
+                {
+                    "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                    "role": "admin" if not self.members else "member",
+                    "state": "full",
+                    "disabled": False,
+                    "profile": {
+                        "name": name,
+                        "mention_name": f"{first}{last[0]}",
+                        "email_address": f"{first}.{last}@example.com",
+                    },
+                }
+            )
+        for name in ["Team 1", "Platform", "Mobile"]:
+            self.groups.append(
+                {
+                    "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                    "name": name,
+                    "mention_name": name.lower().replace(" ", "-"),
+                    "archived": False,
+                    "member_ids": [m["id"] for m in self.members],
+                }
+            )
+        workflow_id = self.next_id()
+        self.workflows.append(
+            {
+                "id": workflow_id,
+                "name": "Standard",
+                "default_state_id": None,
+                "states": [
+                    {
+                        "id": self.next_id(),
+                        "name": name,
+                        "type": state_type,
+                        "position": position,
+                    }
+                    for position, (name, state_type) in enumerate(
+                        STANDARD_WORKFLOW_STATES
+                    )
+                ],
+            }
+        )
+        self.workflows[0]["default_state_id"] = self.workflows[0]["states"][1]["id"]
+        self.custom_fields.append(
+            {
+                "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "name": "Priority",
+                "canonical_name": "priority",
+                "enabled": True,
+                "values": [
+                    {
+                        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                        "value": value,
+                        "position": position,
+                    }
+                    for position, value in enumerate(
+                        ["Highest", "High", "Medium", "Low"]
+                    )
+                ],
+            }
+        )
+        for i in range(5):
+            self.create_label({"name": f"label-{i}"})
+        for i in range(max(1, story_count // 20)):
+            self.create_epic({"name": f"Epic {i}"})
+        iteration_ids = []
+        for i in range(6):
+            start = (self.now - timedelta(weeks=2 * (5 - i))).date()
+            iteration = self.create_iteration(
+                {
+                    "name": f"Sprint {i + 1}",
+                    "start_date": start.isoformat(),
+                    "end_date": (start + timedelta(days=13)).isoformat(),
+                    "group_ids": [self.groups[i % len(self.groups)]["id"]],
+                }
+            )
+            iteration_ids.append(iteration["id"])
+        states = self.workflows[0]["states"]
+        for i in range(story_count):
+            # Stories in later iterations may have rolled over from earlier ones.
+            iteration = rng.randrange(len(iteration_ids))
+            rollovers = rng.randrange(3)
+            previous = iteration_ids[max(0, iteration - rollovers) : iteration]
+            story = self.create_story(
+                {
+                    "name": f"Story {i}",
+                    "story_type": rng.choice(STORY_TYPES),
+                    "epic_id": rng.choice([None, *self.epics]),
+                    "iteration_id": iteration_ids[iteration],
+                    "group_id": rng.choice(self.groups)["id"],
+                    "owner_ids": [rng.choice(self.members)["id"]],
+                    "labels": [
+                        {"name": rng.choice(list(self.labels.values()))["name"]}
+                    ],
+                    "workflow_state_id": states[1]["id"],
+                    "deadline": iso(self.now + timedelta(days=rng.randrange(60))),
+                },
+                created_at=self.now - timedelta(days=60, minutes=i),
+            )
+            story["previous_iteration_ids"] = previous
+            # Move the story along the workflow, recording its history.
+            changed_at = datetime.fromisoformat(
+                story["created_at"].replace("Z", "+00:00")
+            )
+            for state in states[2 : 2 + rng.randrange(len(states) - 1)]:
+                changed_at += timedelta(hours=rng.randrange(1, 96))
+                self.update_story(
+                    story["id"], {"workflow_state_id": state["id"]}, changed_at
+                )
+            for c in range(rng.randrange(4)):
+                self.add_story_comment(story["id"], f"Comment {c} on story {i}")
+        for epic_id in list(self.epics)[:3]:
+            for c in range(2):
+                comment = self.add_epic_comment(epic_id, f"Comment {c}")
+                comment["comments"].append(self.new_comment("A reply"))
+        for i in range(30):
+            member = self.members[i % len(self.members)]
+            token_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            self.tokens[token_id] = {
+                "id": token_id,
+                "description": f"Token {i}",
+                "disabled": i % 7 == 0,
+                "scopes": ["admin"] if i % 3 == 0 else [],
+                "created_at": iso(self.now - timedelta(days=100 - i)),
+                "last_used_at": iso(self.now - timedelta(days=i)) if i % 4 else None,
+                "member": {"id": member["id"], "name": member["profile"]["name"]},
+                "email_address": member["profile"]["email_address"],
+            }
+
+    # Entities
+
+    def get(self, collection, entity_id, kind):
+        try:
+            return collection[int(entity_id)]
+        except (KeyError, ValueError):
+            raise ApiError(404, f"{kind} {entity_id} not found")
+
+    def create_label(self, data):
+        if not data.get("name"):
+            raise ApiError(400, "A label needs a name")
+        label_id = self.next_id()
+        label = {
+            "id": label_id,
+            "name": data["name"],
+            "color": data.get("color"),
+            "description": data.get("description"),
+            "archived": False,
+            "created_at": iso(self.now),
+            "app_url": self.app_url("label", label_id),
+        }
+        self.labels[label_id] = label
+        return label
+
+    def label_ids(self, labels):
+        """Return the IDs of the labels named in `labels`, creating any new ones."""
+        by_name = {label["name"]: label["id"] for label in self.labels.values()}
+        ids = []
+        for label in labels or []:
+            if label["name"] not in by_name:
+                by_name[label["name"]] = self.create_label(label)["id"]
+            ids.append(by_name[label["name"]])
+        return ids
+
+    def create_epic(self, data):
+        if not data.get("name"):
+            raise ApiError(400, "An epic needs a name")
+        epic_id = self.next_id()
+        epic = {
+            **data,
+            "id": epic_id,
+            "entity_type": "epic",
+            "label_ids": self.label_ids(data.get("labels")),
+            "completed": False,
+            "archived": False,
+            "created_at": iso(self.now),
+            "app_url": self.app_url("epic", epic_id),
+        }
+        epic.pop("labels", None)
+        self.epics[epic_id] = epic
+        return epic
+
+    def create_iteration(self, data):
+        missing = [k for k in ("name", "start_date", "end_date") if not data.get(k)]
+        if missing:
+            raise ApiError(400, f"An iteration needs {', '.join(missing)}")
+        iteration_id = self.next_id()
+        iteration = {
+            **data,
+            "id": iteration_id,
+            "entity_type": "iteration",
+            "label_ids": self.label_ids(data.get("labels")),
+            "status": (
+                "done" if data["end_date"] < self.now.date().isoformat() else "started"
+            ),
+            "app_url": self.app_url("iteration", iteration_id),
+        }
+        iteration.pop("labels", None)
+        self.iterations[iteration_id] = iteration
+        return iteration
+
+    def state(self, state_id):
+        for workflow in self.workflows:
+            for state in workflow["states"]:
+                if state["id"] == state_id:
+                    return state
+        raise ApiError(400, f"Workflow state {state_id} not found")
+
+    def create_story(self, data, created_at=None):
+        if not data.get("name"):
+            raise ApiError(400, "A story needs a name")
+        if data.get("epic_id") is not None and data["epic_id"] not in self.epics:
+            raise ApiError(400, f"Epic {data['epic_id']} not found")
+        if (
+            data.get("iteration_id") is not None
+            and data["iteration_id"] not in self.iterations
+        ):
+            raise ApiError(400, f"Iteration {data['iteration_id']} not found")
+        state_id = (
+            data.get("workflow_state_id") or self.workflows[0]["default_state_id"]
+        )
+        state = self.state(state_id)
+        created_at = iso(created_at or self.now)
+        story_id = self.next_id()
+        story = {
+            **data,
+            "id": story_id,
+            "entity_type": "story",
+            "story_type": data.get("story_type", "feature"),
+            "workflow_state_id": state_id,
+            "label_ids": self.label_ids(data.get("labels")),
+            "owner_ids": data.get("owner_ids", []),
+            "file_ids": data.get("file_ids", []),
+            "previous_iteration_ids": [],
+            "archived": False,
+            "created_at": data.get("created_at", created_at),
+            "updated_at": data.get("updated_at", created_at),
+            "app_url": self.app_url("story", story_id),
+        }
+        story.pop("labels", None)
+        story.pop("comments", None)
+        self.stories[story_id] = story
+        self.update_progress(story, state)
+        self.histories[story_id].append(
+            {
+                "id": str(uuid.UUID(int=self.rng.getrandbits(128))),
+                "changed_at": story["created_at"],
+                "member_id": (story["owner_ids"] or [None])[0],
+                "actions": [
+                    {
+                        "id": story_id,
+                        "entity_type": "story",
+                        "action": "create",
+                        "name": story["name"],
+                        "story_type": story["story_type"],
+                        "workflow_state_id": state_id,
+                    }
+                ],
+            }
+        )
+        for comment in data.get("comments") or []:
+            self.add_story_comment(story_id, comment.get("text", ""))
+        return story
+
+    def update_progress(self, story, state):
+        story["started"] = state["type"] in ("started", "done")
+        story["completed"] = state["type"] == "done"
+        if story["started"]:
+            story.setdefault("started_at", story["updated_at"])
+        if story["completed"]:
+            story["completed_at"] = story["updated_at"]
+
+    def update_story(self, story_id, data, changed_at=None):
+        story = self.get(self.stories, story_id, "Story")
+        changes = {
+            k: {"old": story.get(k), "new": v}
+            for k, v in data.items()
+            if story.get(k) != v
+        }
+        story.update(data)
+        story["updated_at"] = iso(changed_at or self.now)
+        if "workflow_state_id" in changes:
+            self.update_progress(story, self.state(story["workflow_state_id"]))
+        if changes:
+            self.histories[story["id"]].append(
+                {
+                    "id": str(uuid.UUID(int=self.rng.getrandbits(128))),
+                    "changed_at": story["updated_at"],
+                    "member_id": (story["owner_ids"] or [None])[0],
+                    "actions": [
+                        {
+                            "id": story["id"],
+                            "entity_type": "story",
+                            "action": "update",
+                            "changes": changes,
+                        }
+                    ],
+                }
+            )
+        return story
+
+    def new_comment(self, text):
+        author = self.rng.choice(self.members)
+        return {
+            "id": self.next_id(),
+            "text": text,
+            "author_id": author["id"],
+            "created_at": iso(self.now),
+            "comments": [],
+        }
+
+    def add_story_comment(self, story_id, text):
+        comment = self.new_comment(text)
+        del comment["comments"]
+        self.story_comments[int(story_id)].append(comment)
+        return comment
+
+    def add_epic_comment(self, epic_id, text):
+        comment = self.new_comment(text)
+        self.epic_comments[int(epic_id)].append(comment)
+        return comment
+
+    def create_file(self, name, size):
+        file_id = self.next_id()
+        entity = {
+            "id": file_id,
+            "entity_type": "file",
+            "name": name,
+            "filename": name,
+            "size": size,
+            "created_at": iso(self.now),
+            "url": f"https://media.app.shortcut.com/{self.slug}/{file_id}/{name}",
+        }
+        self.files[file_id] = entity
+        return entity
+
+    def delete(self, collection, entity_id, kind):
+        entity = self.get(collection, entity_id, kind)
+        del collection[entity["id"]]
+
+    def delete_stories(self, story_ids):
+        missing = [i for i in story_ids if i not in self.stories]
+        if missing:
+            raise ApiError(404, f"Stories not found: {missing}")
+        for story_id in story_ids:
+            del self.stories[story_id]
+
+    # v4 representations
+
+    def member_summary(self, member_id):
+        for member in self.members:
+            if member["id"] == member_id:
+                return {"id": member_id, "name": member["profile"]["name"]}
+        return {"id": member_id, "name": None}
+
+    def v4_story(self, story, base_url):
+        state = self.state(story["workflow_state_id"])
+        comments = self.story_comments.get(story["id"], [])
+        return {
+            **{k: v for k, v in story.items() if k not in ("owner_ids", "label_ids")},
+            "workflow_state": {"id": state["id"], "name": state["name"]},
+            "owners": {
+                "total_items": len(story["owner_ids"]),
+                "entities": [self.member_summary(m) for m in story["owner_ids"]],
+            },
+            "labels": [
+                {"id": i, "name": self.labels[i]["name"]}
+                for i in story["label_ids"]
+                if i in self.labels
+            ],
+            "comments": {
+                "total_items": len(comments),
+                "list_url": f"{base_url}/stories/{story['id']}/comments",
+            },
+        }
+
+    def v4_comment(self, comment):
+        return {
+            "id": comment["id"],
+            "text": comment["text"],
+            "author": self.member_summary(comment["author_id"]),
+            "created_at": comment["created_at"],
+        }
+
+
+def story_matches(workspace, story, query):
+    """
+    Return whether `story` matches a search `query`, supporting the
+    `type:`, `state:`, `label:`, `epic:`, `iteration:`, `is:` (done,
+    started, unstarted, archived) and `!` (negated) operators; other terms
+    match the story's name.
+    """
+    for negated, key, value in re.findall(r'(!?)(?:(\w+):)?("[^"]*"|\S+)', query):
+        value = value.strip('"').lower()
+        state = workspace.state(story["workflow_state_id"])
+        if key == "type":
+            match = story["story_type"] == value
+        elif key == "state":
+            match = state["name"].lower() == value
+        elif key == "label":
+            match = any(
+                workspace.labels[i]["name"].lower() == value
+                for i in story["label_ids"]
+                if i in workspace.labels
+            )
+        elif key == "epic":
+            match = str(story.get("epic_id")) == value
+        elif key == "iteration":
+            match = str(story.get("iteration_id")) == value
+        elif key == "is":
+            match = (
+                story.get("archived") if value == "archived" else state["type"] == value
+            )
+        else:
+            match = value in story["name"].lower()
+        if bool(match) == bool(negated):
+            return False
+    return True
+
+
+def encode_cursor(state):
+    return base64.urlsafe_b64encode(json.dumps(state).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except ValueError:
+        raise ApiError(400, "Invalid cursor")
+
+
+class SlidingWindowLimiter:
+    """Allow up to `limit` requests per token in any 60 second window."""
+
+    def __init__(self, limit, clock=time.monotonic):
+        self.limit = limit
+        self.clock = clock
+        self.windows = collections.defaultdict(collections.deque)
+        self.lock = threading.Lock()
+
+    def check(self, token):
+        """
+        Return (allowed, remaining, seconds until the window has room).
+        """
+        now = self.clock()
+        with self.lock:
+            window = self.windows[token]
+            while window and now - window[0] >= 60:
+                window.popleft()
+            if self.limit and len(window) >= self.limit:
+                return False, 0, 60 - (now - window[0])
+            window.append(now)
+            reset = 60 - (now - window[0])
+            return True, max(0, self.limit - len(window)), reset
+
+
+class SimulatorStats:
+    """Counts of the requests served, by route and by status code."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.by_route = collections.Counter()
+        self.by_status = collections.Counter()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.throttled = 0
+            self.by_route.clear()
+            self.by_status.clear()
+
+    def record(self, route, status_code):
+        with self.lock:
+            self.requests += 1
+            self.by_route[route] += 1
+            self.by_status[str(status_code)] += 1
+            if status_code == 429:
+                self.throttled += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "by_route": dict(self.by_route),
+                "by_status": dict(self.by_status),
+            }
+
+
+class Route:
+    def __init__(self, method, pattern, handler):
+        self.method = method
+        self.pattern = pattern
+        self.regex = re.compile(
+            "^" + re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", pattern) + "$"
+        )
+        self.handler = handler
+
+
+class ApiSimulator:
+    """
+    The simulated API: a workspace, the v3 and v4 routes that serve it,
+    and the latency, rate limiting and fault injection wrapped around them.
+
+    Use `serve()` to run it in the foreground, or use it as a context
+    manager to run it on a background thread, e.g. from a test:
+
+        with ApiSimulator(port=0) as simulator:
+            requests.get(simulator.url + "/api/v3/groups", headers=...)
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=8765,
+        stories=200,
+        seed=1,
+        latency_ms=0,
+        jitter_ms=0,
+        rate_limit=200,
+        throttle_rate=0,
+        retry_after=1,
+        slug="simulated",
+    ):
+        self.workspace = Workspace(stories=stories, seed=seed, slug=slug)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.limiter = SlidingWindowLimiter(rate_limit)
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.fault_rng = random.Random(seed)
+        self.fault_lock = threading.Lock()
+        self.stats = SimulatorStats()
+        self.v3_routes = [
+            Route("GET", "/member", self.get_member),
+            Route("GET", "/members", self.list_members),
+            Route("GET", "/groups", lambda r: self.workspace.groups),
+            Route("GET", "/workflows", lambda r: self.workspace.workflows),
+            Route("GET", "/workflows/{id}", self.get_workflow),
+            Route("GET", "/custom-fields", lambda r: self.workspace.custom_fields),
+            Route("GET", "/custom-fields/{id}", self.get_custom_field),
+            Route("GET", "/labels", self.list_labels),
+            Route(
+                "POST",
+                "/labels",
+                lambda r: self.created(self.workspace.create_label(r.json())),
+            ),
+            Route("PUT", "/labels/{id}", self.update_label),
+            Route("DELETE", "/labels/{id}", self.deleter("labels", "Label")),
+            Route("GET", "/labels/{id}/stories", self.label_stories),
+            Route("GET", "/labels/{id}/epics", self.label_epics),
+            Route("GET", "/epics", lambda r: list(self.workspace.epics.values())),
+            Route(
+                "POST",
+                "/epics",
+                lambda r: self.created(self.workspace.create_epic(r.json())),
+            ),
+            Route(
+                "GET",
+                "/epics/{id}",
+                lambda r: self.workspace.get(
+                    self.workspace.epics, r.params["id"], "Epic"
+                ),
+            ),
+            Route("DELETE", "/epics/{id}", self.deleter("epics", "Epic")),
+            Route("GET", "/epics/{id}/comments", self.epic_comments),
+            Route("GET", "/iterations", self.list_iterations),
+            Route(
+                "POST",
+                "/iterations",
+                lambda r: self.created(self.workspace.create_iteration(r.json())),
+            ),
+            Route(
+                "GET",
+                "/iterations/{id}",
+                lambda r: self.workspace.get(
+                    self.workspace.iterations, r.params["id"], "Iteration"
+                ),
+            ),
+            Route(
+                "DELETE", "/iterations/{id}", self.deleter("iterations", "Iteration")
+            ),
+            Route("GET", "/iterations/{id}/stories", self.iteration_stories),
+            Route(
+                "POST",
+                "/stories",
+                lambda r: self.created(self.workspace.create_story(r.json())),
+            ),
+            Route("POST", "/stories/bulk", self.create_stories),
+            Route("DELETE", "/stories/bulk", self.delete_stories),
+            Route("POST", "/stories/search", self.search_stories_v3_post),
+            Route(
+                "GET",
+                "/stories/{id}",
+                lambda r: self.workspace.get(
+                    self.workspace.stories, r.params["id"], "Story"
+                ),
+            ),
+            Route(
+                "PUT",
+                "/stories/{id}",
+                lambda r: self.workspace.update_story(r.params["id"], r.json()),
+            ),
+            Route("DELETE", "/stories/{id}", self.deleter("stories", "Story")),
+            Route("GET", "/stories/{id}/history", self.story_history),
+            Route("GET", "/search/stories", self.search_stories),
+            Route("POST", "/files", self.upload_files),
+            Route("DELETE", "/files/{id}", self.deleter("files", "File")),
+        ]
+        self.v4_routes = [
+            Route("GET", "/epics/{id}", self.v4_epic),
+            Route("GET", "/epics/{id}/stories", self.v4_epic_stories),
+            Route("GET", "/stories/{id}", self.v4_story),
+            Route("GET", "/stories/{id}/comments", self.v4_story_comments),
+            Route("GET", "/workflow-states/{id}/stories", self.v4_state_stories),
+            Route("GET", "/admin/tokens", self.v4_admin_tokens),
+            Route("DELETE", "/admin/tokens/{id}", self.v4_delete_admin_token),
+        ]
+        self.server = ThreadingHTTPServer((host, port), make_handler(self))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve(self):
+        logger.info("Serving the simulated Shortcut API at %s", self.url)
+        self.server.serve_forever()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+        return False
+
+    # Request handling
+
+    def dispatch(self, request):
+        """Return (status code, body, extra headers) for `request`."""
+        path = request.path
+        if path.startswith("/api/v3/") or path.startswith("/api/beta/"):
+            routes, path = self.v3_routes, "/" + path.split("/", 3)[3]
+            request.base_url = f"{self.url}/api/v3"
+        elif path.startswith(f"/api/v4/{self.workspace.slug}/"):
+            routes, path = self.v4_routes, path[len(f"/api/v4/{self.workspace.slug}") :]
+            request.base_url = f"{self.url}/api/v4/{self.workspace.slug}"
+        else:
+            raise ApiError(404, f"No such endpoint: {request.path}")
+        for route in routes:
+            match = route.regex.match(path)
+            if match and route.method == request.method:
+                request.route = (
+                    f"{request.method} {request.path[: -len(path)]}{route.pattern}"
+                )
+                request.params = match.groupdict()
+                with self.workspace.lock:
+                    result = route.handler(request)
+                if isinstance(result, tuple):
+                    return result
+                return 200, result
+        raise ApiError(404, f"No such endpoint: {request.method} {request.path}")
+
+    def delay(self):
+        if not (self.latency_ms or self.jitter_ms):
+            return
+        with self.fault_lock:
+            jitter = self.fault_rng.uniform(-self.jitter_ms, self.jitter_ms)
+        time.sleep(max(0.0, self.latency_ms + jitter) / 1000)
+
+    def throttle(self, token):
+        """Return the headers of a 429 response if `token` is throttled."""
+        allowed, remaining, reset = self.limiter.check(token)
+        rate_headers = {}
+        if self.limiter.limit:
+            rate_headers = {
+                "X-RateLimit-Limit": str(self.limiter.limit),
+                "X-RateLimit-Remaining": str(remaining),
+                "X-RateLimit-Reset": str(math.ceil(reset)),
+            }
+        if not allowed:
+            return rate_headers | {"Retry-After": str(math.ceil(reset))}, rate_headers
+        with self.fault_lock:
+            injected = self.fault_rng.random() < self.throttle_rate
+        if injected:
+            return rate_headers | {"Retry-After": str(self.retry_after)}, rate_headers
+        return None, rate_headers
+
+    # v3 handlers
+
+    def created(self, entity):
+        return 201, entity
+
+    def deleter(self, collection, kind):
+        def delete(request):
+            self.workspace.delete(
+                getattr(self.workspace, collection), request.params["id"], kind
+            )
+            return 204, None
+
+        return delete
+
+    def get_member(self, request):
+        member = self.workspace.members[0]
+        return {
+            "id": member["id"],
+            "name": member["profile"]["name"],
+            "mention_name": member["profile"]["mention_name"],
+            "workspace2": {"url_slug": self.workspace.slug},
+        }
+
+    def list_members(self, request):
+        return self.workspace.members
+
+    def get_workflow(self, request):
+        for workflow in self.workspace.workflows:
+            if str(workflow["id"]) == request.params["id"]:
+                return workflow
+        raise ApiError(404, f"Workflow {request.params['id']} not found")
+
+    def get_custom_field(self, request):
+        for custom_field in self.workspace.custom_fields:
+            if custom_field["id"] == request.params["id"]:
+                return custom_field
+        raise ApiError(404, f"Custom field {request.params['id']} not found")
+
+    def list_labels(self, request):
+        return list(self.workspace.labels.values())
+
+    def update_label(self, request):
+        label = self.workspace.get(self.workspace.labels, request.params["id"], "Label")
+        label.update(request.json())
+        return label
+
+    def label_stories(self, request):
+        label = self.workspace.get(self.workspace.labels, request.params["id"], "Label")
+        return [
+            s for s in self.workspace.stories.values() if label["id"] in s["label_ids"]
+        ]
+
+    def label_epics(self, request):
+        label = self.workspace.get(self.workspace.labels, request.params["id"], "Label")
+        return [
+            e for e in self.workspace.epics.values() if label["id"] in e["label_ids"]
+        ]
+
+    def epic_comments(self, request):
+        epic = self.workspace.get(self.workspace.epics, request.params["id"], "Epic")
+        return self.workspace.epic_comments.get(epic["id"], [])
+
+    def list_iterations(self, request):
+        return list(self.workspace.iterations.values())
+
+    def iteration_stories(self, request):
+        iteration = self.workspace.get(
+            self.workspace.iterations, request.params["id"], "Iteration"
+        )
+        return [
+            s
+            for s in self.workspace.stories.values()
+            if s.get("iteration_id") == iteration["id"]
+        ]
+
+    def story_history(self, request):
+        story = self.workspace.get(
+            self.workspace.stories, request.params["id"], "Story"
+        )
+        return self.workspace.histories[story["id"]]
+
+    def create_stories(self, request):
+        stories = request.json().get("stories") or []
+        # Validate the whole batch first: the bulk API creates all or nothing.
+        for story in stories:
+            if not story.get("name"):
+                raise ApiError(400, "Every story needs a name")
+        return 201, [self.workspace.create_story(story) for story in stories]
+
+    def delete_stories(self, request):
+        self.workspace.delete_stories(request.json().get("story_ids") or [])
+        return 204, None
+
+    def search(self, query, page_size, offset):
+        if not query:
+            raise ApiError(400, "A search needs a query")
+        matches = [
+            s
+            for s in self.workspace.stories.values()
+            if story_matches(self.workspace, s, query)
+        ]
+        return matches, matches[offset : offset + page_size]
+
+    def search_stories(self, request):
+        if "next" in request.query:
+            state = decode_cursor(request.query["next"])
+            query, page_size, offset = (
+                state["query"],
+                state["page_size"],
+                state["offset"],
+            )
+        else:
+            query = request.query.get("query", "")
+            page_size = min(
+                int(request.query.get("page_size", SEARCH_PAGE_SIZE)), SEARCH_PAGE_SIZE
+            )
+            offset = 0
+        matches, page = self.search(query, page_size, offset)
+        next_path = None
+        if offset + page_size < len(matches):
+            cursor = encode_cursor(
+                {"query": query, "page_size": page_size, "offset": offset + page_size}
+            )
+            next_path = "/api/v3/search/stories?" + urlencode({"next": cursor})
+        return {"data": page, "next": next_path, "total": len(matches)}
+
+    def search_stories_v3_post(self, request):
+        body = request.json()
+        stories = self.workspace.stories.values()
+        return [
+            s
+            for s in stories
+            if all(
+                s.get(k) == v if not isinstance(v, list) else s.get(k) in v
+                for k, v in body.items()
+            )
+        ]
+
+    def upload_files(self, request):
+        body = request.body or b""
+        content_type = request.headers.get("Content-Type", "")
+        if not content_type.startswith("multipart/form-data"):
+            raise ApiError(400, "Files must be uploaded as multipart/form-data")
+        names = re.findall(rb'filename="([^"]*)"', body)
+        if not names:
+            raise ApiError(400, "No files in the upload")
+        size = len(body) // len(names)
+        return 201, [
+            self.workspace.create_file(name.decode("utf-8", "replace"), size)
+            for name in names
+        ]
+
+    # v4 handlers
+
+    def page(self, request, items, path):
+        """
+        Return a page of `items`, with a `next_page_url` carrying a cursor
+        if there are more. As in the real API, a cursor must be the only
+        query parameter; the other parameters are carried in it.
+        """
+        if "cursor" in request.query:
+            if len(request.query) > 1:
+                raise ApiError(400, "cursor must be the only query parameter")
+            state = decode_cursor(request.query["cursor"])
+        else:
+            state = {"offset": 0, "params": request.query}
+        params = state["params"]
+        limit = min(int(params.get("limit", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        items = items(params) if callable(items) else items
+        offset = state["offset"]
+        body = {
+            "entities": items[offset : offset + limit],
+            "total_items": len(items),
+            "total_pages": max(1, math.ceil(len(items) / limit)),
+        }
+        if offset + limit < len(items):
+            cursor = encode_cursor({"offset": offset + limit, "params": params})
+            body["next_page_url"] = f"{request.base_url}{path}?" + urlencode(
+                {"cursor": cursor}
+            )
+        return body
+
+    def v4_epic(self, request):
+        epic = self.workspace.get(self.workspace.epics, request.params["id"], "Epic")
+        stories = [
+            s for s in self.workspace.stories.values() if s.get("epic_id") == epic["id"]
+        ]
+        return {
+            "entity": {
+                **epic,
+                "stories": {
+                    "total_items": len(stories),
+                    "list_url": f"{request.base_url}/epics/{epic['id']}/stories",
+                },
+            }
+        }
+
+    def v4_epic_stories(self, request):
+        epic = self.workspace.get(self.workspace.epics, request.params["id"], "Epic")
+        stories = [
+            self.workspace.v4_story(s, request.base_url)
+            for s in self.workspace.stories.values()
+            if s.get("epic_id") == epic["id"] and not s["archived"]
+        ]
+        return self.page(request, stories, f"/epics/{epic['id']}/stories")
+
+    def v4_story(self, request):
+        story = self.workspace.get(
+            self.workspace.stories, request.params["id"], "Story"
+        )
+        return {"entity": self.workspace.v4_story(story, request.base_url)}
+
+    def v4_story_comments(self, request):
+        story = self.workspace.get(
+            self.workspace.stories, request.params["id"], "Story"
+        )
+        comments = [
+            self.workspace.v4_comment(c)
+            for c in self.workspace.story_comments.get(story["id"], [])
+        ]
+        return self.page(request, comments, f"/stories/{story['id']}/comments")
+
+    def v4_state_stories(self, request):
+        state = self.workspace.state(int(request.params["id"]))
+
+        def stories(params):
+            fields = [f for f in params.get("fields", "").split(",") if f]
+            result = []
+            for s in self.workspace.stories.values():
+                if s["workflow_state_id"] != state["id"]:
+                    continue
+                story = self.workspace.v4_story(s, request.base_url)
+                if fields:
+                    story = {k: story.get(k) for k in ["id", *fields]}
+                result.append(story)
+            return result
+
+        return self.page(request, stories, f"/workflow-states/{state['id']}/stories")
+
+    def v4_admin_tokens(self, request):
+        def tokens(params):
+            result = list(self.workspace.tokens.values())
+            if params.get("filter") == "enabled":
+                result = [t for t in result if not t["disabled"]]
+            elif params.get("filter") == "disabled":
+                result = [t for t in result if t["disabled"]]
+            order_by = params.get("order_by", "created_at")
+            result.sort(
+                key=lambda t: t.get(order_by) or "",
+                reverse=params.get("order_dir") == "desc",
+            )
+            return result
+
+        return self.page(request, tokens, "/admin/tokens")
+
+    def v4_delete_admin_token(self, request):
+        token = self.workspace.tokens.get(request.params["id"])
+        if token is None:
+            raise ApiError(404, f"Token {request.params['id']} not found")
+        token["disabled"] = True
+        return 204, None
+
+
+class SimulatedRequest:
+    def __init__(self, method, url, headers, body):
+        parts = urlsplit(url)
+        self.method = method
+        self.path = parts.path.rstrip("/") or "/"
+        self.query = dict(parse_qsl(parts.query))
+        self.headers = headers
+        self.body = body
+        self.route = f"{method} {self.path}"
+        self.params = {}
+        self.base_url = None
+
+    def json(self):
+        if not self.body:
+            return {}
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            raise ApiError(400, "Malformed JSON body")
+
+    def token(self):
+        auth = self.headers.get("Authorization", "")
+        if auth.startswith("Bearer "):
+            return auth[len("Bearer ") :]
+        # Old /api/beta recipes pass the token as a query parameter.
+        return self.headers.get("Shortcut-Token") or self.query.get("token")
+
+
+def make_handler(simulator):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are written separately; without TCP_NODELAY,
+        # Nagle's algorithm holds the body back until the client's delayed
+        # ACK, adding ~40ms to every response.
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+        def handle_request(self):
+            body = self.read_body()
+            request = SimulatedRequest(self.command, self.path, self.headers, body)
+            if request.path.startswith("/_simulator/"):
+                return self.control(request)
+
+            simulator.delay()
+            rate_headers = {}
+            try:
+                token = request.token()
+                if not token:
+                    raise ApiError(401, "Missing API token")
+                throttled, rate_headers = simulator.throttle(token)
+                if throttled:
+                    return self.respond(
+                        request, 429, {"message": "Too many requests"}, throttled
+                    )
+                status, result = simulator.dispatch(request)
+            except ApiError as err:
+                return self.respond(
+                    request, err.status_code, {"message": err.message}, rate_headers
+                )
+            self.respond(request, status, result, rate_headers)
+
+        def read_body(self):
+            if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                chunks = []
+                while size := int(self.rfile.readline().split(b";")[0], 16):
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+                self.rfile.readline()
+                return b"".join(chunks)
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length) if length else None
+
+        def control(self, request):
+            if request.path == "/_simulator/stats" and request.method == "GET":
+                return self.respond(
+                    request, 200, simulator.stats.as_dict(), record=False
+                )
+            if request.path == "/_simulator/reset" and request.method == "POST":
+                simulator.stats.reset()
+                return self.respond(request, 204, None, record=False)
+            return self.respond(
+                request, 404, {"message": "No such endpoint"}, record=False
+            )
+
+        def respond(self, request, status, result, extra_headers=None, record=True):
+            headers = dict(extra_headers or {})
+            payload = b""
+            if result is not None:
+                payload = json.dumps(result).encode("utf-8")
+                headers["Content-Type"] = "application/json; charset=utf-8"
+            if request.method == "GET" and status == 200:
+                etag = '"' + hashlib.sha1(payload).hexdigest() + '"'
+                headers["ETag"] = etag
+                if self.headers.get("If-None-Match") == etag:
+                    status, payload = 304, b""
+            if record:
+                simulator.stats.record(request.route, status)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            if payload and status != 304:
+                self.wfile.write(payload)
+
+        do_GET = do_POST = do_PUT = do_DELETE = handle_request
+
+    return Handler
+
+
+def main(argv):
+    args = parser.parse_args(argv[1:])
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    simulator = ApiSimulator(
+        host=args.host,
+        port=args.port,
+        stories=args.stories,
+        seed=args.seed,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        rate_limit=args.rate_limit,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+    )
+    print(f"""Simulated Shortcut API listening at {simulator.url}
+Point the recipes at it with:
+    export SHORTCUT_API_BASE_URL={simulator.url}
+    export SHORTCUT_API_TOKEN=simulated
+    export SHORTCUT_WORKSPACE_SLUG={simulator.workspace.slug}""")
+    try:
+        simulator.serve()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,99 @@
+import pytest
+import requests
+
+from api_simulator import ApiSimulator, SlidingWindowLimiter
+
+v3_headers = {"Shortcut-Token": "test-token"}
+v4_headers = {"Authorization": "Bearer test-token"}
+
+
+@pytest.fixture
+def simulator():
+    with ApiSimulator(port=0, stories=60, rate_limit=0) as simulator:
+        yield simulator
+
+
+def test_requires_token(simulator):
+    assert 401 == requests.get(f"{simulator.url}/api/v3/groups").status_code
+
+
+def test_v3_bulk_stories(simulator):
+    url = f"{simulator.url}/api/v3/stories/bulk"
+    resp = requests.post(
+        url, headers=v3_headers, json={"stories": [{"name": "A"}, {"name": "B"}]}
+    )
+    assert 201 == resp.status_code
+    story_ids = [story["id"] for story in resp.json()]
+
+    # the bulk API creates all the stories or none of them
+    bad_batch = {"stories": [{"name": "C"}, {"description": "no name"}]}
+    assert 400 == requests.post(url, headers=v3_headers, json=bad_batch).status_code
+
+    resp = requests.delete(url, headers=v3_headers, json={"story_ids": story_ids})
+    assert 204 == resp.status_code
+    resp = requests.delete(url, headers=v3_headers, json={"story_ids": story_ids})
+    assert 404 == resp.status_code
+
+
+def test_v3_etag_revalidation(simulator):
+    url = f"{simulator.url}/api/v3/workflows"
+    resp = requests.get(url, headers=v3_headers)
+    assert "Standard" == resp.json()[0]["name"]
+    etag = resp.headers["ETag"]
+    resp = requests.get(url, headers=v3_headers | {"If-None-Match": etag})
+    assert 304 == resp.status_code
+
+
+def test_v3_search_pagination(simulator):
+    url = f"{simulator.url}/api/v3/search/stories"
+    data = requests.get(url, headers=v3_headers, params={"query": "story"}).json()
+    assert 60 == data["total"]
+    stories = data["data"]
+    while data["next"]:
+        data = requests.get(simulator.url + data["next"], headers=v3_headers).json()
+        stories.extend(data["data"])
+    assert 60 == len({story["id"] for story in stories})
+
+
+def test_v4_pagination(simulator):
+    base_url = f"{simulator.url}/api/v4/{simulator.workspace.slug}"
+    params = {"limit": 7, "filter": "enabled"}
+    data = requests.get(
+        f"{base_url}/admin/tokens", headers=v4_headers, params=params
+    ).json()
+    tokens = data["entities"]
+    while data.get("next_page_url"):
+        data = requests.get(data["next_page_url"], headers=v4_headers).json()
+        tokens.extend(data["entities"])
+    assert data["total_items"] == len(tokens)
+    assert not any(token["disabled"] for token in tokens)
+
+    # a cursor must be the only query parameter
+    first_page = requests.get(
+        f"{base_url}/admin/tokens", headers=v4_headers, params=params
+    )
+    resp = requests.get(
+        first_page.json()["next_page_url"] + "&limit=3", headers=v4_headers
+    )
+    assert 400 == resp.status_code
+
+
+def test_injected_throttling():
+    with ApiSimulator(port=0, stories=0, throttle_rate=1, retry_after=3) as simulator:
+        resp = requests.get(f"{simulator.url}/api/v3/groups", headers=v3_headers)
+        assert 429 == resp.status_code
+        assert "3" == resp.headers["Retry-After"]
+        stats = requests.get(f"{simulator.url}/_simulator/stats").json()
+        assert 1 == stats["throttled"]
+
+
+def test_sliding_window_limiter():
+    now = [0.0]
+    limiter = SlidingWindowLimiter(2, clock=lambda: now[0])
+    assert limiter.check("a")[0]
+    assert limiter.check("a")[0]
+    allowed, remaining, retry_after = limiter.check("a")
+    assert (False, 0, 60) == (allowed, remaining, retry_after)
+    assert limiter.check("b")[0]
+    now[0] = 60.0
+    assert limiter.check("a")[0]
@@ -22,7 +22,13 @@ import sys
 from collections import defaultdict
 from datetime import datetime, timezone
 
-from lib import print_rate_limiting_explanation, sc_get, validate_environment
+from lib import (
+    configure_metadata_cache,
+    print_rate_limiting_explanation,
+    sc_get,
+    sc_get_cached,
+    validate_environment,
+)
 
 parser = argparse.ArgumentParser(
     description="Generate a report of story rollover from iteration to iteration",
@@ -39,6 +45,11 @@ parser.add_argument(
     help="Name of file to write CSV results to. If not provided, outputs to stdout.",
 )
 parser.add_argument("--debug", action="store_true", help="Turns on debugging logs")
+parser.add_argument(
+    "--refresh",
+    action="store_true",
+    help="Revalidates cached workspace metadata, such as teams",
+)
 
 
 def parse_date(date_str):
@@ -98,7 +109,7 @@ def get_iteration_stories(iteration_id):
 def get_groups():
     """Fetch all groups (teams) in the workspace and return as a dict keyed by ID."""
     logging.info("Fetching groups (teams)...")
-    groups = sc_get("/groups")
+    groups = sc_get_cached("/groups")
     return {g["id"]: g for g in groups}
 
 
@@ -272,6 +283,7 @@ def main(argv):
         logging.basicConfig(level=logging.INFO)
 
     validate_environment()
+    configure_metadata_cache(refresh=args.refresh)
     print_rate_limiting_explanation()
 
     # Get the iteration to analyze
@@ -5,9 +5,12 @@ environment variable.
 
 """
 
+import hashlib
+import json
 import sys
 import os
 import logging
+import time
 
 from pyrate_limiter import Duration, InMemoryBucket, Limiter, Rate  # type: ignore
 import requests
@@ -48,7 +51,8 @@ def print_rate_limiting_explanation():
 
 # API Helpers
 sc_token = os.getenv("SHORTCUT_API_TOKEN")
-api_url_base = "https://api.app.shortcut.com/api/v3"
+sc_host = os.getenv("SHORTCUT_API_BASE_URL", "https://api.app.shortcut.com").rstrip("/")
+api_url_base = f"{sc_host}/api/v3"
 headers = {
     "Shortcut-Token": sc_token,
     "Accept": "application/json; charset=utf-8",
@@ -71,6 +75,101 @@ def sc_get(path, params={}):
     return resp.json()
 
 
+# Workspace metadata cache. Groups and the like rarely change, so they are
+# cached on disk, per API token, for `metadata_cache_ttl_seconds`; expired
+# entries are revalidated with a conditional request.
+metadata_cache_ttl_seconds = 24 * 60 * 60
+metadata_cache_refresh = False
+
+
+def metadata_cache_dir():
+    base = os.getenv("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    key = f"{api_url_base}\n{sc_token or ''}"
+    token_hash = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(base, "shortcut-api-cookbook", token_hash)
+
+
+def configure_metadata_cache(refresh=False):
+    """With `refresh`, revalidate cached metadata before using it."""
+    global metadata_cache_refresh
+    metadata_cache_refresh = refresh
+
+
+@rate_decorator(rate_mapping)
+def sc_get_conditional(path, params, entry):
+    """
+    Make a GET api call, revalidating the `entry` previously cached for it
+    if there is one.
+    """
+    url = api_url_base + path
+    request_headers = dict(headers)
+    if entry and entry.get("etag"):
+        request_headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        request_headers["If-Modified-Since"] = entry["last_modified"]
+    logger.debug("GET url=%s params=%s (metadata)" % (url, params))
+    return requests.get(url, headers=request_headers, params=params)
+
+
+def is_metadata_cache_entry(entry):
+    """
+    Return whether `entry`, as loaded from a cache file, is complete; a
+    partly written or older entry is treated as a cache miss.
+    """
+    return (
+        isinstance(entry, dict)
+        and "body" in entry
+        and isinstance(entry.get("fetched_at"), (int, float))
+    )
+
+
+def sc_get_cached(path, params={}, refresh=False):
+    """
+    Make a GET api call for slowly-changing workspace metadata, such as
+    /groups, through the on-disk metadata cache.
+    """
+    key = json.dumps([path, params], sort_keys=True)
+    name = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+    entry_file = os.path.join(metadata_cache_dir(), f"{name}.json")
+    try:
+        with open(entry_file, encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        entry = None
+    if not is_metadata_cache_entry(entry):
+        entry = None
+    now = time.time()
+    if (
+        entry is not None
+        and not (refresh or metadata_cache_refresh)
+        and now - entry["fetched_at"] < metadata_cache_ttl_seconds
+    ):
+        return entry["body"]
+
+    resp = sc_get_conditional(path, params, entry)
+    if resp.status_code == 304 and entry is not None:
+        entry["fetched_at"] = now
+    else:
+        resp.raise_for_status()
+        entry = {
+            "fetched_at": now,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "body": resp.json(),
+        }
+    try:
+        os.makedirs(os.path.dirname(entry_file), exist_ok=True)
+        tmp_file = f"{entry_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_file, entry_file)
+    except OSError as err:
+        logger.debug("Could not cache %s: %s" % (entry_file, err))
+    return entry["body"]
+
+
 def printerr(s):
     print(s, file=sys.stderr)
 
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+import requests
+
+import lib
+from lib import *
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None, body=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error", response=self)
+
+
+@pytest.fixture
+def fake_api(tmp_path, monkeypatch):
+    """Serve `fake_api.responses` to GET requests, recording their headers."""
+
+    class FakeApi:
+        now = 0.0
+        responses = []
+        requests = []
+
+    def fake_get(url, headers=None, params=None):
+        FakeApi.requests.append(headers)
+        return FakeApi.responses.pop(0)
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(lib.requests, "get", fake_get)
+    monkeypatch.setattr(lib.time, "time", lambda: FakeApi.now)
+    monkeypatch.setattr(lib, "metadata_cache_refresh", False)
+    return FakeApi
+
+
+def test_sc_get_cached(fake_api):
+    groups = [{"id": "g1", "name": "Team"}]
+    fake_api.responses = [
+        FakeResponse(200, {"ETag": '"v1"'}, body=groups),
+        FakeResponse(304),
+        FakeResponse(200, {"ETag": '"v2"'}, body=[]),
+    ]
+    assert groups == sc_get_cached("/groups")
+    # fresh entries are served without a request
+    fake_api.now = metadata_cache_ttl_seconds - 1
+    assert groups == sc_get_cached("/groups")
+    assert 1 == len(fake_api.requests)
+
+    # expired entries are revalidated with their ETag
+    fake_api.now = metadata_cache_ttl_seconds + 1
+    assert groups == sc_get_cached("/groups")
+    assert '"v1"' == fake_api.requests[1]["If-None-Match"]
+    assert groups == sc_get_cached("/groups")
+    assert 2 == len(fake_api.requests)
+
+    # refreshing (--refresh) revalidates even fresh entries
+    configure_metadata_cache(refresh=True)
+    assert [] == sc_get_cached("/groups")
+    assert 3 == len(fake_api.requests)
+
+
+def test_sc_get_cached_ignores_invalid_entries(fake_api, tmp_path):
+    fake_api.responses = [FakeResponse(200, body=[]) for _ in range(3)]
+    assert [] == sc_get_cached("/groups")
+    (entry_file,) = tmp_path.glob("shortcut-api-cookbook/*/*.json")
+    # e.g. written by an older version, or only partly
+    for entry in [{"body": []}, {"fetched_at": 0}]:
+        entry_file.write_text(json.dumps(entry))
+        assert [] == sc_get_cached("/groups")
+    assert 3 == len(fake_api.requests)
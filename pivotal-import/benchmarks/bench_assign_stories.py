@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""Time assigning stories to their epics and iterations.
+
+Compares the previous approach, which rebuilt the epic and iteration
+mappings for every chunk of stories and formatted a debug message for
+every label, against building the index once and assigning each story
+in a single pass. Runs at several story counts to show the time per
+story stays flat as the import grows.
+
+Usage (from the pivotal-import directory):
+
+    pipenv run python benchmarks/bench_assign_stories.py --stories 50000 --epics 2000
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pivotal_import import (
+    PIVOTAL_TO_SHORTCUT_LABEL,
+    PIVOTAL_TO_SHORTCUT_RUN_LABEL,
+    STORY_CHUNK_SIZE,
+    assign_stories,
+    build_assignment_index,
+)
+
+logger = logging.getLogger("bench")
+
+
+def legacy_assign(stories, epics, iterations):
+    for ix in range(0, len(stories), STORY_CHUNK_SIZE):
+        chunk = stories[ix : ix + STORY_CHUNK_SIZE]
+        epic_label_map = {}
+        for epic in epics:
+            for label in epic["entity"]["labels"]:
+                label_name = label["name"]
+                if (
+                    label_name is not PIVOTAL_TO_SHORTCUT_LABEL
+                    and label_name is not PIVOTAL_TO_SHORTCUT_RUN_LABEL
+                ):
+                    epic_label_map[label_name] = epic["imported_entity"]["id"]
+        for story in chunk:
+            for label in story["entity"].get("labels", []):
+                epic_id = epic_label_map.get(label["name"])
+                logger.debug(f"story epic id {epic_id}")
+                if epic_id is not None:
+                    story["entity"]["epic_id"] = epic_id
+        pt_iteration_mapping = {}
+        for iteration in iterations:
+            pt_iteration_mapping[str(iteration["pt_iteration_id"])] = iteration[
+                "imported_entity"
+            ]["id"]
+        for story in chunk:
+            if story["pt_iteration_id"]:
+                story["entity"]["iteration_id"] = pt_iteration_mapping[
+                    str(story["pt_iteration_id"])
+                ]
+
+
+def indexed_assign(stories, epics, iterations):
+    epic_label_map, pt_iteration_mapping = build_assignment_index(epics, iterations)
+    for ix in range(0, len(stories), STORY_CHUNK_SIZE):
+        assign_stories(
+            stories[ix : ix + STORY_CHUNK_SIZE], epic_label_map, pt_iteration_mapping
+        )
+
+
+def build_items(n_stories, n_epics, n_iterations, seed=1):
+    rng = random.Random(seed)
+    common = [
+        {"name": PIVOTAL_TO_SHORTCUT_LABEL},
+        {"name": PIVOTAL_TO_SHORTCUT_RUN_LABEL},
+    ]
+    epics = [
+        {
+            "type": "epic",
+            "entity": {"labels": common + [{"name": f"epic-{n}"}]},
+            "imported_entity": {"id": n},
+        }
+        for n in range(n_epics)
+    ]
+    iterations = [
+        {"pt_iteration_id": str(n), "imported_entity": {"id": 100000 + n}}
+        for n in range(n_iterations)
+    ]
+    stories = []
+    for n in range(n_stories):
+        labels = common + [
+            {"name": rng.choice([f"epic-{rng.randrange(n_epics)}", "backend", "ui"])}
+            for _ in range(rng.randrange(4))
+        ]
+        pt_iteration_id = str(rng.randrange(n_iterations)) if n % 3 else None
+        stories.append(
+            {
+                "type": "story",
+                "entity": {"name": f"Story {n}", "labels": labels},
+                "pt_iteration_id": pt_iteration_id,
+            }
+        )
+    return stories, epics, iterations
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stories", type=int, default=50000)
+    parser.add_argument("--epics", type=int, default=2000)
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args(argv[1:])
+
+    print(f"{'stories':>8} {'legacy':>10} {'indexed':>10} {'indexed/story':>14}")
+    for n_stories in [args.stories // 4, args.stories // 2, args.stories]:
+        timings = []
+        for assign in [legacy_assign, indexed_assign]:
+            stories, epics, iterations = build_items(
+                n_stories, args.epics, args.iterations
+            )
+            start = time.perf_counter()
+            assign(stories, epics, iterations)
+            timings.append(time.perf_counter() - start)
+        legacy_secs, indexed_secs = timings
+        print(
+            f"{n_stories:>8} {legacy_secs:>9.3f}s {indexed_secs:>9.3f}s"
+            f" {indexed_secs / n_stories * 1e6:>11.2f} µs"
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Compare per-request latency of one-off requests against the pooled session.
+
+Runs against a local stub server, so the numbers reflect client-side and
+connection setup cost only. Against the real Shortcut API, each avoided
+connection also saves a TLS handshake and a network round trip or two,
+so the difference there is larger.
+
+Usage (from the pivotal-import directory):
+
+    pipenv run python benchmarks/bench_http_session.py --requests 2000
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import requests
+
+import lib
+from stub_server import start_stub_server
+
+
+def measure(get, url, n):
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        resp = get(url, headers=lib.headers)
+        resp.raise_for_status()
+        resp.json()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(label, latencies):
+    ms = sorted(x * 1000 for x in latencies)
+    p95 = ms[int(len(ms) * 0.95) - 1]
+    print(
+        f"{label:<22} mean {statistics.mean(ms):7.3f} ms   "
+        f"median {statistics.median(ms):7.3f} ms   p95 {p95:7.3f} ms"
+    )
+    return statistics.mean(ms)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args(argv[1:])
+
+    server = start_stub_server()
+    url = f"http://127.0.0.1:{server.server_port}/api/v3/stories/1"
+    try:
+        # warm up both paths
+        measure(requests.get, url, 10)
+        measure(lib.session.get, url, 10)
+
+        print(f"{args.requests} GET requests against {url}")
+        before = report(
+            "requests.get (before)", measure(requests.get, url, args.requests)
+        )
+        after = report(
+            "lib.session (after)", measure(lib.session.get, url, args.requests)
+        )
+        print(f"speedup: {before / after:.2f}x")
+    finally:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+"""Time a full import of a synthetic Pivotal export against the API simulator.
+
+Generates an export of the given size (with attachments, if asked for),
+starts the local Shortcut API simulator from ../api-simulator in a
+subprocess, and runs the importer's pipeline against it phase by phase:
+
+- parse: reading the CSV and parsing its rows
+- build: building an entity from each row and collecting it, i.e. the
+  time `process_pt_csv_export` took less that of the parse phase
+- commit: creating the entities in the simulated workspace, uploading
+  attachments along the way
+
+It reports the time each phase took, rows and requests per second, where
+the time of API requests went (rate limiter, client, network), and the
+peak resident memory of the importer. Use `--json` to save the numbers,
+e.g. to compare a branch against main.
+
+By default the simulator doesn't rate limit, and the importer's own rate
+limiter is lifted, so the numbers reflect the importer rather than the
+rate limit. Pass `--rate-limit 200` to run under Shortcut's rate limit.
+
+Usage (from the pivotal-import directory):
+
+    pipenv run python benchmarks/bench_import.py --rows 5000 --latency-ms 20
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+pivotal_import_dir = os.path.dirname(benchmarks_dir)
+simulator_script = os.path.join(
+    pivotal_import_dir, "..", "api-simulator", "api_simulator.py"
+)
+sys.path.insert(0, pivotal_import_dir)
+
+from synthetic_export import PEOPLE, write_attachments, write_synthetic_export
+
+
+def start_simulator(latency_ms, rate_limit):
+    """Start the API simulator in a subprocess, returning it and its URL."""
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            "-u",
+            simulator_script,
+            "--port",
+            "0",
+            "--stories",
+            "0",
+            "--latency-ms",
+            str(latency_ms),
+            "--rate-limit",
+            str(rate_limit),
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    match = re.search(r"listening at (\S+)", proc.stdout.readline())
+    if not match:
+        proc.kill()
+        sys.exit("The API simulator failed to start")
+    return proc, match.group(1)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def build_benchmark_ctx(lib, initialize):
+    """
+    Build the import context from the simulated workspace the way
+    initialize.py would, mapping every synthetic Pivotal user to a member.
+    """
+    states = initialize.pt_state_mapping_for_workflow(lib.default_workflow_id())
+    priority_custom_field_id = lib.default_priority_custom_field_id()
+    priorities = initialize.pt_priority_mapping_for_custom_field(
+        priority_custom_field_id
+    )
+    member_ids = [member["id"] for member in lib.fetch_members()]
+    return {
+        "token_member": lib.current_member_id(),
+        "group_id": lib.default_group_id(),
+        "priority_config": {
+            pt_priority: mapping["shortcut_custom_field_value_id"]
+            for pt_priority, mapping in priorities.items()
+            if mapping
+        },
+        "priority_custom_field_id": priority_custom_field_id,
+        "user_config": {
+            person: member_ids[n % len(member_ids)] for n, person in enumerate(PEOPLE)
+        },
+        "workflow_config": {
+            pt_state: mapping["shortcut_state_id"]
+            for pt_state, mapping in states.items()
+            if mapping
+        },
+    }
+
+
+def parse_export(pivotal_import, pt_csv_file):
+    """The parse phase on its own: read and parse every row of the export."""
+    with open(pt_csv_file, mode="r", encoding="utf-8") as csvfile:
+        reader = csv.reader(csvfile)
+        header = [col.lower() for col in next(reader)]
+        for row in reader:
+            pivotal_import.parse_row(row, header)
+
+
+def run_import(args, simulator_url):
+    os.environ["SHORTCUT_API_BASE_URL"] = simulator_url
+    os.environ["SHORTCUT_API_TOKEN"] = "benchmark"
+    # keep the metadata cache of the run out of the user's cache
+    os.environ["XDG_CACHE_HOME"] = os.path.abspath("cache")
+
+    # lib reads the API host and token when imported
+    import lib
+    import initialize
+    import pivotal_import
+
+    if not args.rate_limit:
+        lib.limiter = lib.AdaptiveRateLimiter(
+            requests_per_minute=10**9, max_rate=10**9, burst=10**6
+        )
+    workers = lib.configure_concurrency(args.workers)
+    ctx = build_benchmark_ctx(lib, initialize)
+    requests.post(f"{simulator_url}/_simulator/reset").raise_for_status()
+    profiler = lib.enable_request_profiling()
+
+    pt_csv_file = lib.data_pivotal_export_csv
+    phases = {}
+    peak_rss = {}
+
+    start = time.perf_counter()
+    parse_export(pivotal_import, pt_csv_file)
+    phases["parse"] = time.perf_counter() - start
+    peak_rss["parse"] = peak_rss_mb()
+
+    upload_manifest = lib.UploadManifest()
+    journal = lib.ImportJournal.create(pivotal_import.PIVOTAL_TO_SHORTCUT_RUN_LABEL)
+    entity_collector = pivotal_import.EntityCollector(
+        pivotal_import.sc_creator,
+        lambda file: lib.sc_upload_file(file, upload_manifest),
+        journal,
+        stream=args.stream,
+        max_workers=workers,
+    )
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            start = time.perf_counter()
+            pivotal_import.process_pt_csv_export(ctx, pt_csv_file, entity_collector)
+            # building includes parsing, which was timed on its own above
+            phases["build"] = max(0.0, time.perf_counter() - start - phases["parse"])
+            peak_rss["build"] = peak_rss_mb()
+
+            start = time.perf_counter()
+            created = entity_collector.commit()
+            phases["commit"] = time.perf_counter() - start
+            peak_rss["commit"] = peak_rss_mb()
+    finally:
+        journal.close()
+
+    stats = requests.get(f"{simulator_url}/_simulator/stats").json()
+    return {
+        "rows": args.rows,
+        "created_entities": len(created),
+        "failed_stories": len(entity_collector.failed_stories),
+        "workers": workers,
+        "phases": phases,
+        "peak_rss_mb": peak_rss,
+        "requests": stats["requests"],
+        "throttled": stats["throttled"],
+        "requests_by_route": stats["by_route"],
+        "request_profile": profiler.totals,
+    }
+
+
+def report(result, args):
+    phases = result["phases"]
+    total = sum(phases.values())
+    print(
+        f"Imported {result['rows']} rows as {result['created_entities']} entities "
+        f"in {total:.2f} s ({result['rows'] / total:,.0f} rows/s), "
+        f"{result['workers']} workers, {args.latency_ms} ms latency"
+    )
+    if result["failed_stories"]:
+        print(f"  {result['failed_stories']} stories failed to import")
+    print()
+    print(f"{'phase':<10}{'seconds':>10}{'rows/s':>12}{'peak RSS MB':>14}")
+    for phase, seconds in phases.items():
+        rate = result["rows"] / seconds if seconds else float("inf")
+        print(
+            f"{phase:<10}{seconds:>10.3f}{rate:>12,.0f}"
+            f"{result['peak_rss_mb'][phase]:>14.1f}"
+        )
+    print()
+    print(
+        f"{result['requests']} requests, {result['throttled']} throttled, "
+        f"{result['requests'] / phases['commit']:,.1f} requests/s during commit"
+    )
+    for route, count in sorted(
+        result["requests_by_route"].items(), key=lambda item: -item[1]
+    ):
+        print(f"  {count:>8}  {route}")
+    print()
+    print("Request time by method (total seconds across workers):")
+    print(f"  {'method':<8}{'requests':>10}{'wait':>10}{'client':>10}{'network':>10}")
+    for method, totals in sorted(result["request_profile"].items()):
+        print(
+            f"  {method:<8}{totals['requests']:>10}"
+            + "".join(f"{totals[k]:>10.2f}" for k in ["wait", "client", "network"])
+        )
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--comments-per-row", type=int, default=3)
+    parser.add_argument("--attachments-per-row", type=int, default=0)
+    parser.add_argument("--attachment-bytes", type=int, default=4096)
+    parser.add_argument("--epics", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=20,
+        help="Delay of every simulated API response (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        default=0,
+        help="Requests per minute the simulated API allows; 0 disables rate limiting (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--stream", action="store_true", help="Spool parsed stories to disk"
+    )
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the working directory of the run"
+    )
+    args = parser.parse_args(argv[1:])
+    json_file = os.path.abspath(args.json) if args.json else None
+
+    work_dir = tempfile.mkdtemp(prefix="bench-import-")
+    os.chdir(work_dir)
+    os.mkdir("data")
+    write_synthetic_export(
+        "data/pivotal_export.csv",
+        args.rows,
+        comments_per_row=args.comments_per_row,
+        epics=args.epics,
+        iterations=args.iterations,
+    )
+    if args.attachments_per_row:
+        write_attachments(
+            "data",
+            args.rows,
+            args.attachments_per_row,
+            args.attachment_bytes,
+            epics=args.epics,
+        )
+
+    simulator, simulator_url = start_simulator(args.latency_ms, args.rate_limit)
+    try:
+        result = run_import(args, simulator_url)
+    finally:
+        simulator.terminate()
+        simulator.wait()
+        if args.keep:
+            print(f"The working directory of the run is {work_dir}")
+        else:
+            shutil.rmtree(work_dir)
+
+    report(result, args)
+    if json_file:
+        with open(json_file, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
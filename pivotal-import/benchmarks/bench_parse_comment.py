@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Compare the regex-based comment parser against lib.split_comment.
+
+The corpus mixes ordinary comments with pathological ones: long bodies
+full of parentheses and " - " separators, with and without the trailing
+"(Author - Date)" suffix. The greedy regex backtracks over these in
+super-linear time; split_comment scans each comment backwards once.
+
+Usage (from the pivotal-import directory):
+
+    pipenv run python benchmarks/bench_parse_comment.py --length 2000
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import lib
+
+SUFFIX = " (Amy Williams - Oct 15, 2024)"
+
+
+def legacy_split_comment(s):
+    match = re.match(r"(.*)\((.*) - (.*)\)", s, re.DOTALL)
+    return match.groups() if match else None
+
+
+def corpus(length, count, seed=1):
+    rng = random.Random(seed)
+    pieces = ["(", ")", " - ", "see (a) ", "word ", "\n", "x - y "]
+    comments = []
+    for n in range(count):
+        kind = n % 4
+        if kind == 0:
+            body = " ".join("word" for _ in range(length // 5))
+        elif kind == 1:
+            body = "(" * length
+        elif kind == 2:
+            body = "( - " * (length // 4)
+        else:
+            body = "".join(rng.choice(pieces) for _ in range(length // 4))
+        # every other comment lacks the authorship suffix
+        comments.append(body + (SUFFIX if n % 8 < 4 else ""))
+    return comments
+
+
+def timed(label, split, comments):
+    start = time.perf_counter()
+    parsed = [split(c) for c in comments]
+    elapsed = time.perf_counter() - start
+    print(f"{label:<14} {elapsed:8.3f}s  {len(comments) / elapsed:12,.0f} comments/sec")
+    return parsed, elapsed
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--length", type=int, default=2000, help="comment length")
+    parser.add_argument("--count", type=int, default=40, help="number of comments")
+    args = parser.parse_args(argv[1:])
+
+    comments = corpus(args.length, args.count)
+    print(f"{len(comments)} comments of about {args.length} characters")
+    before, legacy_secs = timed("regex", legacy_split_comment, comments)
+    after, fast_secs = timed("split_comment", lib.split_comment, comments)
+    assert before == after, "parsers disagree"
+    print(f"speedup        {legacy_secs / fast_secs:.0f}x")
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""Compare strptime-based date parsing against lib's cached fast path.
+
+Collects every date cell (created/accepted/iteration dates and comment
+suffixes) of a synthetic Pivotal export and parses them all with both
+implementations, reporting dates per second for each.
+
+Usage (from the pivotal-import directory):
+
+    pipenv run python benchmarks/bench_parse_dates.py --rows 100000
+"""
+
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import lib
+from synthetic_export import write_synthetic_export
+
+DATE_COLUMNS = {"created at", "accepted at", "iteration start", "iteration end"}
+
+
+def legacy_parse_date(d):
+    return datetime.strptime(d, "%b %d, %Y").date().strftime("%Y-%m-%d")
+
+
+def legacy_parse_date_time(d):
+    return datetime.strptime(d, "%b %d, %Y").isoformat()
+
+
+def collect_dates(path):
+    dates = []
+    with open(path, encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = [col.lower() for col in next(reader)]
+        for row in reader:
+            for col, val in zip(header, row):
+                if not val:
+                    continue
+                if col in DATE_COLUMNS:
+                    dates.append(val)
+                elif col == "comment":
+                    dates.append(val[val.rindex(" - ") + 3 : -1])
+    return dates
+
+
+def timed(label, parse, dates):
+    start = time.perf_counter()
+    parsed = [parse(d) for d in dates]
+    elapsed = time.perf_counter() - start
+    print(f"{label:<16} {elapsed:8.3f}s  {len(dates) / elapsed:14,.0f} dates/sec")
+    return parsed, elapsed
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args(argv[1:])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dates = collect_dates(
+            write_synthetic_export(os.path.join(tmp, "export.csv"), args.rows)
+        )
+    print(f"{len(dates)} date cells, {len(set(dates))} distinct")
+
+    before, legacy_secs = timed("strptime", legacy_parse_date_time, dates)
+    lib.parse_date_time.cache_clear()
+    after, fast_secs = timed("fast path", lib.parse_date_time, dates)
+    assert before == after, "parsers disagree"
+    assert [legacy_parse_date(d) for d in dates[:10000]] == [
+        lib.parse_date(d) for d in dates[:10000]
+    ], "parsers disagree"
+    print(f"speedup          {legacy_secs / fast_secs:.2f}x")
+    print(lib.parse_date_time.cache_info())
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
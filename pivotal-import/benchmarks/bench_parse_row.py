@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""Time parse_row over a synthetic Pivotal export.
+
+Generates a synthetic Pivotal export and parses every row of it with
+`parse_row`, reporting rows per second, e.g. to compare a change to the
+parser against main.
+
+Usage (from the pivotal-import directory):
+
+    pipenv run python benchmarks/bench_parse_row.py --rows 100000
+"""
+
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pivotal_import import parse_row
+from synthetic_export import write_synthetic_export
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--comments", type=int, default=3)
+    args = parser.parse_args(argv[1:])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = write_synthetic_export(
+            os.path.join(tmp, "export.csv"), args.rows, comments_per_row=args.comments
+        )
+        with open(path, encoding="utf-8") as f:
+            reader = csv.reader(f)
+            header = [col.lower() for col in next(reader)]
+            rows = list(reader)
+
+    print(f"{len(rows)} rows, {len(header)} columns")
+    start = time.perf_counter()
+    for row in rows:
+        parse_row(row, header)
+    elapsed = time.perf_counter() - start
+    print(f"parse_row  {elapsed:8.3f}s  {len(rows) / elapsed:12,.0f} rows/sec")
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Compare fuzzy matching of Pivotal users with and without the trigram index.
+
+Generates a synthetic workspace of Shortcut members and a set of Pivotal
+user names. Some names match a member exactly, some are misspelled or
+abbreviated versions of a member's name, and some belong to nobody. It
+then matches every Pivotal name with initialize.find_sc_user_from_pt_user.
+The full difflib scan over every member is slow, so it is timed on a
+sample of the names and extrapolated. Both matchers report how many
+names they matched to the member the name was derived from.
+
+Usage (from the pivotal-import directory):
+
+    pipenv run python benchmarks/bench_user_matching.py --members 10000 --pt-users 10000
+"""
+
+import argparse
+import difflib
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from initialize import (
+    _build_user_matching_map,
+    _build_user_trigram_index,
+    _casefold_then_remove_spaces_and_specials,
+    find_sc_user_from_pt_user,
+)
+
+
+def legacy_find_sc_user_from_pt_user(pt_user, user_map):
+    simplified_user = _casefold_then_remove_spaces_and_specials(pt_user)
+    user_info = user_map.get(simplified_user)
+    if user_info:
+        return user_info
+    best_matches = difflib.get_close_matches(simplified_user, user_map.keys())
+    if best_matches:
+        return user_map[best_matches[0]]
+    return None
+
+
+def random_name(rng):
+    def word():
+        return "".join(
+            rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9))
+        ).title()
+
+    return f"{word()} {word()}"
+
+
+def perturb(rng, name):
+    first, last = name.split(" ")
+    kind = rng.randrange(4)
+    if kind == 0:
+        # a typo
+        ix = rng.randrange(len(last))
+        return f"{first} {last[:ix]}{rng.choice(string.ascii_lowercase)}{last[ix + 1:]}"
+    if kind == 1:
+        # a middle initial
+        return f"{first} {rng.choice(string.ascii_uppercase)}. {last}"
+    if kind == 2:
+        # a shortened first name
+        return f"{first[:3]} {last}"
+    # a hyphenated, later, last name
+    return f"{first} {last}-{random_name(rng).split(' ')[1]}"
+
+
+def build_names(n_members, n_pt_users, seed=1):
+    rng = random.Random(seed)
+    members = []
+    for n in range(n_members):
+        name = random_name(rng)
+        members.append(
+            {
+                "name": name,
+                "mention_name": name.split(" ")[0].lower() + str(n),
+                "email": f"user{n}@example.com",
+            }
+        )
+    pt_users = []
+    for _ in range(n_pt_users):
+        kind = rng.randrange(3)
+        if kind == 2:
+            pt_users.append((random_name(rng), None))
+        else:
+            member = rng.choice(members)
+            name = member["name"] if kind == 0 else perturb(rng, member["name"])
+            pt_users.append((name, member["email"]))
+    return members, pt_users
+
+
+def run(label, find, pt_users):
+    start = time.perf_counter()
+    found = [find(name) for name, _ in pt_users]
+    elapsed = time.perf_counter() - start
+    correct = sum(
+        1
+        for (_, email), user_info in zip(pt_users, found)
+        if email is not None and user_info is not None and user_info["email"] == email
+    )
+    print(
+        f"{label:<8} {elapsed:9.3f}s for {len(pt_users)} names"
+        f" ({elapsed / len(pt_users) * 1000:.2f} ms/name),"
+        f" {correct} matched to the right member"
+    )
+    return found, elapsed
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=10000)
+    parser.add_argument("--pt-users", type=int, default=10000)
+    parser.add_argument(
+        "--sample", type=int, default=200, help="names to time the full scan with"
+    )
+    args = parser.parse_args(argv[1:])
+
+    members, pt_users = build_names(args.members, args.pt_users)
+    user_map = _build_user_matching_map(members)
+    start = time.perf_counter()
+    trigram_index = _build_user_trigram_index(user_map)
+    print(
+        f"{len(members)} members ({len(user_map)} names to match against),"
+        f" indexed in {time.perf_counter() - start:.3f}s"
+    )
+
+    indexed, indexed_secs = run(
+        "indexed",
+        lambda name: find_sc_user_from_pt_user(name, user_map, trigram_index),
+        pt_users,
+    )
+    sample = pt_users[: args.sample]
+    legacy, legacy_secs = run(
+        "full",
+        lambda name: legacy_find_sc_user_from_pt_user(name, user_map),
+        sample,
+    )
+    same = sum(1 for a, b in zip(legacy, indexed) if a is b)
+    print(f"same match as the full scan for {same} of {len(sample)} sampled names")
+    full_estimate = legacy_secs / len(sample) * len(pt_users)
+    print(
+        f"full scan of all {len(pt_users)} names estimated at {full_estimate:.0f}s,"
+        f" {full_estimate / indexed_secs:.0f}x the indexed time"
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,148 @@
+"""Generate synthetic Pivotal Tracker CSV exports for the benchmarks.
+
+The generated file has the same column layout as a real Pivotal export,
+including the repeated columns (Owned By, Comment, Task, ...) that hold
+one value per cell. Attachments aren't part of the CSV: a Pivotal export
+keeps each story's files in a folder named after the story id, which
+`write_attachments` mimics.
+"""
+
+import csv
+import os
+import random
+from datetime import date, timedelta
+
+PEOPLE = [f"Person {n:04d}" for n in range(200)]
+STATES = ["unscheduled", "unstarted", "started", "finished", "delivered", "accepted"]
+PRIORITIES = ["None", "p0 - Critical", "p1 - High", "p2 - Medium", "p3 - Low"]
+WORDS = (
+    "the quick brown fox jumps over lazy dog import pivotal story (note) - done".split()
+)
+
+
+def pt_date(d):
+    return d.strftime("%b %-d, %Y")
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def export_header(owners, comments, tasks, reviews):
+    return (
+        [
+            "Id",
+            "Title",
+            "Labels",
+            "Iteration",
+            "Iteration Start",
+            "Iteration End",
+            "Type",
+            "Estimate",
+            "Priority",
+            "Current State",
+            "Created at",
+            "Accepted at",
+            "Deadline",
+            "Requested By",
+            "Description",
+            "URL",
+        ]
+        + ["Owned By"] * owners
+        + ["Comment"] * comments
+        + ["Task", "Task Status"] * tasks
+        + ["Review Type", "Reviewer", "Review Status"] * reviews
+        + ["Pull Request", "Git Branch"]
+    )
+
+
+def generate_rows(
+    rows,
+    comments_per_row=3,
+    owners_per_row=2,
+    tasks_per_row=2,
+    reviews_per_row=1,
+    epics=50,
+    iterations=100,
+    description_words=60,
+    seed=1,
+):
+    """Yield the header, then `rows` synthetic rows of a Pivotal export."""
+    rng = random.Random(seed)
+    header = export_header(
+        owners_per_row, comments_per_row, tasks_per_row, reviews_per_row
+    )
+    yield header
+    start = date(2020, 1, 6)
+    epic_labels = [f"epic {n}" for n in range(epics)]
+    for n in range(rows):
+        pt_id = str(100000 + n)
+        if n < epics:
+            epic_row = [pt_id, f"Epic {n}", epic_labels[n], "", "", "", "epic"]
+            yield epic_row + [""] * (len(header) - len(epic_row))
+            continue
+        created = start + timedelta(days=rng.randrange(1500))
+        iteration = rng.randrange(iterations) if iterations else None
+        iteration_start = start + timedelta(weeks=iteration or 0)
+        row = [
+            pt_id,
+            sentence(rng, 6),
+            ", ".join(
+                rng.sample(epic_labels, 1) + ["backend", "frontend"][: rng.randrange(3)]
+            ),
+            str(iteration) if iteration is not None else "",
+            pt_date(iteration_start) if iteration is not None else "",
+            (
+                pt_date(iteration_start + timedelta(days=7))
+                if iteration is not None
+                else ""
+            ),
+            rng.choice(["feature", "bug", "chore", "release"]),
+            str(rng.randrange(1, 8)),
+            rng.choice(PRIORITIES),
+            rng.choice(STATES),
+            pt_date(created),
+            pt_date(created + timedelta(days=rng.randrange(30))),
+            "",
+            rng.choice(PEOPLE),
+            sentence(rng, description_words),
+            f"https://www.pivotaltracker.com/story/show/{pt_id}",
+        ]
+        row += [rng.choice(PEOPLE) for _ in range(owners_per_row)]
+        row += [
+            f"{sentence(rng, 20)} ({rng.choice(PEOPLE)} - {pt_date(created + timedelta(days=c))})"
+            for c in range(comments_per_row)
+        ]
+        for _ in range(tasks_per_row):
+            row += [sentence(rng, 5), rng.choice(["completed", "not completed"])]
+        for _ in range(reviews_per_row):
+            row += ["Code", rng.choice(PEOPLE), rng.choice(["pass", "unstarted"])]
+        row += ["", ""]
+        yield row
+
+
+def write_synthetic_export(path, rows, **kwargs):
+    """Write a synthetic Pivotal export with `rows` rows to `path`."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(generate_rows(rows, **kwargs))
+    return path
+
+
+def write_attachments(
+    data_dir, rows, attachments_per_row=1, attachment_bytes=4096, epics=50, seed=1
+):
+    """
+    Write `attachments_per_row` files of `attachment_bytes` random bytes
+    into `data_dir/<pt_id>/` for each story row of an export generated
+    with the same `rows` and `epics`. Returns the number of files written.
+    """
+    rng = random.Random(seed)
+    written = 0
+    for n in range(epics, rows):
+        story_dir = os.path.join(data_dir, str(100000 + n))
+        os.makedirs(story_dir, exist_ok=True)
+        for a in range(attachments_per_row):
+            with open(os.path.join(story_dir, f"attachment-{a}.bin"), "wb") as f:
+                f.write(rng.randbytes(attachment_bytes))
+            written += 1
+    return written
@@ -2,7 +2,11 @@ import sys
 import logging
 import argparse
 import csv
+import threading
+import time
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
 
 import requests
 
@@ -15,30 +19,252 @@ parser.add_argument(
     "--apply", action="store_true", help="Actually deletes the entities inside Shortcut"
 )
 parser.add_argument("--debug", action="store_true", help="Turns on debugging logs")
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=max_concurrent_requests,
+    help="Maximum number of API requests to have in flight at once (default: %(default)s)",
+)
 
+# Logging
+logger = logging.getLogger(__name__)
 
-def delete_entity(entity_type, entity_id):
-    prefix = None
-    if entity_type == "story":
-        prefix = "/stories/"
-    elif entity_type == "epic":
-        prefix = "/epics/"
-    elif entity_type == "file":
-        prefix = "/files/"
-    elif entity_type == "iteration":
-        prefix = "/iterations/"
 
+"""The API path prefix under which each type of imported entity is deleted"""
+DELETE_PATHS = {
+    "story": "/stories/",
+    "epic": "/epics/",
+    "file": "/files/",
+    "iteration": "/iterations/",
+}
+
+"""
+The order in which entities are deleted: stories (and their files) go
+before the epics and iterations they belong to.
+"""
+DELETION_PHASES = [("story", "file"), ("epic", "iteration")]
+
+"""The maximum number of stories deleted in one request to the bulk API"""
+STORY_DELETE_BATCH_SIZE = 100
+
+"""How many times a deletion that failed with a transient error is retried"""
+DELETE_RETRIES = 3
+
+"""The wait before the first retry of failed deletions, doubled for each retry after it"""
+DELETE_RETRY_BACKOFF_SECONDS = 5
+
+
+def _deletion_outcome(entity_type, entity_id, err):
+    """
+    Return the outcome of a deletion that failed with `err`: True if the
+    entity was already deleted, `err` itself if it is transient (timeouts,
+    dropped connections, server errors, and throttling that outlasted the
+    rate limiter's retries), and None otherwise.
+    """
+    status_code = None
+    if isinstance(err, requests.HTTPError) and err.response is not None:
+        status_code = err.response.status_code
+    if status_code == 404:
+        # Already deleted, e.g. by hand or by an earlier run.
+        return True
+    if status_code is None or status_code == 429 or status_code >= 500:
+        return err
+    printerr(f"Unable to delete {entity_type} {entity_id}")
+    printerr(f"Error: {err}")
+    return None
+
+
+def delete_entity(entity_type, entity_id):
+    """
+    Delete an imported entity, returning True once it is gone, None if it
+    could not be deleted, or the transient error to retry it after.
+    """
+    prefix = DELETE_PATHS.get(entity_type)
     if prefix:
         try:
             sc_delete(f"{prefix}{entity_id}")
-        except requests.HTTPError as err:
-            printerr(f"Unable to delete {entity_type} {entity_id}")
-            printerr(f"Error: {err}")
-            return None
+        except requests.RequestException as err:
+            return _deletion_outcome(entity_type, entity_id, err)
 
     return True
 
 
+def _is_batch_error(err):
+    """
+    Return whether a failed bulk deletion could succeed for a smaller batch:
+    the batch may name a story that can't be deleted, or be too large to
+    delete in time.
+    """
+    if isinstance(err, requests.Timeout):
+        return True
+    if isinstance(err, requests.HTTPError) and err.response is not None:
+        status = err.response.status_code
+        return status in (400, 404, 413, 422) or status >= 500
+    return False
+
+
+def delete_stories(stories):
+    """
+    Delete `stories` ((type, id) pairs) with the bulk API, returning each
+    story paired with the outcome of its deletion, as for `delete_entity`.
+
+    When the API rejects a batch, it is split in half and each half
+    retried, until the story causing the problem is isolated.
+    """
+    story_ids = [int(story_id) for _, story_id in stories]
+    try:
+        sc_delete("/stories/bulk", {"story_ids": story_ids})
+    except requests.RequestException as err:
+        if len(stories) > 1 and _is_batch_error(err):
+            logger.info(
+                "Bulk deletion of %d stories failed (%s), splitting the batch",
+                len(stories),
+                err,
+            )
+            half = len(stories) // 2
+            return delete_stories(stories[:half]) + delete_stories(stories[half:])
+        return [(story, _deletion_outcome(*story, err)) for story in stories]
+    return [(story, True) for story in stories]
+
+
+def deletion_jobs(entities):
+    """
+    Split `entities` into units of work: stories in bulk batches of up to
+    `STORY_DELETE_BATCH_SIZE`, and every other entity on its own.
+    """
+    stories = [entity for entity in entities if entity[0] == "story"]
+    jobs = [
+        stories[i : i + STORY_DELETE_BATCH_SIZE]
+        for i in range(0, len(stories), STORY_DELETE_BATCH_SIZE)
+    ]
+    jobs.extend([entity] for entity in entities if entity[0] != "story")
+    return jobs
+
+
+def run_deletion_job(job):
+    if job[0][0] == "story":
+        return delete_stories(job)
+    return [(job[0], delete_entity(*job[0]))]
+
+
+class DeletionProgress:
+    """
+    Periodically print how many entities have been deleted, and an estimate
+    of how long the rest will take.
+    """
+
+    def __init__(self, total, interval_seconds=10, clock=time.monotonic):
+        self.total = total
+        self.done = 0
+        self.interval_seconds = interval_seconds
+        self.clock = clock
+        self.started_at = clock()
+        self.printed_at = self.started_at
+        self._lock = threading.Lock()
+
+    def eta_seconds(self, now=None):
+        elapsed = (self.clock() if now is None else now) - self.started_at
+        if not self.done or elapsed <= 0:
+            return None
+        return (self.total - self.done) * elapsed / self.done
+
+    def line(self, now=None):
+        percent = 100 * self.done / self.total if self.total else 100
+        eta = self.eta_seconds(now)
+        eta = "unknown" if eta is None else str(timedelta(seconds=round(eta)))
+        return f"Deleted {self.done}/{self.total} ({percent:.1f}%), time left: {eta}"
+
+    def advance(self, n=1):
+        with self._lock:
+            self.done += n
+            now = self.clock()
+            if (
+                now - self.printed_at >= self.interval_seconds
+                or self.done == self.total
+            ):
+                self.printed_at = now
+                printerr(self.line(now))
+
+
+def deletion_phases(entities):
+    """
+    Group `entities` ((type, id) pairs) into the phases they are deleted in.
+    Entities of types outside `DELETION_PHASES` go in the last phase.
+    """
+    phases = [[] for _ in DELETION_PHASES]
+    for entity in entities:
+        for phase, entity_types in zip(phases, DELETION_PHASES):
+            if entity[0] in entity_types:
+                phase.append(entity)
+                break
+        else:
+            phases[-1].append(entity)
+    return phases
+
+
+def delete_entities(
+    entities, deletion_log, max_workers=1, progress=None, sleep=time.sleep
+):
+    """
+    Delete `entities` ((type, id) pairs) phase by phase, from up to
+    `max_workers` threads, recording each deletion in `deletion_log`.
+    Stories are deleted in bulk, and other entities one at a time.
+
+    Deletions that fail with a transient error are retried, with backoff,
+    once the rest of their phase is done. Returns a Counter of the entities
+    deleted by type, and a list of the entities that could not be deleted.
+    """
+    counter = Counter()
+    failed = []
+
+    def finish(entity, deleted):
+        if deleted:
+            counter[entity[0]] += 1
+            deletion_log.record(*entity)
+        else:
+            failed.append(entity)
+        if progress:
+            progress.advance()
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for pending in deletion_phases(entities):
+            for attempt in range(DELETE_RETRIES + 1):
+                if not pending:
+                    break
+                if attempt:
+                    printerr(
+                        f"[Warning] Retrying {len(pending)} deletions that failed with transient errors"
+                    )
+                    sleep(DELETE_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+                futures = [
+                    executor.submit(run_deletion_job, job)
+                    for job in deletion_jobs(pending)
+                ]
+                retries = []
+                for future in as_completed(futures):
+                    for entity, outcome in future.result():
+                        if isinstance(outcome, Exception):
+                            logger.debug(
+                                "Will retry deleting %s %s: %s", *entity, outcome
+                            )
+                            retries.append(entity)
+                        else:
+                            finish(entity, outcome)
+                pending = retries
+            for entity in pending:
+                printerr(
+                    f"[Problem] Unable to delete {entity[0]} {entity[1]} after {DELETE_RETRIES} retries"
+                )
+                finish(entity, None)
+
+    return counter, failed
+
+
+def read_imported_entities(csv_file=shortcut_imported_entities_csv):
+    with open(csv_file) as csvfile:
+        return [(row["type"], row["id"]) for row in csv.DictReader(csvfile)]
+
+
 def main(argv):
     args = parser.parse_args(argv[1:])
     if args.debug:
@@ -49,31 +275,56 @@ def main(argv):
     # We need to make API requests before fully validating local config.
     validate_environment()
 
-    counter = Counter()
-    with open(shortcut_imported_entities_csv) as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            entity_id = row["id"]
-            entity_type = row["type"]
-
-            if args.apply:
-                if delete_entity(entity_type, entity_id):
-                    counter[entity_type] += 1
-                    # Enhancement: This can be replaced with a link to a relevant label,
-                    # which is done during import because there is a trivially simple
-                    # place in the import code flow to print the Shortcut-provided
-                    # app_url for the import-specific label.
-                    print("Deleted {} {}".format(entity_type, entity_id))
-            else:
-                counter[entity_type] += 1
+    entities = read_imported_entities()
+    deletion_log = DeletionLog()
+    remaining = [entity for entity in entities if entity not in deletion_log]
+    if len(remaining) < len(entities):
+        print(
+            f"Skipping {len(entities) - len(remaining)} entities already deleted, as recorded in {deletion_log.csv_file}"
+        )
 
     if not args.apply:
+        counter = Counter(entity_type for entity_type, _ in remaining)
         print("Dry run! Rerun with --apply to actually delete!")
+        if counter:
+            print("Deletion stats")
+            print_stats(counter)
+        return 0
+
+    workers = configure_concurrency(args.workers)
+    try:
+        counter, failed = delete_entities(
+            remaining,
+            deletion_log,
+            max_workers=workers,
+            progress=DeletionProgress(len(remaining)),
+        )
+    finally:
+        deletion_log.close()
+
+    # Deleted files must be uploaded again by the next import.
+    deleted_file_ids = [
+        entity_id
+        for entity_type, entity_id in entities
+        if entity_type == "file" and (entity_type, entity_id) in deletion_log
+    ]
+    if deleted_file_ids and os.path.isfile(shortcut_uploaded_files_csv):
+        UploadManifest().forget(deleted_file_ids)
 
     if counter:
         print("Deletion stats")
         print_stats(counter)
 
+    if failed:
+        printerr(
+            f"[Warning] {len(failed)} entities could not be deleted. Rerun to retry them; the entities already deleted are recorded in {deletion_log.csv_file} and will be skipped."
+        )
+        return 1
+
+    # Everything is deleted, so the next import starts from a clean slate.
+    deletion_log.remove()
+    return 0
+
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv))
@@ -0,0 +1,108 @@
+import os
+import tempfile
+
+import pytest
+import requests
+
+import delete_imported_entities
+from delete_imported_entities import *
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def http_error(status_code):
+    return requests.HTTPError(
+        f"{status_code} Error", response=FakeResponse(status_code)
+    )
+
+
+def test_deletion_phases():
+    entities = [
+        ("epic", "1"),
+        ("story", "2"),
+        ("iteration", "3"),
+        ("label", "4"),
+        ("file", "5"),
+    ]
+    assert [
+        [("story", "2"), ("file", "5")],
+        [("epic", "1"), ("iteration", "3"), ("label", "4")],
+    ] == deletion_phases(entities)
+
+
+def test_delete_entities(monkeypatch):
+    deleted = []
+    transient_errors = [http_error(503)]
+
+    def fake_sc_delete(path, data=None):
+        story_ids = data["story_ids"] if data else []
+        if 3 in story_ids:
+            raise http_error(400)
+        if story_ids == [2] and transient_errors:
+            raise transient_errors.pop()
+        deleted.extend(story_ids or [path])
+
+    monkeypatch.setattr(delete_imported_entities, "sc_delete", fake_sc_delete)
+    sleeps = []
+    entities = [
+        ("epic", "10"),
+        ("story", "1"),
+        ("story", "2"),
+        ("story", "3"),
+        ("iteration", "20"),
+    ]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        log_file = os.path.join(tmpdir, "deleted.csv")
+        deletion_log = DeletionLog(log_file)
+        counter, failed = delete_entities(
+            entities, deletion_log, max_workers=4, sleep=sleeps.append
+        )
+        deletion_log.close()
+
+        assert {"story": 2, "epic": 1, "iteration": 1} == counter
+        assert [("story", "3")] == failed
+        # the transient failure is retried once the rest of its phase is done
+        assert [DELETE_RETRY_BACKOFF_SECONDS] == sleeps
+        # stories are deleted before their epics and iterations
+        assert [1, 2] == deleted[:2]
+        assert {"/epics/10", "/iterations/20"} == set(deleted[2:])
+
+        # an interrupted deletion resumes where it stopped
+        deletion_log = DeletionLog(log_file)
+        assert 4 == len(deletion_log)
+        assert ("story", 2) in deletion_log
+        assert ("story", "3") not in deletion_log
+        deletion_log.remove()
+        assert not os.path.exists(log_file)
+
+
+def test_delete_stories_in_bulk(monkeypatch):
+    sent = []
+    monkeypatch.setattr(
+        delete_imported_entities,
+        "sc_delete",
+        lambda path, data=None: sent.append((path, len(data["story_ids"]))),
+    )
+    stories = [("story", str(i)) for i in range(250)]
+    assert 3 == len(deletion_jobs(stories + [("epic", "1")])) - 1
+    outcomes = [
+        outcome for job in deletion_jobs(stories) for outcome in run_deletion_job(job)
+    ]
+    assert [(story, True) for story in stories] == outcomes
+    assert [
+        ("/stories/bulk", 100),
+        ("/stories/bulk", 100),
+        ("/stories/bulk", 50),
+    ] == sent
+
+
+def test_deletion_progress(capsys):
+    clock = iter([0, 5, 10, 20]).__next__
+    progress = DeletionProgress(4, interval_seconds=10, clock=clock)
+    progress.advance()
+    assert "" == capsys.readouterr().err
+    progress.advance()
+    assert "Deleted 2/4 (50.0%), time left: 0:00:10\n" == capsys.readouterr().err
@@ -19,6 +19,7 @@ import csv
 import difflib
 import logging
 import sys
+from collections import Counter
 
 
 from lib import *
@@ -28,6 +29,11 @@ parser = argparse.ArgumentParser(
     description="""Run this script with no arguments to configure how story state and users will be mapped from Pivotal to Shortcut.""",
 )
 parser.add_argument("--debug", action="store_true", help="Turns on debugging logs")
+parser.add_argument(
+    "--refresh",
+    action="store_true",
+    help="Revalidates cached workspace metadata (groups, workflows, custom fields, members)",
+)
 
 # Logging
 logger = logging.getLogger(__name__)
@@ -248,7 +254,7 @@ def pt_state_mapping_for_workflow(workflow_id):
     If no mapping can be determined automatically for a particular Pivotal Tracker
     state, then it is mapped to `None`.
     """
-    workflow = sc_get(f"/workflows/{workflow_id}")
+    workflow = sc_get_cached(f"/workflows/{workflow_id}")
     pt_state_mapping = {k: None for k in pt_all_states}
     for wf_state in workflow["states"]:
         match (wf_state["type"], wf_state["name"]):
@@ -301,6 +307,37 @@ def pt_state_mapping_for_workflow(workflow_id):
     return pt_state_mapping
 
 
+users_csv_fields = ["pt_user_name", "shortcut_user_email", "shortcut_user_mention_name"]
+
+
+def write_pt_user_rows(writer, pt_users, user_matching_map, user_trigram_index):
+    """
+    Write a users.csv row for each of `pt_users`, mapped to the Shortcut user
+    with a matching name if there is one. Returns the users left unmapped.
+    """
+    unmapped_pt_users = []
+    for pt_user in pt_users:
+        user_info = find_sc_user_from_pt_user(
+            pt_user, user_matching_map, user_trigram_index
+        )
+        email = ""
+        mention_name = ""
+        if not user_info:
+            unmapped_pt_users.append(pt_user)
+        else:
+            email = user_info["email"]
+            mention_name = user_info["mention_name"]
+
+        writer.writerow(
+            {
+                "pt_user_name": pt_user,
+                "shortcut_user_email": email,
+                "shortcut_user_mention_name": mention_name,
+            }
+        )
+    return unmapped_pt_users
+
+
 def populate_users_csv(users_csv_file, pt_csv_file):
     """
     Writes a CSV file mapping the users found in the Pivotal Tracker export with
@@ -320,33 +357,19 @@ def populate_users_csv(users_csv_file, pt_csv_file):
     period, or (b) reach out to support@shortcut.com to request assistance so you're not
     billed for extraneous users.
     """
-    sc_users = fetch_members()
+    sc_users = load_members()
     user_matching_map = _build_user_matching_map(sc_users)
+    user_trigram_index = _build_user_trigram_index(user_matching_map)
     try:
         with open(users_csv_file, "x") as f:
-            pt_all_users = sorted(extract_pt_users(pt_csv_file))
-            unmapped_pt_users = []
-            writer = csv.DictWriter(
-                f, ["pt_user_name", "shortcut_user_email", "shortcut_user_mention_name"]
-            )
+            writer = csv.DictWriter(f, users_csv_fields)
             writer.writeheader()
-            for pt_user in pt_all_users:
-                user_info = find_sc_user_from_pt_user(pt_user, user_matching_map)
-                email = ""
-                mention_name = ""
-                if not user_info:
-                    unmapped_pt_users.append(pt_user)
-                else:
-                    email = user_info["email"]
-                    mention_name = user_info["mention_name"]
-
-                writer.writerow(
-                    {
-                        "pt_user_name": pt_user,
-                        "shortcut_user_email": email,
-                        "shortcut_user_mention_name": mention_name,
-                    }
-                )
+            unmapped_pt_users = write_pt_user_rows(
+                writer,
+                sorted(extract_pt_users(pt_csv_file)),
+                user_matching_map,
+                user_trigram_index,
+            )
             if unmapped_pt_users:
                 exit_unmapped_pt_users(users_csv_file, unmapped_pt_users, sc_users)
     except FileExistsError:
@@ -355,13 +378,26 @@ def populate_users_csv(users_csv_file, pt_csv_file):
         invited_emails = set(
             [user_info["email"] for user_info in user_matching_map.values()]
         )
+        mapped_pt_users = set()
         with open(users_csv_file, "r", newline="") as f:
             reader = csv.DictReader(f)
             for row in reader:
+                mapped_pt_users.add(row["pt_user_name"])
                 if not row["shortcut_user_email"]:
                     unmapped_pt_users.append(row["pt_user_name"])
                 elif row["shortcut_user_email"] not in invited_emails:
                     uninvited_pt_users.append(row["shortcut_user_email"])
+        # the export may have been replaced since users.csv was written
+        new_pt_users = sorted(extract_pt_users(pt_csv_file) - mapped_pt_users)
+        if new_pt_users:
+            print(
+                f"Adding {len(new_pt_users)} Pivotal Tracker users found in {pt_csv_file} to {users_csv_file}"
+            )
+            with open(users_csv_file, "a") as f:
+                writer = csv.DictWriter(f, users_csv_fields)
+                unmapped_pt_users += write_pt_user_rows(
+                    writer, new_pt_users, user_matching_map, user_trigram_index
+                )
         if unmapped_pt_users:
             exit_unmapped_pt_users(users_csv_file, unmapped_pt_users, sc_users)
         if uninvited_pt_users:
@@ -375,9 +411,9 @@ def parse_comment_author(s):
 
     Returns None if the comment wasn't parsable.
     """
-    comment_data = parse_comment(s)
-    if comment_data is not None:
-        return comment_data["author"]
+    parts = split_comment(s)
+    if parts is not None:
+        return parts[1].strip()
     else:
         return None
 
@@ -390,9 +426,10 @@ user_cols = {
 }
 
 
-def extract_pt_users_from_row(row, header):
+def compile_user_extractor(header):
     """
-    Extract all Pivotal users from a given CSV row.
+    Return a function that extracts all Pivotal users from a CSV row with
+    the given (lowercased) `header`.
 
     Pivotal's CSV is structured such that only one user is specified
     per "cell" of the sheet.
@@ -402,44 +439,122 @@ def extract_pt_users_from_row(row, header):
      - Owned By (value itself)
      - Reviewer (value itself)
      - Comment (authorship is indicated by a suffix)
+
+    All other columns are skipped without being looked at.
+    """
+    user_columns = [
+        (ix, user_cols[col]) for ix, col in enumerate(header) if col in user_cols
+    ]
+
+    def extract(row):
+        users_in_row = set()
+        row_len = len(row)
+        for ix, translator in user_columns:
+            if ix < row_len:
+                v = row[ix].strip()
+                if v:
+                    user = translator(v)
+                    if user is not None:
+                        users_in_row.add(user)
+        return users_in_row
+
+    return extract
+
+
+def build_export_profile(pt_csv_file):
+    """
+    Scan the Pivotal export once, returning a profile of it for
+    `write_export_profile`:
+    - users: every Pivotal user found (see `compile_user_extractor`)
+    - items: the type, id, title and labels (as exported) of each row
     """
-    users_in_row = set()
-    for ix, val in enumerate(row):
-        v = val.strip()
-        if not v:
-            continue
+    with open(pt_csv_file, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = [col.lower() for col in next(reader)]
+        column = {col: ix for ix, col in reversed(list(enumerate(header)))}
+        extract_users = compile_user_extractor(header)
 
-        col = header[ix]
-        if col in user_cols:
-            translator = user_cols[col]
-            user = translator(v)
-            if user is not None:
-                users_in_row.add(user)
-    return users_in_row
+        def cell(row, col):
+            ix = column.get(col)
+            return row[ix] if ix is not None and ix < len(row) else ""
+
+        users = set()
+        items = []
+        for row in reader:
+            users.update(extract_users(row))
+            items.append(
+                [
+                    cell(row, "type"),
+                    cell(row, "id"),
+                    cell(row, "title"),
+                    cell(row, "labels"),
+                ]
+            )
+
+    return {
+        "version": export_profile_version,
+        "source": export_file_signature(pt_csv_file),
+        "users": sorted(users),
+        "items": items,
+    }
+
+
+def export_profile(pt_csv_file):
+    """
+    Return the profile of the Pivotal export, from
+    data/pivotal_export_profile.json if it describes the export as it is
+    now, or else by scanning the export and saving its profile there.
+    """
+    profile = load_export_profile(pt_csv_file)
+    if profile is None:
+        profile = build_export_profile(pt_csv_file)
+        write_export_profile(profile)
+    return profile
 
 
 def extract_pt_users(pt_csv_file):
     """
     Given the Pivotal export CSV, return a unique set of all users found in all rows.
     """
-    pt_users = set()
-    with open(pt_csv_file) as csvfile:
-        reader = csv.reader(csvfile)
-        header = [col.lower() for col in next(reader)]
-        for row in reader:
-            pt_users.update(extract_pt_users_from_row(row, header))
-    return pt_users
+    return set(export_profile(pt_csv_file)["users"])
 
 
 def _casefold_then_remove_spaces_and_specials(s):
     return re.sub(r"[\W_]", "", s.casefold())
 
 
-def find_sc_user_from_pt_user(pt_user, user_map):
+"""The number of most similar Shortcut users the fuzzy user match is chosen from."""
+USER_MATCH_CANDIDATES = 50
+
+
+def _trigrams(s):
+    # padded so short names and the start and end of names have trigrams too
+    padded = f"  {s} "
+    return {padded[ix : ix + 3] for ix in range(len(padded) - 2)}
+
+
+def _build_user_trigram_index(user_map):
+    """
+    Return a dict mapping each trigram (three-character substring) of the
+    keys of `user_map` to the keys containing it.
+    """
+    index = {}
+    for key in user_map:
+        for trigram in _trigrams(key):
+            index.setdefault(trigram, []).append(key)
+    return index
+
+
+def find_sc_user_from_pt_user(pt_user, user_map, trigram_index=None):
     """
     Return the Shortcut user that maps to the given Pivotal user.
     Compares full names (since that is was the Pivotal export contains).
 
+    Names without an exact match are matched fuzzily: the keys of
+    `user_map` sharing the most trigrams with the name are shortlisted
+    using `trigram_index` (built from `user_map` if not given), and the
+    closest of those is chosen with `difflib.get_close_matches`.
+
     Return None if a suitable Shortcut user could not be identified.
     """
     simplified_user = _casefold_then_remove_spaces_and_specials(pt_user)
@@ -449,9 +564,14 @@ def find_sc_user_from_pt_user(pt_user, user_map):
         logger.debug("Found user %s: %s", pt_user, user_info)
         return user_info
 
-    all_identifiers = user_map.keys()
+    if trigram_index is None:
+        trigram_index = _build_user_trigram_index(user_map)
+    shared_trigrams = Counter()
+    for trigram in _trigrams(simplified_user):
+        shared_trigrams.update(trigram_index.get(trigram, ()))
+    candidates = [key for key, _ in shared_trigrams.most_common(USER_MATCH_CANDIDATES)]
 
-    best_matches = difflib.get_close_matches(simplified_user, all_identifiers)
+    best_matches = difflib.get_close_matches(simplified_user, candidates)
     if best_matches:
         return user_map[best_matches[0]]
 
@@ -554,23 +674,29 @@ def main(argv):
     args = parser.parse_args(argv[1:])
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
+    configure_metadata_cache(refresh=args.refresh)
 
     # We need to make API requests before fully validating local config.
     validate_environment()
 
     # Ensure local data/shortcut_*.csv files are populated with user's workspace data,
     # so they can review what's available for mapping in the steps that follow.
-    custom_fields = sc_get("/custom-fields")
+    # people may have just been invited, so members are always revalidated
+    write_members_snapshot(fetch_members(refresh=True))
+    custom_fields = sc_get_cached("/custom-fields")
     write_custom_fields_tree(custom_fields)
-    groups = sc_get("/groups")
+    groups = sc_get_cached("/groups")
     write_groups_tree(groups)
-    workflows = sc_get("/workflows")
+    workflows = sc_get_cached("/workflows")
     write_workflows_tree(workflows)
 
     # Configuration consists of the environment variable SHORTCUT_API_TOKEN and all values
     # found in the local config.json file (which is written by this script if absent).
     cfg = load_config()
 
+    # Profile the Pivotal export, unless the saved profile describes it as it is now.
+    export_profile(cfg["pt_csv_file"])
+
     # Populate local data/priorities.csv, data/states.csv, and data/users.csv files,
     # automatically where possible, and print problems to the console where mappings
     # are not 100% complete.
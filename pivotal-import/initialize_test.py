@@ -0,0 +1,82 @@
+from initialize import *
+from initialize import _build_user_matching_map, _build_user_trigram_index
+
+
+def create_test_users():
+    return [
+        {"name": "Amy Williams", "mention_name": "amy", "email": "amy@example.com"},
+        {
+            "name": "Daniel McFadden",
+            "mention_name": "daniel",
+            "email": "daniel@example.com",
+        },
+        {
+            "name": "Emmanuelle Charpentier",
+            "mention_name": "emmanuelle",
+            "email": "emmanuelle@example.com",
+        },
+    ]
+
+
+def test_find_sc_user_from_pt_user_exact():
+    user_map = _build_user_matching_map(create_test_users())
+    assert (
+        "amy@example.com"
+        == find_sc_user_from_pt_user("amy williams", user_map)["email"]
+    )
+
+
+def test_find_sc_user_from_pt_user_fuzzy():
+    user_map = _build_user_matching_map(create_test_users())
+    trigram_index = _build_user_trigram_index(user_map)
+    for pt_user in ["Daniel McFaddenn", "Daniel J. McFadden", "Dan McFadden"]:
+        user_info = find_sc_user_from_pt_user(pt_user, user_map, trigram_index)
+        assert "daniel@example.com" == user_info["email"]
+    assert find_sc_user_from_pt_user("Giorgio Parisi", user_map, trigram_index) is None
+
+
+def test_parse_comment_author():
+    assert "Amy Williams" == parse_comment_author(
+        "Looks good (to me) (Amy Williams - Oct 15, 2024)"
+    )
+    assert parse_comment_author("A comment without a suffix") is None
+
+
+def test_build_export_profile(tmp_path):
+    pt_csv_file = tmp_path / "pivotal_export.csv"
+    pt_csv_file.write_text(
+        "Id,Title,Labels,Iteration,Iteration Start,Iteration End,Type,Current State,Priority,Requested By,Description,Comment\n"
+        "1,An Epic,an epic,,,,epic,,,,,\n"
+        '2,A Story,"an epic, ui",3,"Oct 7, 2024","Oct 14, 2024",feature,started,p2 - Medium,Amy Williams,"two\nlines","Done (Daniel McFadden - Oct 8, 2024)"\n',
+        encoding="utf-8",
+    )
+    profile = build_export_profile(str(pt_csv_file))
+
+    assert ["Amy Williams", "Daniel McFadden"] == profile["users"]
+    assert ["feature", "2", "A Story", "an epic, ui"] == profile["items"][1]
+
+    profile_file = str(tmp_path / "profile.json")
+    write_export_profile(profile, profile_file)
+    assert profile == load_export_profile(str(pt_csv_file), profile_file)
+    pt_csv_file.write_text("Id\n", encoding="utf-8")
+    assert load_export_profile(str(pt_csv_file), profile_file) is None
+
+
+def test_populate_users_csv_adds_new_export_users(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("data")
+    monkeypatch.setattr("initialize.load_members", create_test_users)
+    with open("data/pivotal_export.csv", "w", encoding="utf-8") as f:
+        f.write("Id,Title,Type,Requested By\n1,A Story,feature,Amy Williams\n")
+    populate_users_csv("data/users.csv", "data/pivotal_export.csv")
+
+    # a replaced export has users that data/users.csv doesn't have yet
+    with open("data/pivotal_export.csv", "a", encoding="utf-8") as f:
+        f.write("2,Another Story,feature,Daniel McFadden\n")
+    populate_users_csv("data/users.csv", "data/pivotal_export.csv")
+
+    with open("data/users.csv", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert ["amy@example.com", "daniel@example.com"] == [
+        row["shortcut_user_email"] for row in rows
+    ]
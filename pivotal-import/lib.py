@@ -5,9 +5,13 @@ environment variable.
 
 """
 
+from collections import deque
 from collections.abc import Mapping
-from copy import deepcopy
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from email.utils import parsedate_to_datetime
+import functools
+import hashlib
 import mimetypes
 import re
 import sys
@@ -15,9 +19,12 @@ import csv
 import json
 import os
 import logging
+import threading
+import time
+from types import MappingProxyType
 
-from pyrate_limiter import Duration, InMemoryBucket, Limiter, Rate
 import requests
+from requests.adapters import HTTPAdapter
 
 # Logging
 logger = logging.getLogger(__name__)
@@ -26,36 +33,197 @@ logger = logging.getLogger(__name__)
 # The Shortcut API limit is 200 per minute; the 200th request within 60 seconds
 # will receive an HTTP 429 response.
 #
-# The rate limiting config below sets an in-memory limit that is just below
-# Shortcut's rate limit to reduce the possibility of being throttled, and sets
-# the amount of time it will wait once it reaches that limit to just
-# over a minute to account for possible computer clock differences.
+# Rather than a fixed in-memory limit, the importer uses a limiter that adapts
+# to the feedback the API gives it. It never sends more requests in a minute
+# (its burst included) than stay below the limit the API reports, or
+# Shortcut's documented limit if it reports none, and:
+#  - paces requests to the remaining budget when the API reports one through
+#    rate limit response headers;
+#  - otherwise probes upward after successful requests, up to that ceiling;
+#  - backs off multiplicatively on a 429, pausing every request for as long as
+#    the response's Retry-After header asks, or else until the rate limit
+#    window frees up.
+# Requests that receive a 429 are retried transparently.
 max_requests_per_minute = 200
-rate = Rate(max_requests_per_minute - 5, Duration.MINUTE)
-bucket = InMemoryBucket([rate])
-max_limiter_delay_seconds = 70
-limiter = Limiter(
-    bucket, raise_when_fail=True, max_delay=Duration.SECOND * max_limiter_delay_seconds
-)
+min_requests_per_minute = 20
+max_throttle_retries = 5
+rate_limit_window_seconds = 60
+
+
+def parse_retry_after(value, now=None):
+    """
+    Return the number of seconds a Retry-After header value asks clients
+    to wait, or None if it is absent or unparsable.
+
+    The header may be either a number of seconds or an HTTP date.
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    now = now or datetime.now(timezone.utc)
+    return max(0.0, (retry_at - now).total_seconds())
 
 
-def rate_mapping(*args, **kwargs):
-    return "shortcut-api-request", 1
+def _header_number(resp_headers, *names):
+    for name in names:
+        value = resp_headers.get(name)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    return None
 
 
-rate_decorator = limiter.as_decorator()
+class AdaptiveRateLimiter:
+    """
+    A thread-safe token bucket whose rate follows the API's rate limit feedback.
+
+    Call `acquire()` before sending each request and `observe(resp)` with
+    each response. `observe` returns the number of seconds to wait before
+    retrying when the response was a 429, else None.
+
+    `max_rate` is the API's limit of requests per minute. So that a full
+    bucket sent at once can't take a minute's requests up to it, the rate
+    never exceeds `max_rate - burst - 1` (see `ceiling`).
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=max_requests_per_minute,
+        min_rate=min_requests_per_minute,
+        max_rate=max_requests_per_minute,
+        burst=5,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.burst = burst
+        self.rate = min(float(requests_per_minute), self.ceiling())
+        self.tokens = float(burst)
+        self.clock = clock
+        self.sleep = sleep
+        self.updated_at = clock()
+        self.paused_until = 0.0
+        self.throttled_count = 0
+        self.waited_seconds = 0.0
+        # when each request of the current rate limit window was sent
+        self.sent_at = deque()
+        self._lock = threading.Lock()
+
+    def ceiling(self):
+        """The highest rate that keeps a minute's requests below `max_rate`."""
+        return max(self.min_rate, self.max_rate - self.burst - 1)
+
+    def _forget_sent_before_window(self, now):
+        while self.sent_at and self.sent_at[0] <= now - rate_limit_window_seconds:
+            self.sent_at.popleft()
+
+    def _window_remainder(self, now):
+        """
+        Return the seconds until the oldest request sent within the rate
+        limit window leaves it, or the whole window if none were sent.
+        """
+        self._forget_sent_before_window(now)
+        if not self.sent_at:
+            return float(rate_limit_window_seconds)
+        return self.sent_at[0] + rate_limit_window_seconds - now
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate / 60)
+        self.updated_at = now
+
+    def acquire(self):
+        """Block until a request may be sent, then consume one token."""
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._refill(now)
+                wait = self.paused_until - now
+                if wait <= 0:
+                    # Allow for floating point error in the refill arithmetic.
+                    if self.tokens >= 1 - 1e-9:
+                        self.tokens = max(0.0, self.tokens - 1)
+                        self._forget_sent_before_window(now)
+                        self.sent_at.append(now)
+                        return
+                    wait = (1 - self.tokens) * 60 / self.rate
+                self.waited_seconds += wait
+            self.sleep(wait)
+
+    def observe(self, resp):
+        """Adjust the rate according to the status and headers of `resp`."""
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            resp_headers = resp.headers
+            limit = _header_number(resp_headers, "X-RateLimit-Limit", "RateLimit-Limit")
+            if limit:
+                self.max_rate = max(self.min_rate, limit)
+                self.rate = min(self.rate, self.ceiling())
+
+            if resp.status_code == 429:
+                self.throttled_count += 1
+                self.rate = max(self.min_rate, self.rate * 0.75)
+                self.tokens = 0.0
+                retry_after = parse_retry_after(resp_headers.get("Retry-After"))
+                if retry_after is None:
+                    retry_after = self._window_remainder(now)
+                self.paused_until = max(self.paused_until, now + retry_after)
+                logger.debug(
+                    "Throttled by the API; retrying in %.1fs at %.1f requests/minute",
+                    retry_after,
+                    self.rate,
+                )
+                return retry_after
+
+            remaining = _header_number(
+                resp_headers, "X-RateLimit-Remaining", "RateLimit-Remaining"
+            )
+            reset = _header_number(resp_headers, "X-RateLimit-Reset", "RateLimit-Reset")
+            if remaining is not None and reset is not None:
+                # The reset may be given as an epoch timestamp or as seconds from now.
+                reset_in = reset - time.time() if reset > 1e9 else reset
+                reset_in = max(1.0, reset_in)
+                if remaining < 1:
+                    self.tokens = 0.0
+                    self.paused_until = max(self.paused_until, now + reset_in)
+                else:
+                    headroom_rate = remaining / reset_in * 60
+                    self.rate = min(self.ceiling(), max(self.min_rate, headroom_rate))
+            elif resp.status_code < 400:
+                # Additive increase: ramp back up by one request per minute
+                # for every few successful requests.
+                self.rate = min(self.ceiling(), self.rate + 0.25)
+            return None
+
+
+limiter = AdaptiveRateLimiter()
 
 
 def print_rate_limiting_explanation():
     printerr(
         f"""[Note] This importer adheres to the Shortcut API rate limit of {max_requests_per_minute} requests per minute.
-       It may pause for up to {max_limiter_delay_seconds} seconds during processing to avoid request throttling."""
+       It adapts its request rate to the limits reported by the API, and pauses when throttled
+       for as long as the API asks (usually up to a minute) before retrying."""
     )
 
 
 # API Helpers
 sc_token = os.getenv("SHORTCUT_API_TOKEN")
-api_url_base = "https://api.app.shortcut.com/api/v3"
+sc_host = os.getenv("SHORTCUT_API_BASE_URL", "https://api.app.shortcut.com").rstrip("/")
+api_url_base = f"{sc_host}/api/v3"
 headers = {
     "Shortcut-Token": sc_token,
     "Accept": "application/json; charset=utf-8",
@@ -63,8 +231,172 @@ headers = {
     "User-Agent": "pivotal-to-shortcut/0.0.1-alpha2",
 }
 
+# Header profiles. The headers each kind of request is sent with never
+# change, so they are built once, read-only, and shared by every request.
+json_headers = MappingProxyType(dict(headers))
+# The Content-Type of a multipart upload carries the body's boundary, so
+# it is added per upload.
+multipart_headers = MappingProxyType(
+    {k: v for k, v in headers.items() if k != "Content-Type"}
+    | {"Accept": "application/json"}
+)
+
+# Connection pooling. All of the API helpers below share a single
+# `requests.Session`, so TCP connections (and their TLS sessions) to the
+# Shortcut API are kept alive and reused instead of being re-established
+# for every request. The pool should be at least as large as the number of
+# requests that may be in flight at once.
+http_pool_maxsize = 10
+
+
+def build_session(pool_maxsize=http_pool_maxsize):
+    """
+    Return a `requests.Session` that keeps up to `pool_maxsize` connections
+    per host alive for reuse.
+    """
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+session = build_session()
+
+
+def configure_session(pool_maxsize):
+    """
+    Replace the shared session with one whose connection pool holds
+    `pool_maxsize` connections, closing the connections of the old one.
+    """
+    global session
+    session.close()
+    session = build_session(pool_maxsize)
+    return session
+
+
+# Concurrency. Independent requests (e.g. creating epics, or uploading files)
+# may be sent from a pool of worker threads. They all share the session and
+# rate limiter above, so concurrency reduces the time spent waiting on round
+# trips without exceeding the API's rate limit.
+max_concurrent_requests = 8
+
+
+def configure_concurrency(max_workers):
+    """
+    Set how many requests may be in flight at once, sizing the shared
+    session's connection pool to match.
+    """
+    global max_concurrent_requests
+    max_concurrent_requests = max(1, max_workers)
+    configure_session(max(http_pool_maxsize, max_concurrent_requests))
+    return max_concurrent_requests
+
+
+def map_concurrently(fn, items, max_workers=None):
+    """
+    Return `[fn(item) for item in items]`, calling `fn` from up to
+    `max_workers` threads (default `max_concurrent_requests`).
+
+    Results are returned in the order of `items`. The first exception
+    raised by `fn` is re-raised once all calls have finished.
+    """
+    items = list(items)
+    if max_workers is None:
+        max_workers = max_concurrent_requests
+    if max_workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = [executor.submit(fn, item) for item in items]
+    return [future.result() for future in futures]
+
+
+class RequestProfiler:
+    """
+    Accumulate where the time of each API request goes, by HTTP method:
+    - wait: waiting on the rate limiter
+    - client: client-side overhead (building and encoding the request,
+      reading and decoding the response, connection pool bookkeeping)
+    - network: from sending the request until the response headers
+      arrived, as measured by requests
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {}
+
+    def record(self, method, wait, client, network):
+        with self._lock:
+            totals = self.totals.setdefault(
+                method, {"requests": 0, "wait": 0.0, "client": 0.0, "network": 0.0}
+            )
+            totals["requests"] += 1
+            totals["wait"] += wait
+            totals["client"] += client
+            totals["network"] += network
+
+    def report(self, file=sys.stderr):
+        """Print the mean time per request of each method to `file`."""
+        print("Request profile (mean ms per request):", file=file)
+        print(
+            f"  {'method':<8}{'requests':>10}{'wait':>10}{'client':>10}{'network':>10}",
+            file=file,
+        )
+        with self._lock:
+            for method, totals in sorted(self.totals.items()):
+                n = totals["requests"]
+                print(
+                    f"  {method:<8}{n:>10}"
+                    + "".join(
+                        f"{totals[k] / n * 1000:>10.1f}"
+                        for k in ["wait", "client", "network"]
+                    ),
+                    file=file,
+                )
+
+
+# When set to a RequestProfiler (see `enable_request_profiling`), the
+# timings of every request are recorded in it.
+request_profiler = None
+
+
+def enable_request_profiling():
+    """Start recording request timings, returning the RequestProfiler."""
+    global request_profiler
+    request_profiler = RequestProfiler()
+    return request_profiler
+
+
+def sc_request(method, url, **kwargs):
+    """
+    Send a rate-limited request with the shared session.
+
+    Requests throttled by the API (HTTP 429) are retried transparently
+    after the delay the API asks for, up to `max_throttle_retries` times.
+    Returns the final response; callers decide how to handle errors.
+    """
+    for attempt in range(max_throttle_retries + 1):
+        start = time.perf_counter()
+        limiter.acquire()
+        sent = time.perf_counter()
+        resp = session.request(method, url, **kwargs)
+        if request_profiler is not None:
+            network = resp.elapsed.total_seconds()
+            request_profiler.record(
+                method,
+                sent - start,
+                max(0.0, time.perf_counter() - sent - network),
+                network,
+            )
+        retry_after = limiter.observe(resp)
+        if retry_after is None or attempt == max_throttle_retries:
+            return resp
+        logger.info(
+            "%s %s was throttled, retrying in %.1f seconds", method, url, retry_after
+        )
+    return resp
+
 
-@rate_decorator(rate_mapping)
 def sc_get(path, params={}):
     """
     Make a GET api call.
@@ -72,15 +404,14 @@ def sc_get(path, params={}):
     Serializes params as url query parameters.
     """
     url = api_url_base + path
-    logger.debug("GET url=%s params=%s headers=%s" % (url, params, headers))
-    resp = requests.get(url, headers=headers, params=params)
+    logger.debug("GET url=%s params=%s headers=%s", url, params, json_headers)
+    resp = sc_request("GET", url, headers=json_headers, params=params)
     if resp.status_code >= 400:
         logger.error(f"\n>>> ERROR GET response: {resp.status_code} {resp.text}\n")
     resp.raise_for_status()
     return resp.json()
 
 
-@rate_decorator(rate_mapping)
 def sc_post(path, data={}):
     """Make a POST api call.
 
@@ -91,15 +422,14 @@ def sc_post(path, data={}):
 
     """
     url = api_url_base + path
-    logger.debug("POST url=%s params=%s headers=%s" % (url, data, headers))
-    resp = requests.post(url, headers=headers, json=data)
+    logger.debug("POST url=%s params=%s headers=%s", url, data, json_headers)
+    resp = sc_request("POST", url, headers=json_headers, json=data)
     if resp.status_code >= 400:
         logger.error(f"\n>>> ERROR POST response: {resp.status_code} {resp.text}\n")
     resp.raise_for_status()
     return resp.json()
 
 
-@rate_decorator(rate_mapping)
 def sc_put(path, data={}):
     """
     Make a PUT api call.
@@ -108,77 +438,560 @@ def sc_put(path, data={}):
     Serializes params as JSON in the request body.
     """
     url = api_url_base + path
-    logger.debug("PUT url=%s params=%s headers=%s" % (url, data, headers))
-    resp = requests.put(url, headers=headers, json=data)
+    logger.debug("PUT url=%s params=%s headers=%s", url, data, json_headers)
+    resp = sc_request("PUT", url, headers=json_headers, json=data)
     if resp.status_code >= 400:
         logger.error(f"\n>>> ERROR PUT response: {resp.status_code} {resp.text}\n")
     resp.raise_for_status()
     return resp.json()
 
 
-@rate_decorator(rate_mapping)
-def sc_upload_files(files):
-    """Upload and associate `files` with the story with given `story_id`"""
+# File uploads. Each file is uploaded in its own request with a multipart
+# body that is streamed from disk, so large attachments are never held in
+# memory in full. Uploads that fail because of network problems or server
+# errors are retried with a backoff; throttled uploads are retried by
+# `sc_request` like any other request.
+upload_retries = 3
+upload_retry_backoff_seconds = 2
+upload_chunk_size = 64 * 1024
+
+
+class MultipartFileBody:
+    """
+    A `multipart/form-data` request body containing a single file, which is
+    read from disk in chunks as the body is sent.
+
+    The body can be iterated more than once, so a request using it can be
+    retried, and it has a known length, so it is sent with a Content-Length
+    header rather than chunked transfer encoding.
+    """
+
+    def __init__(self, path, field_name="file0"):
+        self.path = path
+        self.boundary = os.urandom(16).hex()
+        file_name = os.path.basename(path).replace('"', "%22")
+        self.preamble = (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{file_name}"\r\n'
+            f"Content-Type: {guess_mime_type(path)}\r\n\r\n"
+        ).encode("utf-8")
+        self.epilogue = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self.size = os.path.getsize(path)
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return len(self.preamble) + self.size + len(self.epilogue)
+
+    def __iter__(self):
+        yield self.preamble
+        with open(self.path, "rb") as f:
+            while chunk := f.read(upload_chunk_size):
+                yield chunk
+        yield self.epilogue
+
+
+def file_sha256(path):
+    """Return the hex SHA-256 digest of the file at `path`, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(upload_chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _is_retryable_upload_error(err):
+    if isinstance(err, (requests.ConnectionError, requests.Timeout)):
+        return True
+    return (
+        isinstance(err, requests.HTTPError)
+        and err.response is not None
+        and err.response.status_code >= 500
+    )
+
+
+def sc_upload_file(file, manifest=None):
+    """
+    Upload the file at path `file`, returning the created Shortcut file
+    entity, or None if the upload failed.
+
+    If a `manifest` is given and already records this file (by path and
+    content hash), the recorded entity is returned without uploading it
+    again; otherwise a successful upload is recorded in it.
+    """
     url = f"{api_url_base}/files"
-    logger.debug("POST url=%s files=%s headers=%s" % (url, files, headers))
-    file_entities = []
-    for file in files:
-        try:
-            with open(file, "rb") as f:
-                logger.debug(f"File: {f.name} {guess_mime_type(f.name)}")
-                resp = requests.post(
+    try:
+        sha256 = None
+        if manifest is not None:
+            sha256 = file_sha256(file)
+            file_entity = manifest.get(file, sha256)
+            if file_entity is not None:
+                logger.debug(f"Skipping upload of {file}, already uploaded")
+                return file_entity
+
+        for attempt in range(upload_retries + 1):
+            body = MultipartFileBody(file)
+            logger.debug(f"POST url={url} file={file} {guess_mime_type(file)}")
+            try:
+                resp = sc_request(
+                    "POST",
                     url,
-                    headers=dissoc(headers, "Content-Type")
-                    | {"Accept": "application/json"},
-                    files=[
-                        (
-                            "file0",
-                            (os.path.basename(f.name), f, guess_mime_type(f.name)),
-                        )
-                    ],
+                    headers=multipart_headers | {"Content-Type": body.content_type},
+                    data=body,
                 )
                 logger.debug(f"POST response: {resp.status_code} {resp.text}")
                 resp.raise_for_status()
-                resp_json = resp.json()
-                file_entities.append(resp_json[0])
-        except:
-            printerr(f"[Warning] Failed to upload file {file}")
-    return file_entities
+                break
+            except requests.RequestException as err:
+                if attempt == upload_retries or not _is_retryable_upload_error(err):
+                    raise
+                delay = upload_retry_backoff_seconds * 2**attempt
+                logger.info(f"Upload of {file} failed ({err}), retrying in {delay}s")
+                time.sleep(delay)
+
+        file_entity = resp.json()[0]
+        if manifest is not None:
+            manifest.record(file, sha256, file_entity)
+        return file_entity
+    except (OSError, ValueError, requests.RequestException) as err:
+        printerr(f"[Warning] Failed to upload file {file}: {err}")
+        return None
 
 
-@rate_decorator(rate_mapping)
-def sc_delete(path):
+def sc_delete(path, data=None):
     """
     Make a DELETE api call.
 
-    Typically used to delete an entity.
+    Typically used to delete an entity. Bulk deletions serialize `data`
+    as JSON in the request body.
     """
     url = api_url_base + path
-    logger.debug("DELETE url=%s headers=%s" % (url, headers))
-    resp = requests.delete(url, headers=headers)
+    logger.debug("DELETE url=%s params=%s headers=%s", url, data, json_headers)
+    kwargs = {} if data is None else {"json": data}
+    resp = sc_request("DELETE", url, headers=json_headers, **kwargs)
     if resp.status_code >= 400:
         logger.error(f"\n>>> ERROR DELETE response: {resp.status_code} {resp.text}\n")
     resp.raise_for_status()
     return resp
 
 
+# Workspace metadata cache. Workspace metadata (groups, workflows, custom
+# fields, members) rarely changes, so responses to requests for it are
+# cached on disk, per API token, for `metadata_cache_ttl_seconds`. Once an
+# entry expires, or when the cache is refreshed, it is revalidated with a
+# conditional request if the API sent an ETag or Last-Modified header.
+metadata_cache_ttl_seconds = 24 * 60 * 60
+
+
+def metadata_cache_dir(token=None):
+    """Return the directory metadata fetched from this API host with `token` is cached in."""
+    base = os.getenv("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    token = token if token is not None else (sc_token or "")
+    key = f"{api_url_base}\n{token}"
+    token_hash = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(base, "shortcut-api-cookbook", token_hash)
+
+
+def is_metadata_cache_entry(entry):
+    """
+    Return whether `entry`, as loaded from a cache file, is complete; a
+    partly written or older entry is treated as a cache miss.
+    """
+    return (
+        isinstance(entry, dict)
+        and "body" in entry
+        and isinstance(entry.get("fetched_at"), (int, float))
+    )
+
+
+class MetadataCache:
+    """
+    An on-disk cache of GET responses, one JSON file per request, each
+    holding the response body, when it was fetched, and its validators.
+    """
+
+    def __init__(
+        self,
+        directory=None,
+        ttl_seconds=metadata_cache_ttl_seconds,
+        refresh=False,
+        clock=time.time,
+    ):
+        # computed lazily, so the token can be set after this module loads
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        # when refreshing, every entry is revalidated before it is used
+        self.refresh = refresh
+        self.clock = clock
+
+    def entry_file(self, path, params=None):
+        directory = self.directory or metadata_cache_dir()
+        key = json.dumps([path, params or {}], sort_keys=True)
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(directory, f"{name}.json")
+
+    def load(self, entry_file):
+        """Return the valid entry cached in `entry_file`, if any."""
+        try:
+            with open(entry_file, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if is_metadata_cache_entry(entry) else None
+
+    def store(self, entry_file, entry):
+        try:
+            os.makedirs(os.path.dirname(entry_file), exist_ok=True)
+            tmp_file = f"{entry_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_file, entry_file)
+        except OSError as err:
+            logger.debug("Could not cache %s: %s", entry_file, err)
+
+    def get(self, path, params=None, refresh=False):
+        """
+        Return the body of `GET path`, from the cache if it holds a fresh
+        copy, and otherwise from the API.
+        """
+        entry_file = self.entry_file(path, params)
+        entry = self.load(entry_file)
+        now = self.clock()
+        if (
+            entry is not None
+            and not (refresh or self.refresh)
+            and now - entry["fetched_at"] < self.ttl_seconds
+        ):
+            logger.debug("GET %s served from the metadata cache", path)
+            return entry["body"]
+
+        request_headers = json_headers
+        if entry is not None and (entry.get("etag") or entry.get("last_modified")):
+            request_headers = dict(json_headers)
+            if entry.get("etag"):
+                request_headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                request_headers["If-Modified-Since"] = entry["last_modified"]
+
+        url = api_url_base + path
+        logger.debug("GET url=%s params=%s (metadata)", url, params)
+        resp = sc_request("GET", url, headers=request_headers, params=params or {})
+        if resp.status_code == 304 and entry is not None:
+            logger.debug("GET %s revalidated the metadata cache", path)
+            entry["fetched_at"] = now
+        else:
+            if resp.status_code >= 400:
+                logger.error(
+                    f"\n>>> ERROR GET response: {resp.status_code} {resp.text}\n"
+                )
+            resp.raise_for_status()
+            entry = {
+                "fetched_at": now,
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "body": resp.json(),
+            }
+        self.store(entry_file, entry)
+        return entry["body"]
+
+
+metadata_cache = MetadataCache()
+
+
+def configure_metadata_cache(refresh=False):
+    """
+    With `refresh`, revalidate every cached metadata response before using
+    it, e.g. when the workspace is known to have changed.
+    """
+    metadata_cache.refresh = refresh
+    return metadata_cache
+
+
+def sc_get_cached(path, params=None, refresh=False):
+    """
+    Make a GET api call for slowly-changing workspace metadata, such as
+    /groups or /workflows, through the metadata cache.
+    """
+    return metadata_cache.get(path, params, refresh)
+
+
 def printerr(s):
     print(s, file=sys.stderr)
 
 
 # File locations
 data_pivotal_export_csv = "data/pivotal_export.csv"
+data_pivotal_export_profile_json = "data/pivotal_export_profile.json"
 data_priorities_csv = "data/priorities.csv"
 data_states_csv = "data/states.csv"
 data_users_csv = "data/users.csv"
 emails_to_invite = "data/emails_to_invite.csv"
 shortcut_custom_fields_csv = "data/shortcut_custom_fields.csv"
+shortcut_deleted_entities_csv = "data/shortcut_deleted_entities.csv"
 shortcut_groups_csv = "data/shortcut_groups.csv"
 shortcut_imported_entities_csv = "data/shortcut_imported_entities.csv"
+shortcut_members_json = "data/shortcut_members.json"
+shortcut_import_journal_jsonl = "data/shortcut_import_journal.jsonl"
+shortcut_uploaded_files_csv = "data/shortcut_uploaded_files.csv"
 shortcut_users_csv = "data/shortcut_users.csv"
 shortcut_workflows_csv = "data/shortcut_workflows.csv"
 
 
+class UploadManifest:
+    """
+    A record of files already uploaded to Shortcut, keyed by file path and
+    content hash, persisted to `csv_file` as each upload completes so that
+    re-runs of the importer can skip files that were already uploaded.
+    """
+
+    fieldnames = ["path", "sha256", "id", "name", "url"]
+
+    def __init__(self, csv_file=None):
+        self.csv_file = csv_file or shortcut_uploaded_files_csv
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(self.csv_file):
+            with open(self.csv_file, newline="") as f:
+                for row in csv.DictReader(f):
+                    self.entries[(row["path"], row["sha256"])] = {
+                        "id": int(row["id"]),
+                        "entity_type": "file",
+                        "name": row["name"],
+                        "url": row["url"],
+                    }
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def _csv_row(path, sha256, file_entity):
+        return {
+            "path": path,
+            "sha256": sha256,
+            "id": file_entity["id"],
+            "name": file_entity.get("name"),
+            "url": file_entity.get("url"),
+        }
+
+    def get(self, path, sha256):
+        return self.entries.get((path, sha256))
+
+    def record(self, path, sha256, file_entity):
+        with self._lock:
+            self.entries[(path, sha256)] = file_entity
+            is_new_file = not os.path.isfile(self.csv_file)
+            with open(self.csv_file, "a", newline="") as f:
+                writer = csv.DictWriter(f, self.fieldnames)
+                if is_new_file:
+                    writer.writeheader()
+                writer.writerow(self._csv_row(path, sha256, file_entity))
+
+    def forget(self, file_ids):
+        """Remove entries for the given file IDs, e.g. once they are deleted."""
+        file_ids = {int(file_id) for file_id in file_ids}
+        with self._lock:
+            self.entries = {
+                k: v for k, v in self.entries.items() if v["id"] not in file_ids
+            }
+            with open(self.csv_file, "w", newline="") as f:
+                writer = csv.DictWriter(f, self.fieldnames)
+                writer.writeheader()
+                for (path, sha256), file_entity in self.entries.items():
+                    writer.writerow(self._csv_row(path, sha256, file_entity))
+
+
+class DeletionLog:
+    """
+    A record of the imported entities already deleted, keyed by entity type
+    and ID, appended to `csv_file` as each deletion completes so that an
+    interrupted deletion can be resumed where it stopped.
+    """
+
+    fieldnames = ["type", "id"]
+
+    def __init__(self, csv_file=None):
+        self.csv_file = csv_file or shortcut_deleted_entities_csv
+        self.deleted = set()
+        self._lock = threading.Lock()
+        if os.path.isfile(self.csv_file):
+            with open(self.csv_file, newline="") as f:
+                for row in csv.DictReader(f):
+                    self.deleted.add((row["type"], str(row["id"])))
+        self._file = None
+
+    def __len__(self):
+        return len(self.deleted)
+
+    def __contains__(self, entity):
+        entity_type, entity_id = entity
+        return (entity_type, str(entity_id)) in self.deleted
+
+    def record(self, entity_type, entity_id):
+        with self._lock:
+            self.deleted.add((entity_type, str(entity_id)))
+            if self._file is None:
+                is_new_file = not os.path.isfile(self.csv_file)
+                self._file = open(self.csv_file, "a", newline="")
+                if is_new_file:
+                    csv.writer(self._file).writerow(self.fieldnames)
+            csv.writer(self._file).writerow([entity_type, entity_id])
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        """Close and delete the log, once every entity it covers is deleted."""
+        self.close()
+        if os.path.isfile(self.csv_file):
+            os.remove(self.csv_file)
+
+
+class ImportJournal:
+    """
+    An append-only, on-disk record of the entities an import has created.
+
+    The first line of the JSONL file records the import's run label; every
+    following line records one created entity, keyed by `journal_key`.
+    Records are flushed as they are written and fsync'd in batches, so an
+    interrupted import can be resumed without recreating what was already
+    created.
+    """
+
+    fsync_every = 50
+    fsync_interval_seconds = 1.0
+
+    def __init__(self, jsonl_file, run_label, entries=None):
+        self.jsonl_file = jsonl_file
+        self.run_label = run_label
+        self.entries = entries or {}
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        is_new_file = not os.path.isfile(jsonl_file)
+        self._file = open(jsonl_file, "a", encoding="utf-8")
+        if is_new_file:
+            self._write({"run_label": run_label})
+            self._sync()
+
+    @classmethod
+    def create(cls, run_label, jsonl_file=None):
+        """Start a new journal, replacing any existing one."""
+        jsonl_file = jsonl_file or shortcut_import_journal_jsonl
+        if os.path.isfile(jsonl_file):
+            os.remove(jsonl_file)
+        return cls(jsonl_file, run_label)
+
+    @classmethod
+    def load(cls, jsonl_file=None):
+        """
+        Replay an existing journal, returning None if there isn't one.
+
+        A partially written last line (e.g. from a crash) is ignored.
+        """
+        jsonl_file = jsonl_file or shortcut_import_journal_jsonl
+        if not os.path.isfile(jsonl_file):
+            return None
+        run_label = None
+        entries = {}
+        with open(jsonl_file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    logger.warning(f"Ignoring malformed journal line: {line!r}")
+                    continue
+                if "run_label" in record:
+                    run_label = record["run_label"]
+                else:
+                    entries[record["key"]] = record["entity"]
+        return cls(jsonl_file, run_label, entries)
+
+    @staticmethod
+    def exists(jsonl_file=None):
+        return os.path.isfile(jsonl_file or shortcut_import_journal_jsonl)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, item):
+        """Return the recorded entity created for `item`, if any."""
+        return self.entries.get(journal_key(item))
+
+    def record(self, item):
+        """Record the `imported_entity` of `item` as created."""
+        key = journal_key(item)
+        summary = summarize_entity(item["imported_entity"])
+        with self._lock:
+            self.entries[key] = summary
+            self._write({"key": key, "entity": summary})
+            self._unsynced += 1
+            if (
+                self._unsynced >= self.fsync_every
+                or time.monotonic() - self._synced_at >= self.fsync_interval_seconds
+            ):
+                self._sync()
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    def remove(self):
+        """Close and delete the journal, once the import it records is complete."""
+        self.close()
+        os.remove(self.jsonl_file)
+
+
+def summarize_entity(entity):
+    """
+    Return the subset of a created Shortcut entity that is written to
+    `shortcut_imported_entities_csv`, dropping bulky fields like
+    descriptions and comments.
+    """
+    summary = {
+        k: entity[k]
+        for k in ["id", "entity_type", "name", "epic_id", "iteration_id"]
+        if k in entity
+    }
+    summary["app_url"] = entity["app_url"] if "app_url" in entity else entity.get("url")
+    return summary
+
+
+def journal_key(item):
+    """
+    Return the key identifying an importable item across runs of the
+    importer: the Pivotal ID of stories and epics, the Pivotal iteration
+    number of iterations, and the name of labels.
+    """
+    item_type = item["type"]
+    if item_type == "iteration":
+        return f"iteration:{item['pt_iteration_id']}"
+    elif item_type == "label":
+        return f"label:{item['entity']['name']}"
+    else:
+        entity = item["entity"]
+        key = entity["external_id"] if "external_id" in entity else entity["name"]
+        return f"{item_type}:{key}"
+
+
 def write_custom_fields_tree(custom_fields):
     """
     Write to `shortcut_custom_fields_csv` the content of all Custom Fields
@@ -261,7 +1074,7 @@ def default_group_id():
     isn't found.
     """
     group_id = None
-    groups = sc_get("/groups")
+    groups = sc_get_cached("/groups")
     for group in groups:
         if group["name"] == "Team 1":
             group_id = group["id"]
@@ -291,9 +1104,13 @@ def default_priority_custom_field_id():
     return None.
     """
     priority_custom_field_id = None
-    custom_fields = sc_get("/custom-fields")
+    custom_fields = sc_get_cached("/custom-fields")
     for custom_field in custom_fields:
-        if "canonical_name" in custom_field and custom_field["canonical_name"] == "priority" and custom_field["enabled"]:
+        if (
+            "canonical_name" in custom_field
+            and custom_field["canonical_name"] == "priority"
+            and custom_field["enabled"]
+        ):
             priority_custom_field_id = custom_field["id"]
 
     if priority_custom_field_id is None:
@@ -318,7 +1135,7 @@ def default_workflow_id():
     found.
     """
     workflow_id = None
-    workflows = sc_get("/workflows")
+    workflows = sc_get_cached("/workflows")
     for workflow in workflows:
         if workflow["name"] == "Standard":
             workflow_id = workflow["id"]
@@ -337,11 +1154,12 @@ def default_workflow_id():
     else:
         return workflow_id
 
+
 def current_member_id():
     """
     Returns the member id that this token belongs to.
     """
-    member = sc_get("/member")
+    member = sc_get_cached("/member")
     return member["id"]
 
 
@@ -475,8 +1293,76 @@ def get_user_info(member):
     }
 
 
-def fetch_members():
-    return [get_user_info(member) for member in sc_get("/members")]
+def fetch_members(refresh=False):
+    return [
+        get_user_info(member) for member in sc_get_cached("/members", refresh=refresh)
+    ]
+
+
+def write_members_snapshot(members, json_file=shortcut_members_json):
+    """Save the workspace `members` (as returned by `fetch_members`)."""
+    with open(json_file, "w") as f:
+        json.dump(members, f)
+
+
+def load_members(json_file=shortcut_members_json):
+    """
+    Return the workspace members saved by initialize.py, fetching (and
+    saving) them if there is no snapshot.
+    """
+    try:
+        with open(json_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        members = fetch_members()
+        write_members_snapshot(members, json_file)
+        return members
+
+
+#
+# Pivotal export profile
+#
+# initialize.py scans the Pivotal export once and saves what later stages
+# need to know about it (see `initialize.build_export_profile`) so they
+# don't have to scan it again. The profile records the size and
+# modification time of the export it describes, and is ignored once the
+# export changes.
+#
+
+export_profile_version = 1
+
+
+def export_file_signature(pt_csv_file):
+    st = os.stat(pt_csv_file)
+    return {
+        "path": os.path.abspath(pt_csv_file),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+    }
+
+
+def write_export_profile(profile, json_file=data_pivotal_export_profile_json):
+    with open(json_file, "w") as f:
+        json.dump(profile, f)
+
+
+def load_export_profile(pt_csv_file, json_file=data_pivotal_export_profile_json):
+    """
+    Return the saved profile of the Pivotal export `pt_csv_file`, or None
+    if there is none or it describes a different version of the export.
+    """
+    try:
+        with open(json_file) as f:
+            profile = json.load(f)
+        signature = export_file_signature(pt_csv_file)
+    except (OSError, ValueError):
+        return None
+    if (
+        profile.get("version") != export_profile_version
+        or profile.get("source") != signature
+    ):
+        return None
+    return profile
 
 
 #
@@ -484,51 +1370,97 @@ def fetch_members():
 #
 
 
+def split_comment(s):
+    """Split a Pivotal comment into its text, author and date strings.
+
+    Pivotal suffixes each comment with "(Author - Mon D, YYYY)". Returns a
+    tuple `(text, author, date)` of unstripped strings, or None if the
+    comment has no such suffix.
+
+    This finds the same split as matching `(.*)\\((.*) - (.*)\\)` against
+    the comment, but by searching backwards from the end of the string, so
+    it takes linear time however many parentheses the text contains."""
+    close = s.rfind(")")
+    if close < 0:
+        return None
+    dash = s.rfind(" - ", 0, close)
+    if dash < 0:
+        return None
+    open_ = s.rfind("(", 0, dash)
+    if open_ < 0:
+        return None
+    return s[:open_], s[open_ + 1 : dash], s[dash + 3 : close]
+
+
 def parse_comment(s):
     """Parse comment text into a dict with entries:
     - text (comment text, excluding final authorship content)
     - author (Pivotal user name of commenter)
     - created_at (date time, ISO 8601)"""
-    match = re.match(r"(.*)\((.*) - (.*)\)", s, re.DOTALL)
-    if match:
-        txt = match.group(1)
-        if txt is not None:
-            txt = txt.strip()
-        author = match.group(2)
-        if author is not None:
-            author = author.strip()
-        created_at = match.group(3)
-        if created_at is not None:
-            created_at = parse_date_time(created_at.strip())
-        return {"text": txt, "author": author, "created_at": created_at}
-    else:
+    parts = split_comment(s)
+    if parts is None:
         return {"text": s}
+    txt, author, created_at = parts
+    return {
+        "text": txt.strip(),
+        "author": author.strip(),
+        "created_at": parse_date_time(created_at.strip()),
+    }
+
+
+# Month abbreviations as they appear in Pivotal exports, e.g. "Oct 15, 2024".
+_pt_months = {
+    name: ix + 1
+    for ix, name in enumerate(
+        ["jan", "feb", "mar", "apr", "may", "jun"]
+        + ["jul", "aug", "sep", "oct", "nov", "dec"]
+    )
+}
 
 
+def _parse_pt_date(d: str):
+    """Parse a Pivotal "Mon D, YYYY" date into a `date`.
+
+    Equivalent to `datetime.strptime(d, "%b %d, %Y").date()` for dates in
+    the format Pivotal exports, which is sliced by hand here because
+    strptime is slow; anything else falls back to strptime itself."""
+    month_day, sep, year = d.partition(", ")
+    month, _, day = month_day.partition(" ")
+    month = _pt_months.get(month.lower())
+    if (
+        sep
+        and month
+        and len(year) == 4
+        and year.isascii()
+        and year.isdigit()
+        and 1 <= len(day) <= 2
+        and day.isascii()
+        and day.isdigit()
+    ):
+        try:
+            return date(int(year), month, int(day))
+        except ValueError:
+            pass
+    return datetime.strptime(d, "%b %d, %Y").date()
+
+
+@functools.lru_cache(maxsize=8192)
 def parse_date(d: str):
     """Parse the string as a date, then return as a string in ISO 8601 format."""
-    dt = datetime.strptime(d, "%b %d, %Y").date()
-    return dt.strftime("%Y-%m-%d")
+    return _parse_pt_date(d).isoformat()
 
 
+@functools.lru_cache(maxsize=8192)
 def parse_date_time(d: str):
     """Parse the string as a datetime, then return as a string in ISO 8601 format."""
-    return datetime.strptime(d, "%b %d, %Y").isoformat()
+    return _parse_pt_date(d).isoformat() + "T00:00:00"
 
 
 ### Utility functions
 
 
-def dissoc(dict, key_to_remove):
-    """Return a copy of `dict` with `key_to_remove` absent."""
-    d = deepcopy(dict)
-    if key_to_remove in d:
-        del d[key_to_remove]
-    return d
-
-
 def guess_mime_type(file_name):
-    (mime_type, _) = mimetypes.guess_type(file_name)
+    mime_type, _ = mimetypes.guess_type(file_name)
     return mime_type if mime_type is not None else "application/octet-stream"
 
 
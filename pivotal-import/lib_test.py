@@ -1,4 +1,7 @@
+import io
 import tempfile
+from copy import deepcopy
+from datetime import timedelta
 
 import pytest
 from lib import *
@@ -54,7 +57,7 @@ def test_validate_config_missing_fields():
         validate_config({})
     for k in cfg_ok.keys():
         with pytest.raises(SystemExit):
-            validate_config(dissoc(cfg_ok, k))
+            validate_config({key: v for key, v in cfg_ok.items() if key != k})
     for k in [key for key in cfg_ok.keys() if k != "group_id"]:  # group_id may be null
         with pytest.raises(SystemExit):
             validate_config(assoc(cfg_ok, k, ""))
@@ -99,6 +102,18 @@ def test_parse_comment_without_suffix():
     assert parse_comment(s) == {"text": s}
 
 
+def test_split_comment():
+    assert ("A (nested) note ", "Amy - Williams", "Oct 1, 2024") == split_comment(
+        "A (nested) note (Amy - Williams - Oct 1, 2024)"
+    )
+    assert split_comment("(unclosed - text") is None
+    assert split_comment("((((((((((((((((((((((((((((((((((((((( - )") == (
+        "((((((((((((((((((((((((((((((((((((((",
+        "",
+        "",
+    )
+
+
 def test_parse_date():
     assert parse_date("Oct 15, 2024") == "2024-10-15"
 
@@ -107,11 +122,17 @@ def test_parse_date_time():
     assert parse_date_time("Oct 15, 2014") == "2014-10-15T00:00:00"
 
 
-def test_dissoc():
-    d = {"a": "alpha", "b": "beta", "c": "gamma"}
-    assert {"a": "alpha", "b": "beta"} == dissoc(d, "c")
-    assert d == dissoc(d, "")
-    assert {} == dissoc({}, "a")
+def test_parse_date_matches_strptime():
+    for d in ["Jan 1, 2020", "feb 29, 2024", "Dec 31, 1999", "Mar  7, 2021"]:
+        expected = datetime.strptime(d, "%b %d, %Y")
+        assert parse_date(d) == expected.strftime("%Y-%m-%d")
+        assert parse_date_time(d) == expected.isoformat()
+
+
+def test_parse_date_invalid():
+    for d in ["Feb 29, 2023", "Oct 15 2024", "Octember 1, 2024", ""]:
+        with pytest.raises(ValueError):
+            parse_date(d)
 
 
 def test_guess_mime_type():
@@ -119,3 +140,429 @@ def test_guess_mime_type():
     assert "image/png" == guess_mime_type("example.png")
     assert "text/plain" == guess_mime_type("example.txt")
     assert "application/octet-stream" == guess_mime_type("example.unknown_extension")
+
+
+def test_build_session_pool_size():
+    s = build_session(pool_maxsize=4)
+    adapter = s.get_adapter(api_url_base)
+    assert 4 == adapter.poolmanager.connection_pool_kw["maxsize"]
+    s.close()
+
+
+def test_configure_session_replaces_shared_session():
+    import lib
+
+    old_session = lib.session
+    try:
+        new_session = configure_session(16)
+        assert new_session is lib.session
+        assert new_session is not old_session
+        adapter = lib.session.get_adapter(api_url_base)
+        assert 16 == adapter.poolmanager.connection_pool_kw["maxsize"]
+    finally:
+        configure_session(http_pool_maxsize)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, headers=None, body=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body if body is not None else {}
+        self.text = json.dumps(self.body)
+        self.elapsed = timedelta(milliseconds=5)
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error", response=self)
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        return self.responses.pop(0)
+
+
+def make_test_limiter(**kwargs):
+    clock = FakeClock()
+    return clock, AdaptiveRateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("not a date") is None
+    assert 7.0 == parse_retry_after("7")
+    now = datetime(2024, 3, 25, 12, 0, 0, tzinfo=timezone.utc)
+    assert 30.0 == parse_retry_after("Mon, 25 Mar 2024 12:00:30 GMT", now=now)
+    assert 0.0 == parse_retry_after("Mon, 25 Mar 2024 11:00:00 GMT", now=now)
+
+
+def test_adaptive_limiter_paces_after_burst():
+    clock, limiter = make_test_limiter(requests_per_minute=60, burst=2)
+    limiter.acquire()
+    limiter.acquire()
+    assert [] == clock.sleeps
+    limiter.acquire()
+    assert [1.0] == clock.sleeps
+
+
+def test_adaptive_limiter_backs_off_on_429():
+    clock, limiter = make_test_limiter(requests_per_minute=100, burst=5)
+    assert 7.0 == limiter.observe(FakeResponse(429, {"Retry-After": "7"}))
+    assert 75.0 == limiter.rate
+    assert 1 == limiter.throttled_count
+    limiter.acquire()
+    assert 7.0 == clock.sleeps[0]
+
+
+def test_adaptive_limiter_follows_rate_limit_headers():
+    clock, limiter = make_test_limiter(requests_per_minute=100, max_rate=200)
+    assert None == limiter.observe(
+        FakeResponse(
+            200,
+            {
+                "X-RateLimit-Limit": "600",
+                "X-RateLimit-Remaining": "300",
+                "X-RateLimit-Reset": "30",
+            },
+        )
+    )
+    assert 600.0 == limiter.max_rate
+    # the burst is kept below the limit too
+    assert 594.0 == limiter.rate
+
+
+def test_adaptive_limiter_speeds_up_without_headers():
+    clock, limiter = make_test_limiter(requests_per_minute=100, max_rate=200)
+    for _ in range(10):
+        limiter.observe(FakeResponse(200))
+    assert 102.5 == limiter.rate
+
+
+def test_adaptive_limiter_stays_below_limit():
+    clock, limiter = make_test_limiter(max_rate=200, burst=5)
+    assert 194.0 == limiter.rate
+    for _ in range(100):
+        limiter.observe(FakeResponse(200))
+    assert 194.0 == limiter.rate
+
+    # a minute's worth of requests, burst included, stays below the limit
+    sent_at = []
+    while clock.now < 60:
+        limiter.acquire()
+        sent_at.append(clock.now)
+    assert len([t for t in sent_at if t < 60]) < 200
+
+    # unless the API reports a higher limit
+    limiter.observe(FakeResponse(200, {"X-RateLimit-Limit": "400"}))
+    for _ in range(1000):
+        limiter.observe(FakeResponse(200))
+    assert 394.0 == limiter.rate
+
+
+def test_adaptive_limiter_only_remembers_window_of_requests():
+    clock, limiter = make_test_limiter(requests_per_minute=60, max_rate=600, burst=1)
+    for _ in range(300):
+        limiter.acquire()
+    # one request a second, so only the last minute's are kept
+    assert 60 == len(limiter.sent_at)
+
+
+def test_adaptive_limiter_waits_out_window_without_retry_after():
+    clock, limiter = make_test_limiter()
+    limiter.acquire()
+    clock.sleep(45)
+    limiter.acquire()
+    # the first request leaves the window 15 seconds from now
+    assert 15.0 == limiter.observe(FakeResponse(429))
+
+
+def test_sc_request_retries_throttled_requests(monkeypatch):
+    import lib
+
+    clock, limiter = make_test_limiter()
+    fake_session = FakeSession(
+        [
+            FakeResponse(429, {"Retry-After": "3"}),
+            FakeResponse(200, body={"id": 1}),
+        ]
+    )
+    monkeypatch.setattr(lib, "limiter", limiter)
+    monkeypatch.setattr(lib, "session", fake_session)
+
+    assert {"id": 1} == sc_get("/stories/1")
+    assert 2 == len(fake_session.requests)
+    assert 3.0 in clock.sleeps
+
+
+def test_sc_request_gives_up_after_max_retries(monkeypatch):
+    import lib
+
+    clock, limiter = make_test_limiter()
+    fake_session = FakeSession(
+        [FakeResponse(429, {"Retry-After": "1"})] * (max_throttle_retries + 1)
+    )
+    monkeypatch.setattr(lib, "limiter", limiter)
+    monkeypatch.setattr(lib, "session", fake_session)
+
+    with pytest.raises(requests.HTTPError):
+        sc_post("/stories", {"name": "A Story"})
+    assert max_throttle_retries + 1 == len(fake_session.requests)
+
+
+def test_request_header_profiles(monkeypatch):
+    import lib
+
+    fake_session = FakeSession([FakeResponse(200, body={"id": 1})])
+    monkeypatch.setattr(lib, "limiter", make_test_limiter()[1])
+    monkeypatch.setattr(lib, "session", fake_session)
+
+    sc_get("/stories/1")
+    assert json_headers is fake_session.requests[0][2]["headers"]
+    assert "Content-Type" not in multipart_headers
+    with pytest.raises(TypeError):
+        json_headers["Accept"] = "text/plain"
+
+
+def test_request_profiler(monkeypatch):
+    import lib
+
+    fake_session = FakeSession([FakeResponse(200, body={"id": 1})] * 2)
+    monkeypatch.setattr(lib, "limiter", make_test_limiter()[1])
+    monkeypatch.setattr(lib, "session", fake_session)
+    monkeypatch.setattr(lib, "request_profiler", None)
+
+    profiler = enable_request_profiling()
+    sc_get("/stories/1")
+    sc_post("/stories", {"name": "A Story"})
+    assert {"GET", "POST"} == set(profiler.totals)
+    assert 1 == profiler.totals["GET"]["requests"]
+    assert 0.005 == profiler.totals["POST"]["network"]
+
+    out = io.StringIO()
+    profiler.report(out)
+    assert "POST" in out.getvalue()
+
+
+def test_metadata_cache(monkeypatch):
+    import lib
+
+    groups = [{"id": "g1", "name": "Team"}]
+    fake_session = FakeSession(
+        [
+            FakeResponse(200, {"ETag": '"v1"'}, body=groups),
+            FakeResponse(304),
+            FakeResponse(200, {"ETag": '"v2"'}, body=[]),
+        ]
+    )
+    monkeypatch.setattr(lib, "limiter", make_test_limiter()[1])
+    monkeypatch.setattr(lib, "session", fake_session)
+
+    clock = FakeClock()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = MetadataCache(tmpdir, ttl_seconds=60, clock=clock)
+        assert groups == cache.get("/groups")
+        # fresh entries are served without a request
+        clock.now = 59
+        assert groups == cache.get("/groups")
+        assert 1 == len(fake_session.requests)
+
+        # expired entries are revalidated with their ETag
+        clock.now = 61
+        assert groups == cache.get("/groups")
+        assert '"v1"' == fake_session.requests[1][2]["headers"]["If-None-Match"]
+        clock.now = 100
+        assert groups == cache.get("/groups")
+        assert 2 == len(fake_session.requests)
+
+        # refreshing revalidates even fresh entries
+        assert [] == cache.get("/groups", refresh=True)
+        assert 3 == len(fake_session.requests)
+        assert [] == MetadataCache(tmpdir, clock=clock).get("/groups")
+
+
+def test_metadata_cache_ignores_invalid_entries(monkeypatch):
+    import lib
+
+    fake_session = FakeSession([FakeResponse(200, body=[]), FakeResponse(200, body=[])])
+    monkeypatch.setattr(lib, "limiter", make_test_limiter()[1])
+    monkeypatch.setattr(lib, "session", fake_session)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = MetadataCache(tmpdir, clock=FakeClock())
+        # e.g. written by an older version, or only partly
+        for entry in [{"body": []}, {"fetched_at": 0}]:
+            with open(cache.entry_file("/groups"), "w") as f:
+                json.dump(entry, f)
+            assert [] == cache.get("/groups")
+        assert 2 == len(fake_session.requests)
+
+
+def test_map_concurrently_preserves_order():
+    assert [1, 4, 9, 16] == map_concurrently(lambda x: x * x, [1, 2, 3, 4], 3)
+    assert [] == map_concurrently(lambda x: x, [])
+
+
+def test_map_concurrently_reraises():
+    def fail_on_two(x):
+        if x == 2:
+            raise ValueError("two")
+        return x
+
+    with pytest.raises(ValueError):
+        map_concurrently(fail_on_two, [1, 2, 3], 2)
+
+
+def test_multipart_file_body(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_bytes(b"file contents")
+    body = MultipartFileBody(str(path))
+    content = b"".join(body)
+    assert len(body) == len(content)
+    # the body can be iterated again, e.g. when a request is retried
+    assert content == b"".join(body)
+    assert body.content_type.endswith(body.boundary)
+    assert b'filename="notes.txt"' in content
+    assert b"Content-Type: text/plain\r\n\r\nfile contents\r\n" in content
+    assert content.endswith(f"--{body.boundary}--\r\n".encode())
+
+
+def test_upload_manifest_round_trip(tmp_path):
+    csv_file = str(tmp_path / "uploaded.csv")
+    manifest = UploadManifest(csv_file)
+    file_entity = {"id": 12, "entity_type": "file", "name": "a.png", "url": "u"}
+    manifest.record("data/1/a.png", "abc", file_entity)
+    manifest.record("data/2/b.png", "def", dict(file_entity, id=13, name="b.png"))
+
+    reloaded = UploadManifest(csv_file)
+    assert file_entity == reloaded.get("data/1/a.png", "abc")
+    assert reloaded.get("data/1/a.png", "changed") is None
+
+    reloaded.forget(["12"])
+    assert [13] == [e["id"] for e in UploadManifest(csv_file).entries.values()]
+
+
+def test_sc_upload_file_skips_files_in_manifest(tmp_path, monkeypatch):
+    import lib
+
+    path = tmp_path / "a.txt"
+    path.write_bytes(b"a")
+    manifest = UploadManifest(str(tmp_path / "uploaded.csv"))
+    file_entity = {"id": 1, "entity_type": "file", "name": "a.txt", "url": "u"}
+    fake_session = FakeSession([FakeResponse(200, body=[file_entity])])
+    monkeypatch.setattr(lib, "limiter", make_test_limiter()[1])
+    monkeypatch.setattr(lib, "session", fake_session)
+
+    assert file_entity == sc_upload_file(str(path), manifest)
+    assert file_entity == sc_upload_file(str(path), manifest)
+    assert 1 == len(fake_session.requests)
+
+
+def test_sc_upload_file_retries_server_errors(tmp_path, monkeypatch):
+    import lib
+
+    path = tmp_path / "a.txt"
+    path.write_bytes(b"a")
+    file_entity = {"id": 1, "entity_type": "file", "name": "a.txt", "url": "u"}
+    fake_session = FakeSession(
+        [FakeResponse(502), FakeResponse(200, body=[file_entity])]
+    )
+    monkeypatch.setattr(lib, "limiter", make_test_limiter()[1])
+    monkeypatch.setattr(lib, "session", fake_session)
+    monkeypatch.setattr(lib.time, "sleep", lambda s: None)
+
+    assert file_entity == sc_upload_file(str(path))
+    assert 2 == len(fake_session.requests)
+
+
+def test_sc_upload_file_returns_none_on_failure(tmp_path, monkeypatch):
+    import lib
+
+    path = tmp_path / "a.txt"
+    path.write_bytes(b"a")
+    fake_session = FakeSession([FakeResponse(400)])
+    monkeypatch.setattr(lib, "limiter", make_test_limiter()[1])
+    monkeypatch.setattr(lib, "session", fake_session)
+
+    assert sc_upload_file(str(path)) is None
+    assert sc_upload_file(str(tmp_path / "missing.txt")) is None
+
+
+def test_import_journal_round_trip(tmp_path):
+    jsonl_file = str(tmp_path / "journal.jsonl")
+    journal = ImportJournal.create("pivotal->shortcut 2024-04-01 10:00", jsonl_file)
+    story = {
+        "type": "story",
+        "entity": {"name": "A Story", "external_id": "1234"},
+        "imported_entity": {
+            "id": 7,
+            "entity_type": "story",
+            "name": "A Story",
+            "epic_id": 3,
+            "app_url": "https://example.com/story/7",
+            "comments": [{"text": "not journaled"}],
+        },
+    }
+    journal.record(story)
+    journal.close()
+    # a line left partially written by a crash is ignored
+    with open(jsonl_file, "a") as f:
+        f.write('{"key": "story:99", "ent')
+
+    replayed = ImportJournal.load(jsonl_file)
+    assert "pivotal->shortcut 2024-04-01 10:00" == replayed.run_label
+    assert 1 == len(replayed)
+    assert {
+        "id": 7,
+        "entity_type": "story",
+        "name": "A Story",
+        "epic_id": 3,
+        "app_url": "https://example.com/story/7",
+    } == replayed.get({"type": "story", "entity": {"external_id": "1234"}})
+    replayed.remove()
+    assert not ImportJournal.exists(jsonl_file)
+    assert ImportJournal.load(jsonl_file) is None
+
+
+def test_journal_key():
+    assert "story:1234" == journal_key(
+        {"type": "story", "entity": {"external_id": "1234"}}
+    )
+    assert "iteration:12" == journal_key(
+        {"type": "iteration", "pt_iteration_id": "12", "entity": {"name": "PT 12"}}
+    )
+    assert "label:pivotal" == journal_key(
+        {"type": "label", "entity": {"name": "pivotal"}}
+    )
+
+
+def test_members_snapshot(tmp_path, monkeypatch):
+    import lib
+
+    members = [{"name": "Amy Williams", "email": "amy@example.com", "id": "1"}]
+    fetched = []
+    monkeypatch.setattr(lib, "fetch_members", lambda: fetched.append(1) or members)
+    json_file = str(tmp_path / "members.json")
+
+    assert members == load_members(json_file)
+    assert members == load_members(json_file)
+    assert 1 == len(fetched)
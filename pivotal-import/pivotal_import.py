@@ -6,8 +6,12 @@ import argparse
 import csv
 import re
 import sys
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 from collections import Counter
+from types import MappingProxyType
 
 from lib import *
 
@@ -18,11 +22,43 @@ parser.add_argument(
     "--apply", action="store_true", help="Actually creates the entities inside Shortcut"
 )
 parser.add_argument("--debug", action="store_true", help="Turns on debugging logs")
+parser.add_argument(
+    "--refresh",
+    action="store_true",
+    help="Revalidates cached workspace metadata (groups, workflows, custom fields, members)",
+)
+parser.add_argument(
+    "--resume",
+    action="store_true",
+    help="Resumes an interrupted import, creating only the entities it did not create",
+)
+parser.add_argument(
+    "--stream",
+    action="store_true",
+    help="Spools parsed stories to disk, keeping memory use flat for very large exports",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=max_concurrent_requests,
+    help="Maximum number of API requests to have in flight at once (default: %(default)s)",
+)
+parser.add_argument(
+    "--profile-requests",
+    action="store_true",
+    help="Reports where the time of API requests went: rate limiting, client-side overhead, or the network",
+)
 
 
-"""The batch size when running in batch mode"""
+"""The maximum number of stories sent in one request to the bulk API"""
 BATCH_SIZE = 50
 
+"""The maximum size, in bytes of JSON, of the stories sent in one request to the bulk API"""
+BATCH_MAX_BYTES = 1024 * 1024
+
+"""The number of stories whose files are uploaded and which are created at a time"""
+STORY_CHUNK_SIZE = 500
+
 """The labels associated with all stories and epics that are created with this import script."""
 PIVOTAL_TO_SHORTCUT_LABEL = "pivotal->shortcut"
 _current_datetime = datetime.now().strftime("%Y-%m-%d %H:%M")
@@ -35,51 +71,134 @@ PIVOTAL_RELEASE_TYPE_LABEL = "pivotal-release"
 PIVOTAL_HAD_REVIEW_LABEL = "pivotal-had-review"
 
 
-def sc_creator(items):
+"""The API endpoint used to create each type of entity, one at a time."""
+CREATE_ENDPOINTS = {
+    "epic": "/epics",
+    "iteration": "/iterations",
+    "label": "/labels",
+}
+
+
+def story_batches(stories, max_count=None, max_bytes=None):
+    """
+    Split `stories` into batches to send to the bulk API.
+
+    Each batch holds at most `max_count` (default `BATCH_SIZE`) stories,
+    whose entities serialize to at most `max_bytes` (default
+    `BATCH_MAX_BYTES`) of JSON between them. A story that is larger than
+    that on its own is put in a batch by itself.
+    """
+    if max_count is None:
+        max_count = BATCH_SIZE
+    if max_bytes is None:
+        max_bytes = BATCH_MAX_BYTES
+    batch = []
+    batch_bytes = 0
+    for story in stories:
+        # requests serializes JSON as ASCII, so characters are bytes
+        size = len(json.dumps(story["entity"])) + 1
+        if batch and (len(batch) >= max_count or batch_bytes + size > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(story)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+def _is_batch_error(err):
+    """
+    Return whether a failed bulk request was rejected because of its
+    payload, so that sending smaller batches could succeed.
+
+    Other failures (server errors, timeouts) don't tell whether the
+    stories were created, so resending them could create duplicates;
+    they fail the import instead, which `--resume` can pick up from.
+    """
+    if isinstance(err, requests.HTTPError) and err.response is not None:
+        return err.response.status_code in (400, 413, 422)
+    return False
+
+
+def sc_creator(items, on_created=None):
     """Create Shortcut entities utilizing bulk APIs whenever possible.
 
     Accepts a list of dicts that must have at least two keys `type`
     and `entity`. `type` must be one of:
     - epic
     - iteration
+    - label
     - story
 
     `entity` must be the payload that is sent to the Shortcut API.
 
+    If given, `on_created` is called with each item as soon as its
+    entity has been created.
+
+    Entities without a bulk API (epics, iterations, and labels) are
+    independent of one another, so they are created concurrently.
+
+    Stories are sent to the bulk API in batches sized by `story_batches`,
+    several batches at a time. When the API rejects a batch as invalid or
+    too large, it is split in half and each half retried, until the story
+    causing the problem is isolated; that story is reported and left
+    uncreated, with the error in its `import_error` key, so one bad story
+    doesn't fail the import. Any other error fails the import.
+
     Mutates and returns the list of items with two new keys:
     - `imported_id`: the id of the entity that was created
     - `imported_entity`: the full entity that was created
     """
-    batch_stories = []
+    for item in items:
+        if item["type"] != "story" and item["type"] not in CREATE_ENDPOINTS:
+            raise RuntimeError("Unknown entity type {}".format(item["type"]))
+
+    def create_one(item):
+        item["imported_entity"] = sc_post(
+            CREATE_ENDPOINTS[item["type"]], item["entity"]
+        )
+        if on_created:
+            on_created(item)
+        return item
 
     def create_stories(stories):
         entities = [s["entity"] for s in stories]
-        created_entities = sc_post("/stories/bulk", {"stories": entities})
+        try:
+            created_entities = sc_post("/stories/bulk", {"stories": entities})
+        except requests.RequestException as err:
+            if not _is_batch_error(err):
+                raise
+            if len(stories) == 1:
+                story = stories[0]
+                story["import_error"] = str(err)
+                printerr(
+                    '[Problem] Could not create story "{}" (Pivotal id {}): {}'.format(
+                        story["entity"].get("name"),
+                        story["entity"].get("external_id"),
+                        err,
+                    )
+                )
+                return stories
+            logger.info(
+                "Bulk creation of %d stories failed (%s), splitting the batch",
+                len(stories),
+                err,
+            )
+            half = len(stories) // 2
+            create_stories(stories[:half])
+            create_stories(stories[half:])
+            return stories
         for created, story in zip(created_entities, stories):
             story["imported_entity"] = created
+            if on_created:
+                on_created(story)
         return stories
 
-    for item in items:
-        if item["type"] == "story":
-            batch_stories.append(item)
-        elif item["type"] == "epic":
-            res = sc_post("/epics", item["entity"])
-            item["imported_entity"] = res
-        elif item["type"] == "iteration":
-            res = sc_post("/iterations", item["entity"])
-            item["imported_entity"] = res
-        elif item["type"] == "label":
-            res = sc_post("/labels", item["entity"])
-            item["imported_entity"] = res
-        else:
-            raise RuntimeError("Unknown entity type {}".format(item["type"]))
-
-        if len(batch_stories) >= BATCH_SIZE:
-            create_stories(batch_stories)
-            batch_stories.clear()
+    map_concurrently(create_one, [item for item in items if item["type"] != "story"])
 
-    if batch_stories:
-        create_stories(batch_stories)
+    stories = [item for item in items if item["type"] == "story"]
+    map_concurrently(create_stories, list(story_batches(stories)))
 
     return items
 
@@ -305,7 +424,10 @@ def build_entity(ctx, d):
                 review_status = escape_md_table_syntax(review_status)
                 comment_text += f"\n|{reviewer}|{review_type}|{review_status}|"
             comments.append(
-                {"author_id": d.get("requested_by_id", ctx.get("token_member")), "text": comment_text}
+                {
+                    "author_id": d.get("requested_by_id", ctx.get("token_member")),
+                    "text": comment_text,
+                }
             )
 
         # Custom Fields
@@ -377,8 +499,13 @@ def load_priorities(csv_file):
 
 def load_users(csv_file):
     logger.debug(f"Loading users from {csv_file}")
-    email_to_id = {user["email"]: user["id"] for user in fetch_members()}
     user_to_email = load_mapping_csv(csv_file, "pt_user_name", "shortcut_user_email")
+    # use the members initialize.py saved, unless people have been invited since
+    email_to_id = {user["email"]: user["id"] for user in load_members()}
+    if any(email and email not in email_to_id for email in user_to_email.values()):
+        members = fetch_members(refresh=True)
+        write_members_snapshot(members)
+        email_to_id = {user["email"]: user["id"] for user in members}
     return {
         pt_user: email_to_id.get(sc_email)
         for pt_user, sc_email in user_to_email.items()
@@ -393,14 +520,16 @@ def load_workflow_states(csv_file):
 
 def get_mock_emitter():
     _mock_global_id = 0
+    _mock_id_lock = threading.Lock()
 
     def _get_next_id():
         nonlocal _mock_global_id
-        id = _mock_global_id
-        _mock_global_id += 1
+        with _mock_id_lock:
+            id = _mock_global_id
+            _mock_global_id += 1
         return id
 
-    def mock_emitter(items):
+    def mock_emitter(items, on_created=None):
         for item in items:
             entity_id = _get_next_id()
             created_entity = item["entity"].copy()
@@ -413,40 +542,51 @@ def get_mock_emitter():
                     item["type"], entity_id, item["entity"]["name"]
                 )
             )
+            if on_created:
+                on_created(item)
         return items
 
+    def mock_upload_file(file):
+        entity_id = _get_next_id()
+        print('Uploading file {} "{}"'.format(entity_id, file))
+        return {
+            "id": entity_id,
+            "entity_type": "file",
+            "name": os.path.basename(file),
+            "url": f"https://example.com/file/{entity_id}",
+        }
+
+    # Dry runs must not upload files, so the mock emitter carries its own
+    # file uploader for the EntityCollector to use.
+    mock_emitter.upload_file = mock_upload_file
     return mock_emitter
 
 
-def collect_epic_label_mapping(epics):
+def epic_label_index(epics):
     """
-    Return a dict mapping label names to Shortcut Epic ID.
+    Return a dict mapping label names to the epic item stories with that
+    label belong to. When several epics share a label, the last one wins.
     """
-    epic_label_map = {}
+    index = {}
     for epic in epics:
         for label in epic["entity"]["labels"]:
             label_name = label["name"]
-            if (
-                label_name is not PIVOTAL_TO_SHORTCUT_LABEL
-                and label_name is not PIVOTAL_TO_SHORTCUT_RUN_LABEL
+            if label_name not in (
+                PIVOTAL_TO_SHORTCUT_LABEL,
+                PIVOTAL_TO_SHORTCUT_RUN_LABEL,
             ):
-                epic_label_map[label_name] = epic["imported_entity"]["id"]
-    return epic_label_map
+                index[label_name] = epic
+    return index
 
 
-def assign_stories_to_epics(stories, epics):
+def collect_epic_label_mapping(epics):
     """
-    Mutate the `stories` to set an epic_id if that story is assigned to that epic.
+    Return a dict mapping label names to Shortcut Epic ID.
     """
-    epic_label_map = collect_epic_label_mapping(epics)
-    for story in stories:
-        for label in story["entity"].get("labels", []):
-            label_name = label["name"]
-            epic_id = epic_label_map.get(label_name)
-            logger.debug(f"story epic id {epic_id}")
-            if epic_id is not None:
-                story["entity"]["epic_id"] = epic_id
-    return stories
+    return {
+        label_name: epic["imported_entity"]["id"]
+        for label_name, epic in epic_label_index(epics).items()
+    }
 
 
 def collect_pt_iteration_mapping(iterations):
@@ -461,19 +601,85 @@ def collect_pt_iteration_mapping(iterations):
     return d
 
 
-def assign_stories_to_iterations(stories, iterations):
+def build_assignment_index(epics, iterations):
     """
-    Mutate the `stories` to set an iteration_id if that story is assigned to that iteration.
+    Return read-only mappings of label name to Shortcut epic id and of
+    Pivotal iteration id to Shortcut iteration id, for `assign_stories`.
+    """
+    return (
+        MappingProxyType(collect_epic_label_mapping(epics)),
+        MappingProxyType(collect_pt_iteration_mapping(iterations)),
+    )
+
+
+def _assign_epic(story, epic_label_map):
+    # a story belongs to the epic of the last of its labels that has one
+    entity = story["entity"]
+    epic_id = None
+    for label in entity.get("labels", ()):
+        epic_id = epic_label_map.get(label["name"], epic_id)
+    if epic_id is not None:
+        logger.debug("Assigning story %s to epic %s", entity.get("name"), epic_id)
+        entity["epic_id"] = epic_id
+
+
+def _assign_iteration(story, pt_iteration_mapping):
+    pt_iteration_id = story["pt_iteration_id"]
+    if pt_iteration_id:
+        story["entity"]["iteration_id"] = pt_iteration_mapping[str(pt_iteration_id)]
+
+
+def assign_stories(stories, epic_label_map, pt_iteration_mapping):
+    """
+    Mutate the `stories` to set the epic_id and iteration_id of the epic and
+    iteration each story is assigned to, if any, in a single pass over them.
+    Takes the mappings returned by `build_assignment_index`.
     """
-    pt_iteration_mapping = collect_pt_iteration_mapping(iterations)
     for story in stories:
-        pt_iteration_id = story["pt_iteration_id"]
-        if pt_iteration_id:
-            sc_iteration_id = pt_iteration_mapping[str(pt_iteration_id)]
-            story["entity"]["iteration_id"] = sc_iteration_id
+        _assign_epic(story, epic_label_map)
+        _assign_iteration(story, pt_iteration_mapping)
     return stories
 
 
+class StorySpool:
+    """
+    A disk-backed, append-only list of story items.
+
+    Collecting stories into a spool rather than a list keeps the importer's
+    memory use flat regardless of the size of the Pivotal export: stories
+    are written to a temporary file as they are built and read back a chunk
+    at a time when they are created.
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, item):
+        self._file.write(json.dumps(item) + "\n")
+        self._count += 1
+
+    def chunks(self, size):
+        """Yield lists of up to `size` stories, in the order they were appended."""
+        self._file.flush()
+        self._file.seek(0)
+        chunk = []
+        for line in self._file:
+            chunk.append(json.loads(line))
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+        self._file.seek(0, os.SEEK_END)
+
+    def close(self):
+        self._file.close()
+
+
 class EntityCollector:
     """Collect and process entities for import into Shortcut.
 
@@ -483,9 +689,21 @@ class EntityCollector:
     entities.
     """
 
-    def __init__(self, emitter=None):
-        _mock_global_id = 0
-        self.stories = []
+    def __init__(
+        self,
+        emitter=None,
+        file_uploader=None,
+        journal=None,
+        stream=False,
+        max_workers=1,
+    ):
+        # when streaming, stories are spooled to disk rather than held in memory
+        self.stream = stream
+        # with more than one worker, creation is pipelined: stories are
+        # created as soon as their epic and iteration are, rather than
+        # once all epics and iterations are
+        self.max_workers = max_workers
+        self.stories = StorySpool() if stream else []
         self.epics = []
         self.files = []
         # set of strings in {id}|{start}|{end} format
@@ -494,12 +712,24 @@ class EntityCollector:
         # to be populated at commit()
         self.iterations = []
         self.labels = []
+        # Pivotal ids of the stories the emitter could not create
+        self.failed_stories = []
         if emitter is None:
             emitter = get_mock_emitter()
         self.emitter = emitter
+        if file_uploader is None:
+            file_uploader = getattr(emitter, "upload_file", sc_upload_file)
+        self.file_uploader = file_uploader
+        # when resuming an import, entities recorded in the journal
+        # are not created again
+        self.journal = journal
 
     def collect(self, item):
         if item["type"] == "story":
+            if self.stream:
+                # the parsed row is only kept for debugging and would
+                # double the size of the spool
+                item = {k: v for k, v in item.items() if k != "parsed_row"}
             self.stories.append(item)
             if item["iteration"]:
                 self.iteration_strings.add(item["iteration"])
@@ -517,22 +747,99 @@ class EntityCollector:
         # find all stories
         pass
 
-    def commit(self):
-        # create all the default labels
-        self.labels = self.emitter(self.labels)
-        for label in self.labels:
-            if PIVOTAL_TO_SHORTCUT_RUN_LABEL == label["entity"]["name"]:
-                label_url = label["imported_entity"]["app_url"]
-                print(
-                    f"Import Started\n\n==> Click here to monitor import progress: {label_url}"
+    def from_journal(self, items):
+        """
+        Set the entity of each of `items` the journal (if any) records as
+        created by a previous run, and return the remaining items.
+        """
+        if self.journal is None:
+            return list(items)
+
+        pending = []
+        for item in items:
+            entity = self.journal.get(item)
+            if entity is None:
+                pending.append(item)
+            else:
+                item["imported_entity"] = entity
+        if len(pending) < len(items):
+            print(
+                "Skipping {} {} entities already created by a previous run".format(
+                    len(items) - len(pending), items[0]["type"]
                 )
+            )
+        return pending
+
+    def create(self, items):
+        """
+        Create `items` with the emitter, recording each created entity in
+        the journal (if any).
+        """
+        on_created = self.journal.record if self.journal is not None else None
+        self.emitter(items, on_created=on_created)
+        return items
 
-        # create all the epics and find their associated Shortcut epic ids
-        self.epics = self.emitter(self.epics)
-        print("Finished creating {} epics".format(len(self.epics)))
-        assign_stories_to_epics(self.stories, self.epics)
+    def emit(self, items):
+        """
+        Create `items` with the emitter, recording each created entity in
+        the journal (if any) and skipping those it records as created.
+        """
+        if self.journal is None:
+            return self.emitter(items)
 
-        # create all iterations and find their associated Shortcut iteration ids
+        self.create(self.from_journal(items))
+        return items
+
+    def story_chunks(self):
+        """Yield the collected stories in lists of up to `STORY_CHUNK_SIZE`."""
+        if self.stream:
+            yield from self.stories.chunks(STORY_CHUNK_SIZE)
+        else:
+            for ix in range(0, len(self.stories), STORY_CHUNK_SIZE):
+                yield self.stories[ix : ix + STORY_CHUNK_SIZE]
+
+    def story_files(self, story):
+        """Return the paths of the files found in `data/{pt_id}` for `story`."""
+        files = []
+        pt_id = story["entity"]["external_id"]
+        pt_files_dir = f"data/{pt_id}"
+        if os.path.isdir(pt_files_dir):
+            for dirpath, _, filenames in os.walk(pt_files_dir):
+                for f in filenames:
+                    files.append(os.path.join(dirpath, f))
+        return files
+
+    def attach_file(self, story, file_entity):
+        """
+        Add the uploaded `file_entity` to the files of `story`; a failed
+        upload (None) is left out.
+        """
+        file_ids = story["entity"].setdefault("file_ids", [])
+        if file_entity is not None:
+            self.files.append({"imported_entity": file_entity})
+            file_ids.append(file_entity["id"])
+
+    def upload_story_files(self, stories):
+        """
+        Upload the files found in `data/{pt_id}` for each of `stories`,
+        setting the story's `file_ids`. All the stories' files are uploaded
+        concurrently.
+        """
+        story_files = []
+        for story in stories:
+            if self.journal is not None and self.journal.get(story) is not None:
+                continue
+            for path in self.story_files(story):
+                story_files.append((story, path))
+
+        file_entities = map_concurrently(
+            lambda story_file: self.file_uploader(story_file[1]), story_files
+        )
+        for (story, _), file_entity in zip(story_files, file_entities):
+            self.attach_file(story, file_entity)
+
+    def build_iterations(self):
+        """Return the iteration items to create for the collected stories."""
         iteration_entities = []
         for iteration_string in self.iteration_strings:
             id, start_date, end_date = iteration_string.split("|")
@@ -548,38 +855,192 @@ class EntityCollector:
                     },
                 }
             )
-        self.iterations = self.emitter(iteration_entities)
+        return iteration_entities
+
+    def created_stories(self, stories):
+        """
+        Return the entities created for `stories` (summaries when streaming),
+        noting those that could not be created in `failed_stories`.
+        """
+        created = []
+        for story in stories:
+            entity = story.get("imported_entity")
+            if entity is None:
+                self.failed_stories.append(story["entity"].get("external_id"))
+            else:
+                created.append(summarize_entity(entity) if self.stream else entity)
+        return created
+
+    def commit_in_phases(self, iteration_entities):
+        """
+        Create all the epics, then all the iterations, then the stories;
+        return the entities created for the stories.
+        """
+        # create all the epics and find their associated Shortcut epic ids
+        self.epics = self.emit(self.epics)
+        print("Finished creating {} epics".format(len(self.epics)))
+
+        # create all iterations and find their associated Shortcut iteration ids
+        self.iterations = self.emit(iteration_entities)
         print("Finished creating {} iterations".format(len(self.iterations)))
-        assign_stories_to_iterations(self.stories, self.iterations)
-
-        # upload files attached to stories so they can be associated during Story creation
-        for story in self.stories:
-            pt_id = story["entity"]["external_id"]
-            pt_files_dir = f"data/{pt_id}"
-            if os.path.isdir(pt_files_dir):
-                file_entities = sc_upload_files(
-                    [
-                        os.path.join(dirpath, f)
-                        for (dirpath, _, filenames) in os.walk(pt_files_dir)
-                        for f in filenames
+
+        # Assign stories to their epics and iterations, upload the files attached
+        # to them so they can be associated during Story creation, and create
+        # them, a chunk at a time. When streaming, only one chunk of stories
+        # is in memory at once, and only a summary of each created story is kept.
+        epic_label_map, pt_iteration_mapping = build_assignment_index(
+            self.epics, self.iterations
+        )
+        created_stories = []
+        for stories in self.story_chunks():
+            assign_stories(stories, epic_label_map, pt_iteration_mapping)
+            self.upload_story_files(stories)
+            self.emit(stories)
+            created_stories.extend(self.created_stories(stories))
+        return created_stories
+
+    def commit_pipelined(self, iteration_entities):
+        """
+        Create the epics, iterations and stories without waiting for one
+        kind of entity to be done before starting on the next: each story
+        is created as soon as the epic and iteration it belongs to have been
+        and its files are uploaded. Returns the entities created for the
+        stories.
+
+        Epics and iterations are created by one pool of workers, and stories
+        and their files by another, so that story work never queues behind
+        epics and iterations. The pools split `max_workers` between them and
+        share the rate limiter.
+        """
+        self.iterations = iteration_entities
+
+        epic_by_label = epic_label_index(self.epics)
+        iteration_by_pt_id = {
+            str(iteration["pt_iteration_id"]): iteration
+            for iteration in self.iterations
+        }
+
+        def dependencies(story):
+            """Return the epic and iteration `story` is assigned to, if any."""
+            epic = None
+            for label in story["entity"].get("labels", []):
+                epic = epic_by_label.get(label["name"], epic)
+            iteration = None
+            if story["pt_iteration_id"]:
+                iteration = iteration_by_pt_id[str(story["pt_iteration_id"])]
+            return (epic, iteration)
+
+        entity_workers = max(1, self.max_workers // 2)
+        entity_pool = ThreadPoolExecutor(max_workers=entity_workers)
+        story_pool = ThreadPoolExecutor(
+            max_workers=max(1, self.max_workers - entity_workers)
+        )
+        try:
+            # Each epic and iteration is created by a task of its own; those
+            # a previous run created have no task.
+            creating = {}
+            for item in self.from_journal(self.epics) + self.from_journal(
+                self.iterations
+            ):
+                creating[id(item)] = entity_pool.submit(self.create, [item])
+
+            created_stories = []
+            for stories in self.story_chunks():
+                # Each story waits on the tasks creating its epic and
+                # iteration, and on the uploads of its files.
+                waiting = []
+                for story in self.from_journal(stories):
+                    deps = dependencies(story)
+                    uploads = [
+                        story_pool.submit(self.file_uploader, path)
+                        for path in self.story_files(story)
                     ]
+                    tasks = [creating[id(dep)] for dep in deps if id(dep) in creating]
+                    waiting.append((story, deps, uploads, tasks + uploads))
+
+                story_tasks = []
+                ready = []
+                while waiting:
+                    still_waiting = []
+                    for story, deps, uploads, tasks in waiting:
+                        if not all(task.done() for task in tasks):
+                            still_waiting.append((story, deps, uploads, tasks))
+                            continue
+                        # raises the error of an epic or iteration that failed
+                        for task in tasks:
+                            task.result()
+                        epic, iteration = deps
+                        if epic is not None:
+                            story["entity"]["epic_id"] = epic["imported_entity"]["id"]
+                        if iteration is not None:
+                            story["entity"]["iteration_id"] = iteration[
+                                "imported_entity"
+                            ]["id"]
+                        for upload in uploads:
+                            self.attach_file(story, upload.result())
+                        ready.append(story)
+                    waiting = still_waiting
+
+                    # Send the stories that are ready in full batches, holding
+                    # a partial batch back until more stories are ready.
+                    batches = list(story_batches(ready))
+                    ready = []
+                    if waiting and batches and len(batches[-1]) < BATCH_SIZE:
+                        ready = batches.pop()
+                    for batch in batches:
+                        story_tasks.append(story_pool.submit(self.create, batch))
+
+                    if waiting:
+                        unfinished = [
+                            task
+                            for *_, tasks in waiting
+                            for task in tasks
+                            if not task.done()
+                        ]
+                        wait(unfinished, return_when=FIRST_COMPLETED)
+
+                for task in story_tasks:
+                    task.result()
+                created_stories.extend(self.created_stories(stories))
+
+            for task in creating.values():
+                task.result()
+        except BaseException:
+            for pool in (entity_pool, story_pool):
+                pool.shutdown(wait=True, cancel_futures=True)
+            raise
+        entity_pool.shutdown(wait=True)
+        story_pool.shutdown(wait=True)
+
+        print("Finished creating {} epics".format(len(self.epics)))
+        print("Finished creating {} iterations".format(len(self.iterations)))
+        return created_stories
+
+    def commit(self):
+        # create all the default labels
+        self.labels = self.emit(self.labels)
+        for label in self.labels:
+            if PIVOTAL_TO_SHORTCUT_RUN_LABEL == label["entity"]["name"]:
+                label_url = label["imported_entity"]["app_url"]
+                print(
+                    f"Import Started\n\n==> Click here to monitor import progress: {label_url}"
                 )
-                self.files += [
-                    {"imported_entity": file_entity} for file_entity in file_entities
-                ]
-                story["entity"]["file_ids"] = [
-                    file_entity["id"] for file_entity in file_entities
-                ]
 
-        # create all the stories
-        self.stories = self.emitter(self.stories)
-        print("Finished creating {} stories".format(len(self.stories)))
+        iteration_entities = self.build_iterations()
+        if self.max_workers > 1:
+            created_stories = self.commit_pipelined(iteration_entities)
+        else:
+            created_stories = self.commit_in_phases(iteration_entities)
+        print("Finished creating {} stories".format(len(created_stories)))
 
         # Aggregate all the created stories, epics, iterations, and labels into a list of maps
         created_entities = []
         created_set = set()
-        for item in self.epics + self.iterations + self.files + self.stories:
-            entity = item["imported_entity"]
+        created_others = [
+            item["imported_entity"]
+            for item in self.epics + self.iterations + self.files
+        ]
+        for entity in created_others + created_stories:
             if entity["id"] not in created_set:
                 created_entities.append(entity)
                 created_set.add(entity["id"])
@@ -640,25 +1101,143 @@ def build_ctx(cfg):
     return ctx
 
 
+def check_export_profile(cfg, ctx):
+    """
+    Warn if the Pivotal export has changed since initialize.py profiled it,
+    or has users that data/users.csv doesn't map.
+    """
+    profile = load_export_profile(cfg["pt_csv_file"])
+    if profile is None:
+        printerr(
+            f"[Warning] {cfg['pt_csv_file']} has changed since initialize.py last ran; rerun it to check the mappings in data/ are complete."
+        )
+        return
+    unmapped_users = [
+        user for user in profile["users"] if user not in ctx["user_config"]
+    ]
+    if unmapped_users:
+        msg = "\n  - ".join(unmapped_users)
+        printerr(
+            f"[Warning] These Pivotal Tracker users aren't mapped to Shortcut users in {cfg['users_csv_file']}, so they won't be set on the stories they appear in:\n  - {msg}"
+        )
+
+
+def open_journal(args):
+    """
+    Return the journal of the interrupted import when resuming, else None.
+
+    When resuming, the journal of the interrupted import is replayed and
+    its run label reused, so resumed entities are labeled like the others.
+    Otherwise, this checks that no interrupted import is left; the journal
+    of a new import is created by `create_journal` once it is about to
+    create entities.
+    """
+    global PIVOTAL_TO_SHORTCUT_RUN_LABEL
+    if not args.apply:
+        return None
+    if args.resume:
+        journal = ImportJournal.load()
+        if journal is None:
+            printerr(
+                f"[Problem] There is no interrupted import to resume ({shortcut_import_journal_jsonl} not found)."
+            )
+            sys.exit(1)
+        PIVOTAL_TO_SHORTCUT_RUN_LABEL = journal.run_label
+        print(
+            f"Resuming import {journal.run_label}, {len(journal)} entities were already created."
+        )
+        return journal
+    if ImportJournal.exists():
+        printerr(
+            f"""[Problem] A previous import did not finish; its progress is recorded in {shortcut_import_journal_jsonl}.
+  - To finish that import, rerun with --resume (make import-resume).
+  - To start a new import instead, delete {shortcut_import_journal_jsonl} and rerun."""
+        )
+        sys.exit(1)
+    return None
+
+
+def create_journal(args, journal):
+    """
+    Return the journal to record this import in: `journal` when resuming,
+    a new journal for a new import, or None for a dry run.
+    """
+    if not args.apply or journal is not None:
+        return journal
+    return ImportJournal.create(PIVOTAL_TO_SHORTCUT_RUN_LABEL)
+
+
 def main(argv):
     args = parser.parse_args(argv[1:])
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
+    configure_metadata_cache(refresh=args.refresh)
+    if args.resume and not args.apply:
+        parser.error("--resume requires --apply")
     emitter = None
     if args.apply:
         emitter = sc_creator
+    workers = configure_concurrency(args.workers)
+    profiler = enable_request_profiling() if args.profile_requests else None
 
-    entity_collector = EntityCollector(emitter)
+    file_uploader = None
+    if args.apply:
+        upload_manifest = UploadManifest()
+        if len(upload_manifest):
+            print(
+                f"Found {len(upload_manifest)} previously uploaded files in {shortcut_uploaded_files_csv}, they will not be uploaded again."
+            )
+        file_uploader = lambda file: sc_upload_file(file, upload_manifest)
+
+    journal = open_journal(args)
+    # dry runs create entities in phases, so their output reads in order
+    entity_collector = EntityCollector(
+        emitter,
+        file_uploader,
+        journal,
+        stream=args.stream,
+        max_workers=workers if args.apply else 1,
+    )
 
-    # We need to make API requests before fully validating local config.
-    validate_environment()
-    cfg = load_config()
-    ctx = build_ctx(cfg)
-    print_rate_limiting_explanation()
-    process_pt_csv_export(ctx, cfg["pt_csv_file"], entity_collector)
+    try:
+        # We need to make API requests before fully validating local config.
+        validate_environment()
+        cfg = load_config()
+        ctx = build_ctx(cfg)
+        check_export_profile(cfg, ctx)
+        print_rate_limiting_explanation()
+        process_pt_csv_export(ctx, cfg["pt_csv_file"], entity_collector)
+
+        # Only start a journal once the import is ready to create entities,
+        # so a run that fails before then doesn't block the next one.
+        journal = entity_collector.journal = create_journal(args, journal)
+        created_entities = entity_collector.commit()
+        write_created_entities_csv(created_entities)
+    except BaseException:
+        # A journal of no entities has nothing to resume.
+        if journal is not None and not len(journal):
+            journal.remove()
+        raise
+    finally:
+        if journal is not None:
+            journal.close()
+        if profiler is not None:
+            profiler.report()
+
+    if entity_collector.failed_stories:
+        printerr(
+            f"""[Warning] {len(entity_collector.failed_stories)} stories could not be created, see the problems reported above.
+  - Pivotal ids: {", ".join(str(id) for id in entity_collector.failed_stories)}"""
+        )
+        if journal is not None:
+            printerr(
+                "  - Once they are fixed in the Pivotal export, rerun with --resume (make import-resume) to create them."
+            )
+        return 1
 
-    created_entities = entity_collector.commit()
-    write_created_entities_csv(created_entities)
+    # The import is complete, so there is nothing left to resume.
+    if journal is not None:
+        journal.remove()
 
     return 0
 
@@ -1,3 +1,5 @@
+import pytest
+
 from pivotal_import import *
 
 
@@ -83,6 +85,17 @@ def test_parse_reviewers():
     )
 
 
+def test_parse_row_skips_unused_columns():
+    headers = ["id", "unused column", "title", "owned by", "owned by"]
+    assert {
+        "external_id": "12",
+        "name": "Story",
+        "owners": ["Amy Williams"],
+    } == parse_row(["12", "ignored", " Story ", "Amy Williams", ""], headers)
+    # short rows are parsed up to their last cell
+    assert {"external_id": "13"} == parse_row(["13"], headers)
+
+
 def test_parse_priority():
     assert "p3 - low" == parse_priority("p3 - Low")
     assert parse_priority("none") is None
@@ -465,7 +478,15 @@ def test_build_epic():
 
 
 def test_assign_stories_to_epics():
-    assert assign_stories_to_epics(
+    epics = [
+        {
+            "type": "epic",
+            # This label is used to determine epic membership of the story; see the story's labels
+            "entity": {"id": 1234, "labels": [{"name": "an epic name"}]},
+            "imported_entity": {"id": 1234},
+        }
+    ]
+    assert assign_stories(
         [
             {
                 "type": "story",
@@ -474,18 +495,12 @@ def test_assign_stories_to_epics():
                     # This label is used to determine epic membership of the story; see the epic's labels
                     "labels": [{"name": "an epic name"}],
                 },
+                "pt_iteration_id": None,
             },
             # This story is not assigned to an epic, and so should not have an epic_id
-            {"type": "story", "entity": {"name": "A Story 2"}},
-        ],
-        [
-            {
-                "type": "epic",
-                # This label is used to determine epic membership of the story; see the story's labels
-                "entity": {"id": 1234, "labels": [{"name": "an epic name"}]},
-                "imported_entity": {"id": 1234},
-            }
+            {"type": "story", "entity": {"name": "A Story 2"}, "pt_iteration_id": None},
         ],
+        *build_assignment_index(epics, []),
     ) == [
         {
             "type": "story",
@@ -494,16 +509,60 @@ def test_assign_stories_to_epics():
                 "epic_id": 1234,
                 "labels": [{"name": "an epic name"}],
             },
+            "pt_iteration_id": None,
         },
         # Note the absence of the epic_id, fixing a bug where we unintentionally assigned
         # an epic to every story; bug introduced in commit
         # efbb2ddb691c7c91b0f2e3c817cfead663adc5db on 2024-04-08
-        {"type": "story", "entity": {"name": "A Story 2"}},
+        {"type": "story", "entity": {"name": "A Story 2"}, "pt_iteration_id": None},
     ]
 
 
+def test_build_assignment_index():
+    # an equal, but not identical, copy of the label every epic has
+    import_label = "".join(["pivotal", "->", "shortcut"])
+    epics = [
+        {
+            "type": "epic",
+            "entity": {"labels": [{"name": import_label}, {"name": "an epic"}]},
+            "imported_entity": {"id": 1234},
+        }
+    ]
+    iterations = [{"pt_iteration_id": 5, "imported_entity": {"id": 99}}]
+    epic_label_map, pt_iteration_mapping = build_assignment_index(epics, iterations)
+    assert {"an epic": 1234} == dict(epic_label_map)
+    assert {"5": 99} == dict(pt_iteration_mapping)
+    with pytest.raises(TypeError):
+        epic_label_map["another epic"] = 1
+
+    stories = [
+        {
+            "entity": {"labels": [{"name": "an epic"}, {"name": import_label}]},
+            "pt_iteration_id": "5",
+        },
+        {"entity": {"labels": [{"name": import_label}]}, "pt_iteration_id": None},
+    ]
+    assign_stories(stories, epic_label_map, pt_iteration_mapping)
+    assert {"epic_id": 1234, "iteration_id": 99} == {
+        k: v for k, v in stories[0]["entity"].items() if k != "labels"
+    }
+    assert ["labels"] == list(stories[1]["entity"])
+
+
 def test_assign_stories_to_iterations():
-    assert assign_stories_to_iterations(
+    iterations = [
+        {
+            "type": "iteration",
+            "pt_iteration_id": "123",
+            "entity": {
+                "name": "PT 123",
+                "start_date": "2024-01-01",
+                "end_date": "2025-01-01",
+            },
+            "imported_entity": {"id": 1234},
+        }
+    ]
+    assert assign_stories(
         [
             {
                 "type": "story",
@@ -521,18 +580,7 @@ def test_assign_stories_to_iterations():
                 "pt_iteration_id": None,
             },
         ],
-        [
-            {
-                "type": "iteration",
-                "pt_iteration_id": "123",
-                "entity": {
-                    "name": "PT 123",
-                    "start_date": "2024-01-01",
-                    "end_date": "2025-01-01",
-                },
-                "imported_entity": {"id": 1234},
-            }
-        ],
+        *build_assignment_index([], iterations),
     ) == [
         {
             "type": "story",
@@ -702,3 +750,317 @@ def test_entity_collector_with_epics():
             "external_id": "3456",
         },
     ] == created
+
+
+def test_entity_collector_pipelined(monkeypatch):
+    import pivotal_import
+
+    monkeypatch.setattr(pivotal_import, "BATCH_SIZE", 2)
+    mock_emitter = get_mock_emitter()
+    story_created = threading.Event()
+
+    def emitter(items, on_created=None):
+        if not items or items[0]["type"] == "label":
+            pass
+        elif items[0]["type"] == "story":
+            story_created.set()
+        else:
+            # epics and iterations are only created once a story has been,
+            # so the import would hang if stories waited for them
+            assert story_created.wait(5)
+        return mock_emitter(items, on_created)
+
+    entity_collector = EntityCollector(emitter, max_workers=4)
+    entity_collector.collect(
+        {
+            "type": "epic",
+            "entity": {"name": "An Epic", "labels": [{"name": "my-epic-label"}]},
+        }
+    )
+    stories = [
+        {
+            "type": "story",
+            "entity": {"name": f"A Story {n}", "external_id": str(n)},
+            "iteration": None,
+            "pt_iteration_id": None,
+        }
+        for n in range(4)
+    ]
+    stories[1]["entity"]["labels"] = [{"name": "my-epic-label"}]
+    stories[2]["iteration"] = "5|2024-01-01|2024-01-08"
+    stories[2]["pt_iteration_id"] = "5"
+    for story in stories:
+        entity_collector.collect(story)
+
+    created = entity_collector.commit()
+
+    epic_id = entity_collector.epics[0]["imported_entity"]["id"]
+    iteration_id = entity_collector.iterations[0]["imported_entity"]["id"]
+    assert epic_id == stories[1]["imported_entity"]["epic_id"]
+    assert iteration_id == stories[2]["imported_entity"]["iteration_id"]
+    assert "epic_id" not in stories[0]["imported_entity"]
+    assert 6 == len(created)
+
+
+def test_entity_collector_pipelined_story_before_unrelated_epic():
+    mock_emitter = get_mock_emitter()
+    story_created = threading.Event()
+    created_types = []
+
+    def emitter(items, on_created=None):
+        if items and items[0]["type"] == "epic":
+            # the story doesn't belong to any epic, so it mustn't wait on them
+            assert story_created.wait(5)
+        mock_emitter(items, on_created)
+        created_types.extend(item["type"] for item in items)
+        if items and items[0]["type"] == "story":
+            story_created.set()
+        return items
+
+    entity_collector = EntityCollector(emitter, max_workers=2)
+    for n in range(4):
+        entity_collector.collect(
+            {
+                "type": "epic",
+                "entity": {"name": f"Epic {n}", "labels": [{"name": f"epic-{n}"}]},
+            }
+        )
+    entity_collector.collect(
+        {
+            "type": "story",
+            "entity": {"name": "A Story", "external_id": "1"},
+            "iteration": None,
+            "pt_iteration_id": None,
+        }
+    )
+
+    created = entity_collector.commit()
+
+    assert ["story", "epic", "epic", "epic", "epic"] == created_types
+    assert 5 == len(created)
+
+
+def test_entity_collector_pipelined_uploads_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data/1")
+    with open("data/1/a.txt", "w") as f:
+        f.write("a")
+
+    entity_collector = EntityCollector(max_workers=2)
+    story = {
+        "type": "story",
+        "entity": {"name": "A Story", "external_id": "1"},
+        "iteration": None,
+        "pt_iteration_id": None,
+    }
+    entity_collector.collect(story)
+    entity_collector.commit()
+
+    file_id = entity_collector.files[0]["imported_entity"]["id"]
+    assert [file_id] == story["imported_entity"]["file_ids"]
+
+
+def test_sc_creator(monkeypatch):
+    import pivotal_import
+
+    posted = []
+
+    def fake_sc_post(path, data={}):
+        posted.append(path)
+        if path == "/stories/bulk":
+            return [{"id": s["name"]} for s in data["stories"]]
+        return {"id": data["name"]}
+
+    monkeypatch.setattr(pivotal_import, "sc_post", fake_sc_post)
+    monkeypatch.setattr(pivotal_import, "BATCH_SIZE", 2)
+
+    items = [{"type": "epic", "entity": {"name": f"Epic {i}"}} for i in range(5)]
+    assert items == sc_creator(items)
+    assert [f"Epic {i}" for i in range(5)] == [
+        item["imported_entity"]["id"] for item in items
+    ]
+
+    stories = [{"type": "story", "entity": {"name": f"Story {i}"}} for i in range(5)]
+    sc_creator(stories)
+    assert [f"Story {i}" for i in range(5)] == [
+        s["imported_entity"]["id"] for s in stories
+    ]
+    assert 3 == posted.count("/stories/bulk")
+
+
+def test_story_batches():
+    stories = [
+        {"type": "story", "entity": {"name": "x" * size}} for size in [10, 10, 200, 10]
+    ]
+    batches = list(story_batches(stories, max_count=3, max_bytes=100))
+    assert [stories[0:2], stories[2:3], stories[3:4]] == batches
+    batches = list(story_batches(stories, max_count=3, max_bytes=1000))
+    assert [stories[0:3], stories[3:4]] == batches
+
+
+def test_sc_creator_isolates_bad_story(monkeypatch):
+    import pivotal_import
+
+    batch_sizes = []
+
+    def fake_sc_post(path, data={}):
+        batch_sizes.append(len(data["stories"]))
+        if any(s["name"] == "Bad Story" for s in data["stories"]):
+            resp = requests.Response()
+            resp.status_code = 400
+            raise requests.HTTPError("400 Client Error", response=resp)
+        return [{"id": s["name"]} for s in data["stories"]]
+
+    monkeypatch.setattr(pivotal_import, "sc_post", fake_sc_post)
+    monkeypatch.setattr(pivotal_import, "BATCH_SIZE", 4)
+
+    stories = [{"type": "story", "entity": {"name": f"Story {i}"}} for i in range(4)]
+    stories[2]["entity"]["name"] = "Bad Story"
+    created = []
+    sc_creator(stories, on_created=created.append)
+
+    assert [stories[0], stories[1], stories[3]] == created
+    assert "imported_entity" not in stories[2]
+    assert "400 Client Error" == stories[2]["import_error"]
+    assert [4, 2, 2, 1, 1] == batch_sizes
+
+
+def test_sc_creator_does_not_resend_batch_on_server_error(monkeypatch):
+    import pivotal_import
+
+    batch_sizes = []
+
+    def fake_sc_post(path, data={}):
+        batch_sizes.append(len(data["stories"]))
+        resp = requests.Response()
+        resp.status_code = 502
+        raise requests.HTTPError("502 Server Error", response=resp)
+
+    monkeypatch.setattr(pivotal_import, "sc_post", fake_sc_post)
+    monkeypatch.setattr(pivotal_import, "BATCH_SIZE", 4)
+
+    # the stories may have been created, so resending them could duplicate them
+    stories = [{"type": "story", "entity": {"name": f"Story {i}"}} for i in range(4)]
+    with pytest.raises(requests.HTTPError):
+        sc_creator(stories)
+    assert [4] == batch_sizes
+
+
+def test_sc_creator_unknown_type():
+    with pytest.raises(RuntimeError):
+        sc_creator([{"type": "milestone", "entity": {"name": "A Milestone"}}])
+
+
+def test_entity_collector_resumes_from_journal(tmp_path):
+    journal = ImportJournal.create(
+        PIVOTAL_TO_SHORTCUT_RUN_LABEL, str(tmp_path / "journal.jsonl")
+    )
+    journal.record(
+        {
+            "type": "story",
+            "entity": {"name": "A Story 1", "external_id": "1234"},
+            "imported_entity": {
+                "id": 100,
+                "entity_type": "story",
+                "name": "A Story 1",
+                "app_url": "https://example.com/entity/100",
+            },
+        }
+    )
+    entity_collector = EntityCollector(journal=journal)
+    for name, external_id in [("A Story 1", "1234"), ("A Story 2", "4567")]:
+        entity_collector.collect(
+            {
+                "type": "story",
+                "entity": {"name": name, "external_id": external_id},
+                "iteration": None,
+                "pt_iteration_id": None,
+            }
+        )
+
+    created = entity_collector.commit()
+
+    # Only the story missing from the journal was created, and it was journaled
+    assert [100, 0] == [entity["id"] for entity in created]
+    assert 0 == journal.get(entity_collector.stories[1])["id"]
+    journal.close()
+
+
+def test_failed_run_leaves_no_journal(tmp_path, monkeypatch):
+    import lib
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    # no API token, so the environment doesn't validate
+    monkeypatch.setattr(lib, "sc_token", None)
+
+    with pytest.raises(SystemExit):
+        main(["pivotal_import.py", "--apply"])
+
+    # the next run isn't blocked by the journal of an import that never started
+    assert not ImportJournal.exists()
+    assert open_journal(parser.parse_args(["--apply"])) is None
+
+
+def test_story_spool():
+    spool = StorySpool()
+    for i in range(5):
+        spool.append({"type": "story", "entity": {"name": f"A Story {i}"}})
+    assert 5 == len(spool)
+    chunks = list(spool.chunks(2))
+    assert [2, 2, 1] == [len(chunk) for chunk in chunks]
+    assert "A Story 4" == chunks[-1][0]["entity"]["name"]
+    # the spool can be read again
+    assert 3 == len(list(spool.chunks(2)))
+    spool.close()
+
+
+def test_entity_collector_streaming(monkeypatch):
+    import pivotal_import
+
+    monkeypatch.setattr(pivotal_import, "STORY_CHUNK_SIZE", 2)
+    entity_collector = EntityCollector(stream=True)
+    entity_collector.collect(
+        {
+            "type": "epic",
+            "entity": {"name": "An Epic", "labels": [{"name": "my-epic-label"}]},
+            "iteration": None,
+            "pt_iteration_id": None,
+        }
+    )
+    for i in range(3):
+        entity_collector.collect(
+            {
+                "type": "story",
+                "entity": {
+                    "name": f"A Story {i}",
+                    "external_id": str(i),
+                    "labels": [{"name": "my-epic-label"}],
+                    "description": "A long description " * 100,
+                },
+                "iteration": None,
+                "pt_iteration_id": None,
+                "parsed_row": {"description": "A long description " * 100},
+            }
+        )
+
+    created = entity_collector.commit()
+
+    assert [
+        {
+            "id": 0,
+            "entity_type": "epic",
+            "name": "An Epic",
+            "labels": [{"name": "my-epic-label"}],
+            "app_url": "https://example.com/entity/0",
+        }
+    ] + [
+        {
+            "id": i + 1,
+            "entity_type": "story",
+            "name": f"A Story {i}",
+            "epic_id": 0,
+            "app_url": f"https://example.com/entity/{i + 1}",
+        }
+        for i in range(3)
+    ] == created
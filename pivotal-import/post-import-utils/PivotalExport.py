@@ -3,6 +3,7 @@ import  csv
 from    dataclasses         import dataclass
 from    itertools           import islice
 import  io
+import  json
 import  os
 import  regex
 import  requests
@@ -42,14 +43,41 @@ class PivotalItemLabelRec:
 
 class PivotalExport:
 
-    def __init__( self, csv_path ):
+    def __init__( self, csv_path, profile_path = None ):
         '''
         Represents an extract of data from a Pivotal export
+
+        If initialize.py saved a profile of this export (see profile_path),
+        the labels of each item are read from it rather than the CSV. The
+        CSV is only read, once, when something else is asked for.
         '''
 
+        self.csv_path     = csv_path
+        self.profile_path = profile_path or os.path.join( os.path.dirname(csv_path), 'pivotal_export_profile.json' )
+        self._row_omds    = None
+
+    @property
+    def row_omds( self ):
+
         # Get the CSV as a list of rows, each represented as an OMD
-        self.csv_path = csv_path
-        self.row_omds = list( self.gen_csv_row_as_omd() )
+        if self._row_omds is None: self._row_omds = list( self.gen_csv_row_as_omd() )
+        return self._row_omds
+
+    def load_profile( self ):
+        '''
+        Return the profile initialize.py saved of this export, or None if there is none
+        or the export has changed since.
+        '''
+
+        try:
+            with open( self.profile_path, 'r' ) as f: profile = json.load( f )
+            st = os.stat( self.csv_path )
+        except ( OSError, ValueError ):
+            return None
+        source = profile.get( 'source', {} )
+        if source.get('path') != os.path.abspath(self.csv_path) or source.get('size') != st.st_size or source.get('mtime_ns') != st.st_mtime_ns:
+            return None
+        return profile
 
     def gen_csv_row_as_list_of_tuples( self ):
 
@@ -65,6 +93,17 @@ class PivotalExport:
 
     def gen_itemlabelrecs( self ):
 
+        profile = self.load_profile()
+        if profile is not None and profile.get('version') == 1:
+            for item_type, item_id, item_name, labels in profile['items']:
+                yield PivotalItemLabelRec(
+                    item_type = item_type,
+                    item_id   = item_id,
+                    item_name = item_name,
+                    labels    = tuple( regex.split( r',\s*', labels ) )
+                )
+            return
+
         for row_omd in self.row_omds:
             yield PivotalItemLabelRec(
                 item_type = row_omd['Type'],
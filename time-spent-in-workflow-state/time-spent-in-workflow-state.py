@@ -7,10 +7,12 @@ by fetching and parsing story history data from the Shortcut API.
 
 Usage:
     python workflow_time_analysis.py story_id1 story_id2 story_id3 ...
+    python workflow_time_analysis.py --query "team:Mobile is:done"
     
 Requirements:
     - Set SHORTCUT_API_TOKEN environment variable
     - Python 3.x with requests library
+    - Optionally, numpy, to compute time in states faster for large numbers of stories
 
 Example:
     python workflow_time_analysis.py 12345 67890 11111
@@ -18,33 +20,388 @@ Example:
 
 import os
 import sys
+import hashlib
+import sqlite3
+import threading
+import time
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import List, Dict, Any, Optional
+from types import MappingProxyType
+from typing import Iterable, Iterator, List, Dict, Any, Mapping, NamedTuple, Optional, Tuple
+from urllib.parse import urlencode
 import argparse
 import csv
+import math
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; see compute_time_in_states
+    np = None
+
+
+class RateLimiter:
+    """
+    Spaces requests evenly so that no more than `requests_per_minute` are sent,
+    across all threads. When the API throttles a request anyway, `pause` holds
+    back every thread until the API is ready again.
+    """
+
+    def __init__(self, requests_per_minute: float, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 60 / requests_per_minute
+        self.clock = clock
+        self.sleep = sleep
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        with self.lock:
+            now = self.clock()
+            send_at = max(now, self.next_at)
+            self.next_at = send_at + self.interval
+        if send_at > now:
+            self.sleep(send_at - now)
+
+    def pause(self, seconds: float):
+        """Send no more requests for `seconds`."""
+        with self.lock:
+            self.next_at = max(self.next_at, self.clock() + seconds)
+
+
+class StoryHistoryCache:
+    """
+    An on-disk SQLite store of story histories, keyed by story ID.
+
+    Story history is append-only, and any change to a story changes its
+    updated_at, so a cached history is current for as long as the story's
+    updated_at matches the one it was cached with. Histories are stored as
+    compressed JSON.
+    """
+
+    def __init__(self, db_file: str):
+        os.makedirs(os.path.dirname(db_file), exist_ok=True)
+        self.db_file = db_file
+        self.db = sqlite3.connect(db_file, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        with self.lock:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS story_history ('
+                            'story_id TEXT PRIMARY KEY, '
+                            'updated_at TEXT NOT NULL, '
+                            'history BLOB NOT NULL)')
+            self.db.commit()
+
+    def get(self, story_id: str, updated_at: str) -> Optional[List[Dict[str, Any]]]:
+        """Return the story's cached history, or None if it is missing or stale."""
+        with self.lock:
+            row = self.db.execute(
+                'SELECT history FROM story_history WHERE story_id = ? AND updated_at = ?',
+                (story_id, updated_at)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, story_id: str, updated_at: str, history: List[Dict[str, Any]]):
+        """Cache the story's history, as of the story's updated_at."""
+        blob = zlib.compress(json.dumps(history).encode('utf-8'))
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO story_history (story_id, updated_at, history) '
+                'VALUES (?, ?, ?)',
+                (story_id, updated_at, blob))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class WorkflowStates(NamedTuple):
+    """Read-only lookups of the workspace's workflow states, by state ID."""
+
+    names: Mapping[int, str]
+    order: Mapping[int, int]
+    types: Mapping[int, str]
+
+    def name(self, state_id: Optional[int]) -> str:
+        return self.names.get(state_id, f"Unknown State ({state_id})")
+
+    def sorted_ids(self, state_ids) -> List[int]:
+        """Sort state IDs by their position in their workflow."""
+        return sorted(state_ids, key=lambda sid: self.order.get(sid, 999))
+
+
+def parse_timestamp(timestamp_str: Optional[str]) -> datetime:
+    """
+    Parse a timestamp string into a datetime object.
+
+    Args:
+        timestamp_str: ISO format timestamp string
+
+    Returns:
+        datetime object (now, if there is no timestamp)
+    """
+    if not timestamp_str:
+        return datetime.now(timezone.utc)
+
+    # Handle different timestamp formats
+    try:
+        # Try parsing with timezone info
+        return datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            # Fallback to basic parsing
+            return datetime.strptime(timestamp_str, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=timezone.utc)
+        except ValueError:
+            # Last resort
+            return datetime.strptime(timestamp_str, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+
+
+class TimeInStates(NamedTuple):
+    """Time spent in workflow states, in hours, by a batch of stories."""
+
+    # For each story: the hours it spent in each state it entered
+    story_hours: List[Dict[int, float]]
+    # For each story: the hours it spent in all states
+    story_totals: List[float]
+    # For each state: how many stories entered it, and their hours in it
+    state_story_counts: Dict[int, int]
+    state_totals: Dict[int, float]
+    # For each state: the percentiles (see PERCENTILES) of the stories' hours in it
+    state_percentiles: Dict[int, Dict[int, float]]
+
+
+"""The percentiles of the hours stories spent in each state that are reported"""
+PERCENTILES = (50, 85, 95)
+
+
+def compute_time_in_states(stories_changes: List[List[Dict[str, Any]]], skip_state_ids=frozenset(),
+                           now: Optional[datetime] = None) -> TimeInStates:
+    """
+    Compute the time a batch of stories spent in each workflow state, in one pass.
+
+    A story is in the state of each change until its next change, or until
+    now for its last change. Uses numpy when it is installed, else plain Python;
+    both give the same results.
+
+    Args:
+        stories_changes: For each story, its workflow changes in chronological
+            order, as returned by parse_workflow_changes
+        skip_state_ids: States whose time isn't counted, e.g. "done" states
+        now: The time to count the time in stories' current state up to (default: now)
+
+    Returns:
+        The TimeInStates of the stories, which are in the same order as stories_changes
+    """
+    now_seconds = (now or datetime.now(timezone.utc)).timestamp()
+    if np is not None:
+        return _compute_time_in_states_numpy(stories_changes, skip_state_ids, now_seconds)
+    return _compute_time_in_states_python(stories_changes, skip_state_ids, now_seconds)
+
+
+def _percentile(sorted_hours: List[float], q: float) -> float:
+    """Linearly interpolated percentile, as numpy.percentile computes by default."""
+    position = (len(sorted_hours) - 1) * q / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_hours) - 1)
+    return sorted_hours[lower] + (sorted_hours[upper] - sorted_hours[lower]) * (position - lower)
+
+
+def _compute_time_in_states_python(stories_changes, skip_state_ids, now_seconds) -> TimeInStates:
+    story_hours = []
+    for changes in stories_changes:
+        times = [parse_timestamp(change['timestamp']).timestamp() if change['timestamp'] else now_seconds
+                 for change in changes]
+        times.append(now_seconds)
+        hours = {}
+        for i, change in enumerate(changes):
+            state_id = change['to_state_id']
+            if state_id in skip_state_ids:
+                continue
+            hours[state_id] = hours.get(state_id, 0.0) + (times[i + 1] - times[i]) / 3600
+        story_hours.append(hours)
+
+    hours_by_state = {}
+    for hours in story_hours:
+        for state_id, state_hours in hours.items():
+            hours_by_state.setdefault(state_id, []).append(state_hours)
+    state_percentiles = {}
+    for state_id, state_hours in hours_by_state.items():
+        state_hours.sort()
+        state_percentiles[state_id] = {q: _percentile(state_hours, q) for q in PERCENTILES}
+    return TimeInStates(
+        story_hours=story_hours,
+        story_totals=[sum(hours.values()) for hours in story_hours],
+        state_story_counts={state_id: len(state_hours) for state_id, state_hours in hours_by_state.items()},
+        state_totals={state_id: sum(state_hours) for state_id, state_hours in hours_by_state.items()},
+        state_percentiles=state_percentiles,
+    )
+
+
+def _epoch_seconds(timestamps: List[Optional[str]], now_seconds: float):
+    """Parse ISO timestamps into a numpy array of seconds since the epoch."""
+    try:
+        # numpy parses ISO timestamps natively, but not time zones: Shortcut's are all UTC ("Z")
+        parsed = np.array([ts[:-1] if ts and ts.endswith('Z') else (ts or 'NaT') for ts in timestamps],
+                          dtype='datetime64[us]')
+        seconds = parsed.astype(np.int64) / 1e6
+        seconds[np.isnat(parsed)] = now_seconds
+        return seconds
+    except ValueError:
+        return np.array([parse_timestamp(ts).timestamp() if ts else now_seconds for ts in timestamps])
+
+
+def _compute_time_in_states_numpy(stories_changes, skip_state_ids, now_seconds) -> TimeInStates:
+    # Flatten every story's changes into columns: story index, state, time
+    counts = np.fromiter((len(changes) for changes in stories_changes), dtype=np.int64,
+                         count=len(stories_changes))
+    story_index = np.repeat(np.arange(len(stories_changes)), counts)
+    changes = [change for story_changes in stories_changes for change in story_changes]
+    # State IDs are coded as consecutive integers, so they can index arrays
+    state_ids = {}
+    state_codes = np.fromiter((state_ids.setdefault(change['to_state_id'], len(state_ids)) for change in changes),
+                              dtype=np.int64, count=len(changes))
+    state_ids = list(state_ids)
+    times = _epoch_seconds([change['timestamp'] for change in changes], now_seconds)
+
+    # Each change lasts until the story's next change, its last one until now
+    ends = np.empty_like(times)
+    ends[:-1] = times[1:]
+    is_last = np.ones(len(changes), dtype=bool)
+    is_last[:-1] = story_index[1:] != story_index[:-1]
+    ends[is_last] = now_seconds
+    hours = (ends - times) / 3600
+
+    counted = ~np.isin(state_codes, [code for code, state_id in enumerate(state_ids) if state_id in skip_state_ids])
+    story_index, state_codes, hours = story_index[counted], state_codes[counted], hours[counted]
+
+    # Sum the hours of each (story, state) pair
+    pairs, pair_index = np.unique(story_index * len(state_ids) + state_codes, return_inverse=True)
+    pair_hours = np.bincount(pair_index, weights=hours, minlength=len(pairs))
+    pair_stories, pair_states = np.divmod(pairs, max(len(state_ids), 1))
+
+    story_hours = [{} for _ in stories_changes]
+    for story, code, state_hours in zip(pair_stories.tolist(), pair_states.tolist(), pair_hours.tolist()):
+        story_hours[story][state_ids[code]] = state_hours
+    story_totals = np.bincount(pair_stories, weights=pair_hours, minlength=len(stories_changes))
+    state_counts = np.bincount(pair_states, minlength=len(state_ids))
+    state_totals = np.bincount(pair_states, weights=pair_hours, minlength=len(state_ids))
+
+    # Percentiles per state: sort the pairs by state, then by hours, and split by state
+    order = np.lexsort((pair_hours, pair_states))
+    by_state = np.split(pair_hours[order], np.cumsum(state_counts)[:-1])
+    state_percentiles = {
+        state_ids[code]: dict(zip(PERCENTILES, np.percentile(state_hours, PERCENTILES).tolist()))
+        for code, state_hours in enumerate(by_state) if len(state_hours)
+    }
+    return TimeInStates(
+        story_hours=story_hours,
+        story_totals=story_totals.tolist(),
+        state_story_counts={state_ids[code]: count for code, count in enumerate(state_counts.tolist()) if count},
+        state_totals={state_ids[code]: state_totals[code].item() for code in range(len(state_ids))
+                      if state_counts[code]},
+        state_percentiles=state_percentiles,
+    )
 
 
 class ShortcutWorkflowAnalyzer:
     """Analyzes time spent by stories in different workflow states."""
     
-    def __init__(self, include_done_states: bool = False):
+    # Workspace metadata, such as workflows, rarely changes, so it is cached
+    # on disk for a day and then revalidated with a conditional request.
+    METADATA_CACHE_TTL_SECONDS = 24 * 60 * 60
+
+    # Shortcut allows 200 requests per minute per token; stay just under it.
+    REQUESTS_PER_MINUTE = 195
+    # How many times a throttled (HTTP 429) request is retried, and how long
+    # to wait before retrying when the API doesn't say (via Retry-After).
+    MAX_THROTTLE_RETRIES = 5
+    DEFAULT_RETRY_AFTER_SECONDS = 60
+
+    # The largest page of results the story search API returns
+    SEARCH_PAGE_SIZE = 25
+
+    def __init__(self, include_done_states: bool = False, refresh: bool = False, max_workers: int = 1,
+                 history_cache: bool = False):
         """Initialize the analyzer with API configuration.
 
         Args:
             include_done_states: Whether to include time spent in "done" type states (default: False)
+            refresh: Whether to revalidate cached workspace metadata before using it (default: False)
+            max_workers: How many stories to analyze concurrently (default: 1)
+            history_cache: Whether to cache story histories on disk between runs (default: False)
         """
         self.api_token = os.getenv('SHORTCUT_API_TOKEN')
         if not self.api_token:
             raise ValueError("SHORTCUT_API_TOKEN environment variable is required")
 
-        self.api_base_url = 'https://api.app.shortcut.com/api/v3'
+        api_host = os.getenv('SHORTCUT_API_BASE_URL', 'https://api.app.shortcut.com').rstrip('/')
+        self.api_host = api_host
+        self.api_base_url = f'{api_host}/api/v3'
         self.headers = {
             'Shortcut-Token': self.api_token,
             'Content-Type': 'application/json'
         }
         self.include_done_states = include_done_states
+        self.refresh = refresh
+        cache_home = os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        cache_key = f"{self.api_base_url}\n{self.api_token}"
+        token_hash = hashlib.sha256(cache_key.encode('utf-8')).hexdigest()[:16]
+        self.metadata_cache_dir = os.path.join(cache_home, 'shortcut-api-cookbook', token_hash)
+
+        self.history_cache: Optional[StoryHistoryCache] = None
+        if history_cache:
+            try:
+                self.history_cache = StoryHistoryCache(
+                    os.path.join(self.metadata_cache_dir, 'story-history.sqlite3'))
+            except (OSError, sqlite3.Error) as e:
+                print(f"Not caching story histories, the cache could not be opened: {e}")
+
+        # The time in states of the stories of the last batch analyzed
+        self.time_in_states: Optional[TimeInStates] = None
+
+        # Loaded on first use, then shared by every story of the run
+        self._workflow_states: Optional[WorkflowStates] = None
+        self._workflow_states_lock = threading.Lock()
+
+        # One rate limiter and one pool of connections shared by all workers
+        self.max_workers = max(1, max_workers)
+        self.limiter = RateLimiter(self.REQUESTS_PER_MINUTE)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _get(self, url: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """
+        Send a rate-limited GET request, retrying it when the API throttles it.
+
+        Args:
+            url: The URL to GET
+            headers: The request headers (default: the API headers)
+
+        Returns:
+            The final response; callers decide how to handle errors
+        """
+        for attempt in range(self.MAX_THROTTLE_RETRIES + 1):
+            self.limiter.acquire()
+            response = self.session.get(url, headers=headers or self.headers)
+            if response.status_code != 429 or attempt == self.MAX_THROTTLE_RETRIES:
+                return response
+            try:
+                retry_after = float(response.headers['Retry-After'])
+            except (KeyError, ValueError):
+                retry_after = self.DEFAULT_RETRY_AFTER_SECONDS
+            print(f"Rate limited by the Shortcut API, retrying in {retry_after:g} seconds...")
+            self.limiter.pause(retry_after)
+        return response
     
     def fetch_story_history(self, story_id: str) -> Dict[str, Any]:
         """
@@ -62,7 +419,7 @@ class ShortcutWorkflowAnalyzer:
         url = f"{self.api_base_url}/stories/{story_id}/history"
         
         try:
-            response = requests.get(url, headers=self.headers)
+            response = self._get(url)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -71,6 +428,32 @@ class ShortcutWorkflowAnalyzer:
                 print(f"Story {story_id} not found. Please check the story ID.")
             raise
     
+    def get_story_history(self, story_id: str, updated_at: Optional[str]) -> List[Dict[str, Any]]:
+        """
+        Get a story's history from the history cache if it is current, else fetch it.
+
+        Args:
+            story_id: The ID of the story
+            updated_at: The story's updated_at, which the cached history must match
+
+        Returns:
+            The story history data
+        """
+        if self.history_cache is None or not updated_at:
+            return self.fetch_story_history(story_id)
+        try:
+            history_data = self.history_cache.get(story_id, updated_at)
+        except (sqlite3.Error, zlib.error, ValueError) as e:
+            print(f"Error reading the cached history of story {story_id}: {e}")
+            history_data = None
+        if history_data is None:
+            history_data = self.fetch_story_history(story_id)
+            try:
+                self.history_cache.put(story_id, updated_at, history_data)
+            except sqlite3.Error as e:
+                print(f"Error caching the history of story {story_id}: {e}")
+        return history_data
+
     def fetch_story_details(self, story_id: str) -> Dict[str, Any]:
         """
         Fetch basic story details to get current state.
@@ -84,13 +467,41 @@ class ShortcutWorkflowAnalyzer:
         url = f"{self.api_base_url}/stories/{story_id}"
         
         try:
-            response = requests.get(url, headers=self.headers)
+            response = self._get(url)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
             print(f"Error fetching story details for {story_id}: {e}")
             raise
     
+    def search_stories(self, query: str) -> Iterator[Dict[str, Any]]:
+        """
+        Search for stories, yielding them page by page as the pages arrive.
+
+        Args:
+            query: A Shortcut search query, e.g. "team:Mobile is:done"
+
+        Yields:
+            The stories found; each carries the name, type, workflow state
+            and updated_at that analyze_story needs from the story details
+
+        Raises:
+            requests.exceptions.RequestException: If the API call fails
+        """
+        params = {'query': query, 'page_size': self.SEARCH_PAGE_SIZE, 'detail': 'slim'}
+        url = f"{self.api_base_url}/search/stories?{urlencode(params)}"
+        while url:
+            response = self._get(url)
+            try:
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                print(f"Error searching for stories matching {query!r}: {e}")
+                raise
+            page = response.json()
+            yield from page.get('data', [])
+            # The next page is given as a path, e.g. "/api/v3/search/stories?next=..."
+            url = f"{self.api_host}{page['next']}" if page.get('next') else None
+
     def parse_workflow_changes(self, history_data: List[Dict[str, Any]], story_details: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
         Parse the history data to extract workflow state changes with timestamps.
@@ -152,6 +563,62 @@ class ShortcutWorkflowAnalyzer:
 
         return workflow_changes
     
+    def fetch_cached(self, path: str) -> Any:
+        """
+        Fetch slowly-changing workspace metadata through the on-disk cache.
+
+        Args:
+            path: The API path to GET, e.g. "/workflows"
+
+        Returns:
+            The JSON response body, from the cache if it is fresh
+
+        Raises:
+            requests.exceptions.RequestException: If the API call fails
+        """
+        name = hashlib.sha256(json.dumps([path, {}]).encode('utf-8')).hexdigest()[:32]
+        cache_file = os.path.join(self.metadata_cache_dir, f"{name}.json")
+        try:
+            with open(cache_file, encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+        # A partly written or older entry is treated as a cache miss
+        if not (isinstance(entry, dict) and 'body' in entry
+                and isinstance(entry.get('fetched_at'), (int, float))):
+            entry = None
+
+        now = time.time()
+        if entry and not self.refresh and now - entry['fetched_at'] < self.METADATA_CACHE_TTL_SECONDS:
+            return entry['body']
+
+        headers = dict(self.headers)
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        response = self._get(f"{self.api_base_url}{path}", headers)
+        if response.status_code == 304 and entry is not None:
+            entry['fetched_at'] = now
+        else:
+            response.raise_for_status()
+            entry = {
+                'fetched_at': now,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'body': response.json(),
+            }
+
+        try:
+            os.makedirs(self.metadata_cache_dir, exist_ok=True)
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            pass  # the cache is only an optimization
+        return entry['body']
+
     def fetch_workflow_states(self) -> tuple[Dict[int, str], Dict[int, int], Dict[int, str]]:
         """
         Fetch all workflow states to map IDs to names, order, and types.
@@ -162,12 +629,8 @@ class ShortcutWorkflowAnalyzer:
             - state_order: Dictionary mapping state IDs to their order position within their workflow
             - state_types: Dictionary mapping state IDs to their type (backlog, unstarted, started, done)
         """
-        url = f"{self.api_base_url}/workflows"
-
         try:
-            response = requests.get(url, headers=self.headers)
-            response.raise_for_status()
-            workflows = response.json()
+            workflows = self.fetch_cached('/workflows')
 
             state_map = {}
             state_order = {}
@@ -184,116 +647,101 @@ class ShortcutWorkflowAnalyzer:
         except requests.exceptions.RequestException as e:
             print(f"Error fetching workflow states: {e}")
             return {}, {}, {}
-    
-    def calculate_time_in_states(self, workflow_changes: List[Dict[str, Any]], state_map: Dict[int, str],
-                                 state_types: Dict[int, str], include_done_states: bool = False) -> Dict[int, float]:
-        """
-        Calculate the time spent in each workflow state.
 
-        Args:
-            workflow_changes: List of workflow state changes
-            state_map: Mapping of state IDs to names
-            state_types: Mapping of state IDs to types
-            include_done_states: Whether to include time spent in "done" type states (default: False)
+    def workflow_states(self) -> WorkflowStates:
+        """
+        Get the workspace's workflow states, fetching them on first use only.
 
         Returns:
-            Dictionary mapping state IDs to time spent (in hours)
+            The WorkflowStates shared by all the stories analyzed
         """
-        time_in_states = {}
-
-        if not workflow_changes:
-            return time_in_states
-
-        for i in range(len(workflow_changes)):
-            current_change = workflow_changes[i]
-            to_state_id = current_change['to_state_id']
-
-            # Skip "done" type states unless explicitly included
-            if not include_done_states and state_types.get(to_state_id) == 'done':
-                continue
+        with self._workflow_states_lock:
+            if self._workflow_states is not None:
+                return self._workflow_states
+            state_map, state_order, state_types = self.fetch_workflow_states()
+            states = WorkflowStates(MappingProxyType(state_map),
+                                    MappingProxyType(state_order),
+                                    MappingProxyType(state_types))
+            # If fetching failed, try again for the next story
+            if state_map:
+                self._workflow_states = states
+            return states
+    
+    @staticmethod
+    def _done_state_ids(state_types: Mapping[int, str]) -> set:
+        return {state_id for state_id, state_type in state_types.items() if state_type == 'done'}
 
-            # Parse the current timestamp
-            current_time = self._parse_timestamp(current_change['timestamp'])
+    def compute_batch(self, results: List[Dict[str, Any]]) -> TimeInStates:
+        """
+        Compute the time in states of all the successfully analyzed stories at once,
+        setting each result's time_in_states and total_hours, and dropping its
+        workflow_changes.
 
-            # Calculate time spent in this state
-            if i < len(workflow_changes) - 1:
-                # Not the last change, use next change timestamp
-                next_change = workflow_changes[i + 1]
-                next_time = self._parse_timestamp(next_change['timestamp'])
-                time_spent = (next_time - current_time).total_seconds() / 3600  # Convert to hours
-            else:
-                # Last change - if story is complete, calculate to now
-                # Otherwise, this represents current state
-                now = datetime.now(timezone.utc)
-                time_spent = (now - current_time).total_seconds() / 3600
-
-            # Add to total time for this state
-            if to_state_id in time_in_states:
-                time_in_states[to_state_id] += time_spent
-            else:
-                time_in_states[to_state_id] = time_spent
+        Args:
+            results: Analysis results, as returned by collect_story
 
+        Returns:
+            The TimeInStates of the successful results, also kept in self.time_in_states
+        """
+        successful = [result for result in results if result.get('analysis_successful')]
+        skip_state_ids = set()
+        if not self.include_done_states:
+            skip_state_ids = self._done_state_ids(self.workflow_states().types)
+        time_in_states = compute_time_in_states([result.pop('workflow_changes') for result in successful],
+                                                skip_state_ids)
+        for result, hours, total_hours in zip(successful, time_in_states.story_hours,
+                                              time_in_states.story_totals):
+            result['time_in_states'] = hours
+            result['total_hours'] = total_hours
+        self.time_in_states = time_in_states
         return time_in_states
-    
-    def _parse_timestamp(self, timestamp_str: str) -> datetime:
+
+    def analyze_story(self, story_id: str, story_details: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
-        Parse a timestamp string into a datetime object.
+        Analyze a single story's time spent in workflow states.
         
         Args:
-            timestamp_str: ISO format timestamp string
+            story_id: The ID of the story to analyze
+            story_details: The story's details, e.g. from search results (default: fetched)
             
         Returns:
-            datetime object
+            Dictionary containing the analysis results
         """
-        if not timestamp_str:
-            return datetime.now(timezone.utc)
-        
-        # Handle different timestamp formats
-        try:
-            # Try parsing with timezone info
-            return datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-        except ValueError:
-            try:
-                # Fallback to basic parsing
-                return datetime.strptime(timestamp_str, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=timezone.utc)
-            except ValueError:
-                # Last resort
-                return datetime.strptime(timestamp_str, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
-    
-    def analyze_story(self, story_id: str) -> Dict[str, Any]:
+        result = self.collect_story(story_id, story_details)
+        self.compute_batch([result])
+        return result
+
+    def collect_story(self, story_id: str, story_details: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
-        Analyze a single story's time spent in workflow states.
-        
+        Fetch a story's details and history, and parse its workflow changes.
+
         Args:
             story_id: The ID of the story to analyze
-            
+            story_details: The story's details, e.g. from search results (default: fetched)
+
         Returns:
-            Dictionary containing the analysis results
+            Dictionary containing the analysis results, with the story's
+            workflow_changes rather than its time_in_states; see compute_batch
         """
         try:
             print(f"Analyzing story {story_id}...")
             
             # Fetch data
-            history_data = self.fetch_story_history(story_id)
-            story_details = self.fetch_story_details(story_id)
+            # The details come first: the cached history is current only
+            # if the story hasn't been updated since it was cached
+            if story_details is None:
+                story_details = self.fetch_story_details(story_id)
+            history_data = self.get_story_history(story_id, story_details.get('updated_at'))
             
-            # Get workflow state mapping, order, and types
-            state_map, state_order, state_types = self.fetch_workflow_states()
-
             # Parse workflow changes
             workflow_changes = self.parse_workflow_changes(history_data, story_details)
 
-            # Calculate time in states
-            time_in_states = self.calculate_time_in_states(workflow_changes, state_map, state_types, self.include_done_states)
-
             return {
                 'story_id': story_id,
                 'story_name': story_details.get('name', 'Unknown'),
                 'story_type': story_details.get('story_type', 'Unknown'),
-                'current_state': state_map.get(story_details.get('workflow_state_id'), 'Unknown'),
-                'time_in_states': time_in_states,
-                'state_map': state_map,
-                'state_order': state_order,
+                'current_state_id': story_details.get('workflow_state_id'),
+                'workflow_changes': workflow_changes,
                 'total_changes': len(workflow_changes),
                 'analysis_successful': True
             }
@@ -308,20 +756,53 @@ class ShortcutWorkflowAnalyzer:
     
     def analyze_stories(self, story_ids: List[str]) -> List[Dict[str, Any]]:
         """
-        Analyze multiple stories.
+        Analyze multiple stories, up to `max_workers` at a time.
         
         Args:
             story_ids: List of story IDs to analyze
             
         Returns:
-            List of analysis results
+            List of analysis results, in the same order as story_ids
         """
-        results = []
-        
-        for story_id in story_ids:
-            result = self.analyze_story(story_id)
-            results.append(result)
-        
+        return self._analyze((story_id, None) for story_id in story_ids)
+
+    def analyze_query(self, query: str) -> List[Dict[str, Any]]:
+        """
+        Analyze the stories a search query finds, up to `max_workers` at a time.
+
+        The search results carry the story details, so only the stories'
+        histories are fetched, and stories are analyzed as soon as their
+        page of results arrives.
+
+        Args:
+            query: A Shortcut search query, e.g. "team:Mobile is:done"
+
+        Returns:
+            List of analysis results, in the order the search returned the stories
+        """
+        return self._analyze((str(story['id']), story) for story in self.search_stories(query))
+
+    def _analyze(self, stories: Iterable[Tuple[str, Optional[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        """
+        Analyze (story ID, story details) pairs, consuming them as they come.
+
+        The stories are fetched concurrently, then their time in states is
+        computed for all of them at once.
+
+        Returns:
+            List of analysis results, in the same order as the stories
+        """
+        # Fetch the workflow states up front, rather than from every worker at once
+        self.workflow_states()
+
+        if self.max_workers == 1:
+            results = [self.collect_story(story_id, details) for story_id, details in stories]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(self.collect_story, story_id, details)
+                           for story_id, details in stories]
+                results = [future.result() for future in futures]
+        self.compute_batch(results)
         return results
     
     def export_to_csv(self, results: List[Dict[str, Any]], filename: str = None) -> str:
@@ -341,6 +822,7 @@ class ShortcutWorkflowAnalyzer:
 
         # Create CSV in current directory
         csv_path = filename
+        states = self.workflow_states()
         
         with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
             fieldnames = ['StoryID', 'StoryName', 'StoryType', 'CurrentState', 'State', 'HoursSpent']
@@ -352,17 +834,12 @@ class ShortcutWorkflowAnalyzer:
                     story_id = result['story_id']
                     story_name = result['story_name']
                     story_type = result['story_type']
-                    current_state = result['current_state']
-                    state_map = result.get('state_map', {})
-                    state_order = result.get('state_order', {})
+                    current_state = states.names.get(result['current_state_id'], 'Unknown')
 
                     # Sort state IDs by their workflow order
-                    sorted_state_ids = sorted(result['time_in_states'].keys(),
-                                            key=lambda sid: state_order.get(sid, 999))
-
-                    for state_id in sorted_state_ids:
+                    for state_id in states.sorted_ids(result['time_in_states']):
                         hours = result['time_in_states'][state_id]
-                        state_name = state_map.get(state_id, f"Unknown State ({state_id})")
+                        state_name = states.name(state_id)
                         writer.writerow({
                             'StoryID': story_id,
                             'StoryName': story_name,
@@ -407,33 +884,40 @@ class ShortcutWorkflowAnalyzer:
         
         print("\nDetailed Results:")
         print("-" * 80)
+
+        states = self.workflow_states()
         
         for result in successful:
+            current_state = states.names.get(result['current_state_id'], 'Unknown')
             print(f"\nStory {result['story_id']}: {result['story_name']}")
-            print(f"Type: {result['story_type']} | Current State: {result['current_state']}")
+            print(f"Type: {result['story_type']} | Current State: {current_state}")
             print(f"Workflow changes: {result['total_changes']}")
             
             if result['time_in_states']:
                 print("Time in states:")
-                total_hours = sum(result['time_in_states'].values())
+                total_hours = result['total_hours']
 
                 # Sort states by workflow order
-                state_map = result.get('state_map', {})
-                state_order = result.get('state_order', {})
-
-                # Sort state IDs by their workflow order
-                sorted_state_ids = sorted(result['time_in_states'].keys(),
-                                        key=lambda sid: state_order.get(sid, 999))
-
-                for state_id in sorted_state_ids:
+                for state_id in states.sorted_ids(result['time_in_states']):
                     hours = result['time_in_states'][state_id]
-                    state_name = state_map.get(state_id, f"Unknown State ({state_id})")
+                    state_name = states.name(state_id)
                     percentage = (hours / total_hours * 100) if total_hours > 0 else 0
                     print(f"  - {state_name}: {hours:.2f} hours ({percentage:.1f}%)")
                 print(f"Total time tracked: {total_hours:.2f} hours")
             else:
                 print("No workflow state changes found.")
 
+        time_in_states = self.time_in_states
+        if time_in_states and time_in_states.state_totals:
+            print("\nTime in states across all stories (hours):")
+            print(f"  {'State':<30}{'Stories':>8}{'Total':>12}"
+                  + "".join(f"{f'p{q}':>10}" for q in PERCENTILES))
+            for state_id in states.sorted_ids(time_in_states.state_totals):
+                percentiles = time_in_states.state_percentiles[state_id]
+                print(f"  {states.name(state_id)[:29]:<30}{time_in_states.state_story_counts[state_id]:>8}"
+                      f"{time_in_states.state_totals[state_id]:>12.2f}"
+                      + "".join(f"{percentiles[q]:>10.2f}" for q in PERCENTILES))
+
 
 def read_story_ids_from_csv(csv_file_path: str) -> List[str]:
     """
@@ -527,30 +1011,47 @@ def main():
     parser.add_argument('--input-csv', metavar='FILE',
                        help='CSV file containing story IDs. If single column, that column is used; '
                             'if multiple columns, expects "storyid" or "story_id" column (case-insensitive)')
+    parser.add_argument('--query', metavar='QUERY',
+                       help='Analyze the stories found by a Shortcut search query, e.g. "team:Mobile is:done"')
     parser.add_argument('--csv', help='Output CSV filename (optional)')
     parser.add_argument('--verbose', '-v', action='store_true',
                        help='Show detailed results for each story (default: show summary only)')
     parser.add_argument('--include-done-states', action='store_true',
                        help='Include time spent in "done" type workflow states (default: excluded)')
+    parser.add_argument('--refresh', action='store_true',
+                       help='Revalidate cached workspace metadata, such as workflows (default: cached for a day)')
+    parser.add_argument('--no-history-cache', action='store_true',
+                       help='Fetch every story history from the API rather than reusing the histories '
+                            'of stories that have not been updated since the last run')
+    parser.add_argument('--workers', type=int, default=8,
+                       help='Number of stories to analyze concurrently (default: 8); '
+                            'requests stay within the API rate limit either way')
 
     args = parser.parse_args()
 
-    # Validate input: either story_ids or --input-csv, but not both
-    if args.input_csv and args.story_ids:
-        parser.error("Cannot specify both story IDs as arguments and --input-csv. Use one or the other.")
+    # Validate input: exactly one of story_ids, --input-csv, or --query
+    inputs = [bool(args.story_ids), bool(args.input_csv), bool(args.query)]
+    if sum(inputs) > 1:
+        parser.error("Specify only one of story IDs as arguments, --input-csv, or --query.")
 
-    if not args.input_csv and not args.story_ids:
-        parser.error("Must specify either story IDs as arguments or --input-csv")
+    if not any(inputs):
+        parser.error("Must specify either story IDs as arguments, --input-csv, or --query")
 
     try:
-        # Get story IDs from either command line or CSV file
-        if args.input_csv:
-            story_ids = read_story_ids_from_csv(args.input_csv)
+        analyzer = ShortcutWorkflowAnalyzer(include_done_states=args.include_done_states,
+                                            refresh=args.refresh,
+                                            max_workers=args.workers,
+                                            history_cache=not args.no_history_cache)
+
+        # Get stories from the command line, a CSV file, or a search
+        if args.query:
+            results = analyzer.analyze_query(args.query)
         else:
-            story_ids = args.story_ids
-
-        analyzer = ShortcutWorkflowAnalyzer(include_done_states=args.include_done_states)
-        results = analyzer.analyze_stories(story_ids)
+            if args.input_csv:
+                story_ids = read_story_ids_from_csv(args.input_csv)
+            else:
+                story_ids = args.story_ids
+            results = analyzer.analyze_stories(story_ids)
 
         # Show detailed output if verbose flag is set
         if args.verbose:
@@ -561,6 +1062,11 @@ def main():
             failed = [r for r in results if not r.get('analysis_successful')]
             print(f"\nProcessed {len(results)} stories ({len(successful)} successful, {len(failed)} failed)")
 
+        if analyzer.history_cache is not None:
+            cache = analyzer.history_cache
+            print(f"Story histories: {cache.hits} unchanged since the last run, {cache.misses} fetched")
+            cache.close()
+
         # Export to CSV
         csv_file = analyzer.export_to_csv(results, args.csv)
         print(f"Results exported to: {csv_file}")
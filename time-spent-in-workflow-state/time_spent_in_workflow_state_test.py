@@ -0,0 +1,209 @@
+import importlib.util
+import json
+import os
+from datetime import datetime, timezone
+
+import pytest
+import requests
+
+# The script's file name isn't a valid module name, so it is loaded by path
+spec = importlib.util.spec_from_file_location(
+    'time_spent_in_workflow_state',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'time-spent-in-workflow-state.py'))
+ts = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(ts)
+
+NOW = datetime(2024, 3, 25, 12, 0, 0, tzinfo=timezone.utc)
+
+
+def change(to_state_id, timestamp):
+    return {'to_state_id': to_state_id, 'timestamp': timestamp}
+
+
+STORIES_CHANGES = [
+    [],
+    # a single transition counts until now
+    [change(1, '2024-03-25T10:00:00Z')],
+    [change(1, '2024-03-24T12:00:00Z'), change(2, '2024-03-25T00:00:00Z'),
+     change(1, '2024-03-25T06:00:00Z'), change(3, '2024-03-25T09:00:00.000Z')],
+    [change(2, '2024-03-20T12:00:00Z'), change(3, None)],
+]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error", response=self)
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.urls = []
+        self.headers = []
+
+    def get(self, url, headers=None):
+        self.urls.append(url)
+        self.headers.append(headers)
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def analyzer(tmp_path, monkeypatch):
+    monkeypatch.setenv('SHORTCUT_API_TOKEN', 'test-token')
+    monkeypatch.setenv('SHORTCUT_API_BASE_URL', 'https://api.example.com')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    analyzer = ts.ShortcutWorkflowAnalyzer()
+    clock = FakeClock()
+    analyzer.limiter = ts.RateLimiter(analyzer.REQUESTS_PER_MINUTE, clock=clock, sleep=clock.sleep)
+    return analyzer
+
+
+def test_fetch_cached(analyzer, monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(ts.time, 'time', lambda: now)
+    workflows = [{'id': 1, 'states': []}]
+    analyzer.session = FakeSession([
+        FakeResponse(200, workflows, {'ETag': '"v1"'}),
+        FakeResponse(304),
+        FakeResponse(200, [], {'ETag': '"v2"'}),
+    ])
+    assert workflows == analyzer.fetch_cached('/workflows')
+    # fresh entries are served without a request
+    now += analyzer.METADATA_CACHE_TTL_SECONDS - 1
+    assert workflows == analyzer.fetch_cached('/workflows')
+    assert 1 == len(analyzer.session.urls)
+
+    # expired entries are revalidated with their ETag
+    now += 2
+    assert workflows == analyzer.fetch_cached('/workflows')
+    assert '"v1"' == analyzer.session.headers[1]['If-None-Match']
+    assert workflows == analyzer.fetch_cached('/workflows')
+    assert 2 == len(analyzer.session.urls)
+
+    # refreshing (--refresh) revalidates even fresh entries
+    analyzer.refresh = True
+    assert [] == analyzer.fetch_cached('/workflows')
+    assert 3 == len(analyzer.session.urls)
+
+
+def test_fetch_cached_ignores_invalid_entries(analyzer):
+    analyzer.session = FakeSession([FakeResponse(200, []) for _ in range(3)])
+    assert [] == analyzer.fetch_cached('/workflows')
+    (cache_file,) = [os.path.join(analyzer.metadata_cache_dir, name)
+                     for name in os.listdir(analyzer.metadata_cache_dir) if name.endswith('.json')]
+    # e.g. written by an older version, or only partly
+    for entry in [{'body': []}, {'fetched_at': 0}]:
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        assert [] == analyzer.fetch_cached('/workflows')
+    assert 3 == len(analyzer.session.urls)
+
+
+def test_compute_time_in_states_python():
+    result = ts._compute_time_in_states_python(STORIES_CHANGES, frozenset({3}), NOW.timestamp())
+    assert [{}, {1: 2.0}, {1: 15.0, 2: 6.0}, {2: 120.0}] == result.story_hours
+    assert [0.0, 2.0, 21.0, 120.0] == result.story_totals
+    assert {1: 2, 2: 2} == result.state_story_counts
+    assert {1: 17.0, 2: 126.0} == result.state_totals
+    assert {50: 8.5, 85: 13.05, 95: 14.35} == pytest.approx(result.state_percentiles[1])
+
+
+def test_compute_time_in_states_empty():
+    for compute in [ts._compute_time_in_states_python, ts._compute_time_in_states_numpy]:
+        if compute is ts._compute_time_in_states_numpy and ts.np is None:
+            continue
+        result = compute([], frozenset(), NOW.timestamp())
+        assert ([], [], {}, {}, {}) == tuple(result)
+        result = compute([[]], frozenset(), NOW.timestamp())
+        assert ([{}], [0.0], {}, {}, {}) == tuple(result)
+
+
+def test_compute_time_in_states_numpy_matches_python():
+    pytest.importorskip('numpy')
+    for stories_changes in [STORIES_CHANGES, STORIES_CHANGES[1:2], []]:
+        for skip_state_ids in [frozenset(), frozenset({3})]:
+            expected = ts._compute_time_in_states_python(stories_changes, skip_state_ids, NOW.timestamp())
+            actual = ts._compute_time_in_states_numpy(stories_changes, skip_state_ids, NOW.timestamp())
+            assert expected.story_totals == pytest.approx(actual.story_totals)
+            assert len(expected.story_hours) == len(actual.story_hours)
+            for expected_hours, actual_hours in zip(expected.story_hours, actual.story_hours):
+                assert expected_hours == pytest.approx(actual_hours)
+            assert expected.state_story_counts == actual.state_story_counts
+            assert expected.state_totals == pytest.approx(actual.state_totals)
+            assert expected.state_percentiles.keys() == actual.state_percentiles.keys()
+            for state_id, percentiles in expected.state_percentiles.items():
+                assert percentiles == pytest.approx(actual.state_percentiles[state_id])
+
+
+def test_rate_limiter_spaces_requests():
+    clock = FakeClock()
+    limiter = ts.RateLimiter(120, clock=clock, sleep=clock.sleep)
+    for _ in range(3):
+        limiter.acquire()
+    assert [0.5, 0.5] == clock.sleeps
+
+    limiter.pause(10)
+    limiter.acquire()
+    assert 10.0 == clock.sleeps[-1]
+
+
+def test_get_retries_throttled_requests(analyzer):
+    analyzer.session = FakeSession([FakeResponse(429, headers={'Retry-After': '3'}), FakeResponse(200, {})])
+    assert 200 == analyzer._get('https://api.example.com/api/v3/stories/1').status_code
+    assert 2 == len(analyzer.session.urls)
+    assert 3.0 in analyzer.limiter.clock.sleeps
+
+
+def test_workflow_states_are_fetched_once(analyzer):
+    workflows = [{'states': [{'id': 2, 'name': 'Done', 'type': 'done'},
+                             {'id': 1, 'name': 'To Do', 'type': 'unstarted'}]}]
+    analyzer.session = FakeSession([FakeResponse(200, workflows)])
+    states = analyzer.workflow_states()
+    assert states is analyzer.workflow_states()
+    assert 1 == len(analyzer.session.urls)
+    assert 'To Do' == states.name(1)
+    assert 'Unknown State (3)' == states.name(3)
+    assert [2, 1, 3] == states.sorted_ids([3, 1, 2])
+
+
+def test_search_stories_follows_pages(analyzer):
+    analyzer.session = FakeSession([
+        FakeResponse(200, {'data': [{'id': 1}, {'id': 2}], 'next': '/api/v3/search/stories?next=abc'}),
+        FakeResponse(200, {'data': [{'id': 3}], 'next': None}),
+    ])
+    assert [1, 2, 3] == [story['id'] for story in analyzer.search_stories('team:Mobile')]
+    assert 'https://api.example.com/api/v3/search/stories?next=abc' == analyzer.session.urls[1]
+
+
+def test_story_history_cache(tmp_path):
+    cache = ts.StoryHistoryCache(str(tmp_path / 'cache' / 'story-history.sqlite3'))
+    history = [{'id': 'a', 'changed_at': '2024-03-25T10:00:00Z'}]
+    assert cache.get('1', '2024-03-25T10:00:00Z') is None
+    cache.put('1', '2024-03-25T10:00:00Z', history)
+    assert history == cache.get('1', '2024-03-25T10:00:00Z')
+    # a story updated since is fetched again
+    assert cache.get('1', '2024-03-25T11:00:00Z') is None
+    assert (1, 2) == (cache.hits, cache.misses)
+    cache.close()
@@ -49,7 +49,8 @@ def print_rate_limiting_explanation():
 
 # API Helpers
 sc_token = os.getenv("SHORTCUT_API_TOKEN")
-api_url_base = "https://api.app.shortcut.com/api/v3"
+sc_host = os.getenv("SHORTCUT_API_BASE_URL", "https://api.app.shortcut.com").rstrip("/")
+api_url_base = f"{sc_host}/api/v3"
 headers = {
     "Shortcut-Token": sc_token,
     "Accept": "application/json; charset=utf-8",
@@ -50,7 +50,8 @@ def print_rate_limiting_explanation():
 # API Helpers
 sc_token = os.getenv("SHORTCUT_API_TOKEN")
 sc_workspace = os.getenv("SHORTCUT_WORKSPACE_SLUG")
-api_url_base = f"https://api.app.shortcut.com/api/v4/{sc_workspace}"
+sc_host = os.getenv("SHORTCUT_API_BASE_URL", "https://api.app.shortcut.com").rstrip("/")
+api_url_base = f"{sc_host}/api/v4/{sc_workspace}"
 headers = {
     "Authorization": f"Bearer {sc_token}",
     "Accept": "application/json; charset=utf-8",